@@ -0,0 +1,83 @@
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+from typing import List
+
+sys.path.insert(0, f"{os.environ['UCOMP_DEVROOT']}/tools")
+
+from asm import Assembler, Assembly
+
+
+REGISTERS: List[str] = [f"r{i}" for i in range(13)]
+DST_SRC: List[str] = ['mov', 'add', 'sub', 'and', 'or', 'xor', 'cmp', 'mul', 'div', 'sdiv', 'mod', 'smod',
+                      'shl', 'shr', 'sar']
+JUMPS: List[str] = ['jmp', 'jmpz', 'jmpnz', 'jmpeq', 'jmpne', 'jmpgt', 'jmplt', 'jmpge', 'jmple']
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark the VM assembler.')
+    parser.add_argument('-n', '--lines', metavar='N', type=int, dest='lines', \
+                        required=False, default=2000000, \
+                        help='the number of lines to generate and assemble; defaults to 2000000')
+    parser.add_argument('-r', '--repeat', metavar='N', type=int, dest='repeat', \
+                        required=False, default=3, \
+                        help='assemble the source N times, keeping the fastest run; defaults to 3')
+    parser.add_argument('-s', '--seed', metavar='SEED', type=int, dest='seed', \
+                        required=False, default=1, \
+                        help='seed of the generated source; defaults to 1')
+    return parser.parse_args()
+
+
+def generate(lines: int, seed: int) -> str:
+    # Whole functions of 50 lines, up to at least the given number of lines, each a mix of every operand form,
+    # local jumps and calls to the previous function, written the way the code generators write them.
+    rng = random.Random(seed)
+    source: List[str] = []
+    function: int = 0
+    while len(source) < lines:
+        source.append(f"f{function}:")
+        for block in range(6):
+            source.append(f"    .b{block}:")
+            for _ in range(7):
+                r, s = rng.choice(REGISTERS), rng.choice(REGISTERS)
+                match rng.randrange(8):
+                    case 0:
+                        source.append(f"    {rng.choice(DST_SRC)} {r}, {s}")
+                    case 1:
+                        source.append(f"    {rng.choice(DST_SRC)} {r}, {rng.randrange(1 << 32)}")
+                    case 2:
+                        source.append(f"    {rng.choice(DST_SRC)} {r}, {rng.randrange(1 << 32):#x}    ; hex")
+                    case 3:
+                        source.append(f"    load {r}, [{s}+{rng.randrange(256)}]")
+                    case 4:
+                        source.append(f"    store [{r}+{s}*4], {rng.choice(REGISTERS)}")
+                    case 5:
+                        source.append(f"    {rng.choice(['push', 'pop', 'not'])} {r}")
+                    case 6:
+                        source.append(f"    {rng.choice(JUMPS)} .b{rng.randrange(6)}")
+                    case _:
+                        source.append(f"    call f{max(function - 1, 0)}")
+        source.append("    ret")
+        function += 1
+    return '\n'.join(source) + '\n'
+
+
+def run_benchmark():
+    args: argparse.Namespace = parse_args()
+
+    source: str = generate(args.lines, args.seed)
+    lines: int = source.count('\n')
+    best: float = float('inf')
+    for _ in range(args.repeat):
+        start: float = time.perf_counter()
+        assembly: Assembly = Assembler().assemble(io.StringIO(source))
+        best = min(best, time.perf_counter() - start)
+
+    print(f"{lines} lines, {len(assembly.image())} bytes in {best:.2f} s: {lines / best:,.0f} lines/s")
+
+
+run_benchmark()
@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+sys.path.insert(0, f"{os.environ['UCOMP_DEVROOT']}/tests/bin")
+sys.path.insert(0, f"{os.environ['UCOMP_DEVROOT']}/tools")
+
+from utils import *
+from vm import ExecType, OutputType, Program, Status, VM, load_program
+
+
+RESULTS_VERSION: int = 1
+
+
+@dataclass
+class Result:
+    instrs: int
+    seconds: float
+    mips: float
+
+
+# workload -> execution type -> result
+Results = Dict[str, Dict[str, Result]]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark the VM.')
+    parser.add_argument('--root', metavar='ROOT', type=str, dest='root_dir', \
+                        required=False, default='bench', \
+                        help='root directory for in/*.asm and ref/*.stdout')
+    parser.add_argument('-w', '--workload', metavar='NAME', type=str, dest='workloads', \
+                        required=False, action='append', \
+                        help='run only the given workload; may be given more than once')
+    parser.add_argument('-e', '--execution-type', metavar='EXEC_TYPE', dest='exec_types', \
+                        required=False, action='append', choices=[e.name for e in ExecType], \
+                        help='run on the given execution type only; may be given more than once; defaults to all')
+    parser.add_argument('-O', '--optimize', dest='optimize', \
+                        required=False, action='store_true', \
+                        help='assemble the workloads with asm.py -O')
+    parser.add_argument('-r', '--repeat', metavar='N', type=int, dest='repeat', \
+                        required=False, default=3, \
+                        help='run each workload N times, keeping the fastest run; defaults to 3')
+    parser.add_argument('-o', '--output', metavar='JSON', type=str, dest='output_file', \
+                        required=False, \
+                        help='file to save the results to, as a baseline for later runs')
+    parser.add_argument('-b', '--baseline', metavar='JSON', type=str, dest='baseline_file', \
+                        required=False, \
+                        help='results saved by an earlier run, with -o, to compare against')
+    parser.add_argument('-t', '--threshold', metavar='PERCENT', type=float, dest='threshold', \
+                        required=False, default=10.0, \
+                        help='how much slower than the baseline, in MIPS, counts as a regression; defaults to 10')
+    return parser.parse_args()
+
+
+def build(name: str, in_asm: str, out_img: str, out_so: str, exec_types: List[ExecType], optimize: bool) -> bool:
+    if not execute(f"python3 $UCOMP_DEVROOT/tools/asm.py {'-O' if optimize else ''} -o {out_img} {in_asm}"):
+        print_red(f"{name}: cannot assemble")
+        return False
+    if ExecType.AOT in exec_types and not execute(f"python3 $UCOMP_DEVROOT/tools/aot.py -o {out_so} {out_img}"):
+        print_red(f"{name}: cannot translate")
+        return False
+    return True
+
+
+def measure(program: Program, exec_type: ExecType, native_lib: str, ref_stdout: bytes, repeat: int) -> Optional[Result]:
+    # Loading, and so resetting memory, is left out of the time; the first run warms the caches up as any other.
+    with VM(exec_type=exec_type, output=OutputType.BUFFER,
+            native_lib=native_lib if exec_type == ExecType.AOT else None) as vm:
+        best: Optional[Result] = None
+        for _ in range(repeat):
+            vm.load(program)
+            start: float = time.perf_counter()
+            status: Status = vm.run()
+            seconds: float = time.perf_counter() - start
+            if status != Status.EXITED or vm.output() != ref_stdout:
+                return None
+            if best is None or seconds < best.seconds:
+                best = Result(vm.retired(), seconds, vm.retired() / seconds / 1e6)
+        return best
+
+
+def load_results(file_name: str) -> Results:
+    with open(file_name, mode='r', encoding='utf-8') as file:
+        data = json.load(file)
+    if data.get('version') != RESULTS_VERSION:
+        sys.exit(f"'{file_name}' holds no benchmark results.")
+    return {name: {exec_type: Result(**result) for exec_type, result in per_type.items()}
+            for name, per_type in data['results'].items()}
+
+
+def save_results(file_name: str, results: Results):
+    data = {
+        'version': RESULTS_VERSION,
+        'results': {name: {exec_type: asdict(result) for exec_type, result in per_type.items()}
+                    for name, per_type in results.items()},
+    }
+    with open(file_name, mode='w', encoding='utf-8') as file:
+        json.dump(data, file, indent=4)
+        print(file=file)
+
+
+def report(name: str, exec_type: ExecType, result: Result, baseline: Optional[Result], threshold: float) -> bool:
+    line: str = f"{name:<12} {exec_type.name.lower():<12} {result.instrs:>12} {result.seconds * 1e3:>10.1f} ms" \
+                f" {result.mips:>10.1f} MIPS"
+    if baseline is None:
+        print(line)
+        return True
+    change: float = (result.mips / baseline.mips - 1) * 100
+    line += f" {change:>+8.1f}%"
+    if change < -threshold:
+        print_red(line)
+        return False
+    print_green(line)
+    return True
+
+
+def run_benchmarks():
+    args: argparse.Namespace = parse_args()
+
+    in_dir: str                             = f"{args.root_dir}/in"
+    ref_dir: str                            = f"{args.root_dir}/ref"
+    out_dir: str                            = create_tmpdir('bench-')
+
+    exec_types: List[ExecType]              = [ExecType[e] for e in args.exec_types] if args.exec_types else list(ExecType)
+    names: List[str]                        = sorted([f"{file.rpartition('.')[0]}" for file in list_files(in_dir, '.asm')])
+    if args.workloads:
+        unknown: List[str] = [name for name in args.workloads if name not in names]
+        if unknown:
+            sys.exit(f"Unknown workload(s): {', '.join(unknown)}.")
+        names = [name for name in names if name in args.workloads]
+    baseline: Results = load_results(args.baseline_file) if args.baseline_file is not None else {}
+
+    results: Results = {}
+    ok: bool = True
+    print_green(f"{'workload':<12} {'exec type':<12} {'instrs':>12} {'time':>13} {'speed':>15}")
+    for name in names:
+        out_img: str = f"{out_dir}/{name}.img"
+        out_so: str = f"{out_dir}/{name}.so"
+        if not build(name, f"{in_dir}/{name}.asm", out_img, out_so, exec_types, args.optimize):
+            ok = False
+            continue
+        program: Program = load_program(out_img)
+        with open(f"{ref_dir}/{name}.stdout", mode='rb') as ref_file:
+            ref_stdout: bytes = ref_file.read()
+        results[name] = {}
+        for exec_type in exec_types:
+            result: Optional[Result] = measure(program, exec_type, out_so, ref_stdout, args.repeat)
+            if result is None:
+                print_red(f"{name:<12} {exec_type.name.lower():<12} failed")
+                ok = False
+                continue
+            results[name][exec_type.name] = result
+            ok &= report(name, exec_type, result, baseline.get(name, {}).get(exec_type.name), args.threshold)
+
+    remove_dir(out_dir)
+
+    if args.output_file is not None:
+        save_results(args.output_file, results)
+    if not ok:
+        sys.exit(1)
+
+
+run_benchmarks()
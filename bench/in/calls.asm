@@ -0,0 +1,63 @@
+;
+; Sum up 0 + 1 + ... + 59999 plus one per term, through two levels of small functions:
+;
+;     add(x, y) { return x + y; }
+;     sum3(a, b, c) { return add(add(a, b), c); }
+;
+;     for (i = 0; i < 60000; i++)
+;         s = sum3(s, i, 1);
+;
+
+main:
+    mov r9, 0
+    mov r10, 0
+
+.loop:
+    mov r0, 1
+    push r0
+    push r10
+    push r9
+    call sum3
+    pop r9
+
+    add r10, 1
+    cmp r10, 60000
+    jmplt .loop
+
+    push r9
+    mov r0, 1
+    push r0
+    call $sys_enter
+
+    add sp, 8
+
+    mov r0, 0
+    push r0
+    call $sys_enter
+
+; the result takes the place of the last parameter, the return address that of the one before it
+sum3:
+    load r0, [sp+4]
+    load r1, [sp+8]
+    push r1
+    push r0
+    call add
+    load r1, [sp+16]
+    push r1
+    call add
+    pop r0
+    store [sp+12], r0
+    load r12, [sp]
+    store [sp+8], r12
+    add sp, 8
+    ret
+
+add:
+    load r0, [sp+4]
+    load r1, [sp+8]
+    add r0, r1
+    store [sp+8], r0
+    load r12, [sp]
+    store [sp+4], r12
+    add sp, 4
+    ret
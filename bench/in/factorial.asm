@@ -0,0 +1,51 @@
+;
+; Compute 12!, recursively, 50000 times over:
+;
+;     factorial(n) {
+;         if (n <= 1)
+;             return 1;
+;         return n * factorial(n-1);
+;     }
+;
+
+main:
+    mov r10, 50000
+
+.again:
+    mov r0, 12
+    push r0
+    call factorial
+    pop r9
+
+    sub r10, 1
+    cmp r10, 0
+    jmpnz .again
+
+    push r9
+    mov r0, 1
+    push r0
+    call $sys_enter
+
+    add sp, 8
+
+    mov r0, 0
+    push r0
+    call $sys_enter
+
+factorial:
+    load r0, [sp+4]
+    cmp r0, 1
+    jmpgt .recurse
+    mov r0, 1
+    store [sp+4], r0
+    ret
+
+.recurse:
+    sub r0, 1
+    push r0
+    call factorial
+    pop r1
+    load r0, [sp+4]
+    mul r0, r1
+    store [sp+4], r0
+    ret
@@ -0,0 +1,47 @@
+;
+; Compute the 25th Fibonacci number, recursively:
+;
+;     fibonacci(n) {
+;         if (n <= 1)
+;             return n;
+;         return fibonacci(n-2) + fibonacci(n-1);
+;     }
+;
+
+main:
+    mov r0, 25
+    push r0
+    call fibonacci
+
+    mov r0, 1
+    push r0
+    call $sys_enter
+
+    add sp, 8
+
+    mov r0, 0
+    push r0
+    call $sys_enter
+
+fibonacci:
+    load r0, [sp+4]
+    cmp r0, 1
+    jmple .return
+
+    sub r0, 1
+    push r0
+    sub r0, 1
+    push r0
+    call fibonacci
+    pop r1
+    pop r0
+    push r1
+    push r0
+    call fibonacci
+    pop r0
+    pop r1
+    add r0, r1
+
+.return:
+    store [sp+4], r0
+    ret
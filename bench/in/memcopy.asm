@@ -0,0 +1,51 @@
+;
+; Copy 64 KiB, a word at a time, 40 times over, then display a checksum of the copy, all of its words
+; XORed together.
+;
+
+main:
+    mov r0, 1048576
+    mov r1, 2097152
+
+    ; src[i] = i * i
+    mov r2, 0
+.fill:
+    mov r3, r2
+    mul r3, r2
+    store [r0+r2*4], r3
+    add r2, 1
+    cmp r2, 16384
+    jmplt .fill
+
+    mov r10, 40
+.pass:
+    mov r2, 0
+.copy:
+    load r3, [r0+r2]
+    store [r1+r2], r3
+    add r2, 4
+    cmp r2, 65536
+    jmplt .copy
+    sub r10, 1
+    cmp r10, 0
+    jmpnz .pass
+
+    mov r4, 0
+    mov r2, 0
+.checksum:
+    load r3, [r1+r2]
+    xor r4, r3
+    add r2, 4
+    cmp r2, 65536
+    jmplt .checksum
+
+    push r4
+    mov r0, 1
+    push r0
+    call $sys_enter
+
+    add sp, 8
+
+    mov r0, 0
+    push r0
+    call $sys_enter
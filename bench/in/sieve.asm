@@ -0,0 +1,78 @@
+;
+; Count the primes below 300000, 3 times over, with the sieve of Eratosthenes, one byte per number:
+;
+;     for (i = 2; i * i < N; i++)
+;         if (!composite[i])
+;             for (j = i * i; j < N; j += i)
+;                 composite[j] = 1;
+;
+
+main:
+    mov r10, 3
+
+.pass:
+    ; composite[] = {0}, a word at a time
+    mov r0, 1048576
+    mov r1, 0
+    mov r2, 0
+.clear:
+    store [r0+r1], r2
+    add r1, 4
+    cmp r1, 300000
+    jmplt .clear
+
+    mov r7, 1
+    mov r1, 2
+.outer:
+    mov r3, r1
+    mul r3, r1
+    cmp r3, 300000
+    jmpge .count
+    mov r5, r0
+    add r5, r1
+    loadb r4, [r5]
+    cmp r4, 0
+    jmpnz .next
+    mov r5, r0
+    add r5, r3
+    mov r6, r0
+    add r6, 300000
+.inner:
+    storeb [r5], r7
+    add r5, r1
+    cmp r5, r6
+    jmplt .inner
+.next:
+    add r1, 1
+    jmp .outer
+
+.count:
+    mov r8, 0
+    mov r5, r0
+    add r5, 2
+    mov r6, r0
+    add r6, 300000
+.count_loop:
+    loadb r4, [r5]
+    cmp r4, 0
+    jmpnz .composite
+    add r8, 1
+.composite:
+    add r5, 1
+    cmp r5, r6
+    jmplt .count_loop
+
+    sub r10, 1
+    cmp r10, 0
+    jmpnz .pass
+
+    push r8
+    mov r0, 1
+    push r0
+    call $sys_enter
+
+    add sp, 8
+
+    mov r0, 0
+    push r0
+    call $sys_enter
@@ -0,0 +1,88 @@
+;
+; Sort 1500 pseudo-random words, as unsigned, by insertion, then count the pairs left out of order
+; and display them along with the smallest and the largest word:
+;
+;     for (i = 1; i < N; i++) {
+;         key = a[i];
+;         for (j = i; j > 0 && a[j-1] > key; j--)
+;             a[j] = a[j-1];
+;         a[j] = key;
+;     }
+;
+
+main:
+    mov r0, 1048576
+
+    ; a[i] = x = x * 1103515245 + 12345
+    mov r1, 0
+    mov r2, 1
+.fill:
+    mul r2, 1103515245
+    add r2, 12345
+    store [r0+r1*4], r2
+    add r1, 1
+    cmp r1, 1500
+    jmplt .fill
+
+    mov r1, 1
+.outer:
+    cmp r1, 1500
+    jmpge .check
+    load r2, [r0+r1*4]
+    mov r3, r1
+.inner:
+    cmp r3, 0
+    jmpeq .insert
+    mov r4, r3
+    sub r4, 1
+    load r5, [r0+r4*4]
+    cmp r5, r2
+    jmple .insert
+    store [r0+r3*4], r5
+    mov r3, r4
+    jmp .inner
+.insert:
+    store [r0+r3*4], r2
+    add r1, 1
+    jmp .outer
+
+.check:
+    mov r6, 0
+    mov r1, 1
+.check_loop:
+    mov r4, r1
+    sub r4, 1
+    load r5, [r0+r4*4]
+    load r2, [r0+r1*4]
+    cmp r5, r2
+    jmple .ordered
+    add r6, 1
+.ordered:
+    add r1, 1
+    cmp r1, 1500
+    jmplt .check_loop
+
+    push r6
+    call display
+    load r6, [r0]
+    push r6
+    call display
+    load r6, [r0+5996]
+    push r6
+    call display
+
+    mov r0, 0
+    push r0
+    call $sys_enter
+
+display:
+    load r12, [sp]
+    load r11, [sp+4]
+    store [sp+4], r12
+    add sp, 4
+    push r11
+    mov r11, 1
+    push r11
+    call $sys_enter
+    add sp, 8
+    ret
@@ -0,0 +1,15 @@
+import os
+import sys
+
+sys.path.insert(0, f"{os.environ['UCOMP_DEVROOT']}/tools")
+
+from vm import VM, ExecType, OutputType, Status
+
+
+# retired.py EXEC_TYPE SO IMG: print the instructions retired by running IMG on EXEC_TYPE.
+exec_type, native_lib, program = sys.argv[1:]
+with VM(exec_type=ExecType[exec_type], native_lib=native_lib, output=OutputType.BUFFER) as vm:
+    vm.load(program)
+    if vm.run() != Status.EXITED:
+        sys.exit(f"{program} did not exit.")
+    print(vm.retired())
@@ -1,4 +1,5 @@
 import argparse
+import os
 
 from typing import List
 
@@ -9,14 +10,14 @@ def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description='Test the VM assembler.')
     parser.add_argument('--root', metavar='ROOT', type=str, dest='root_dir', \
                         required=False, default='tests', \
-                        help='root directory for in/asm/*.asm and in/ref/asm/*.{hex,lbl}')
+                        help='root directory for in/asm{,opt}/*.asm and in/ref/asm{,opt}/*.{hex,lbl}')
     return parser.parse_args()
 
 
-def execute_test(name: str, in_asm: str, ref_hex: str, ref_lbl: str, out_hex: str, out_lbl: str):
+def execute_test(name: str, in_asm: str, ref_hex: str, ref_lbl: str, out_hex: str, out_lbl: str, asm_args: str = ''):
     print(f"{name}...", end='')
 
-    if not execute(f"python3 $UCOMP_DEVROOT/tools/asm.py -o {out_hex} -l {out_lbl} {in_asm}"):
+    if not execute(f"python3 $UCOMP_DEVROOT/tools/asm.py {asm_args} -x -o {out_hex} -l {out_lbl} {in_asm}"):
         print_red('failed')
         return
     if not (execute(f"diff {ref_hex} {out_hex}") and execute(f"diff {ref_lbl} {out_lbl}")):
@@ -26,6 +27,21 @@ def execute_test(name: str, in_asm: str, ref_hex: str, ref_lbl: str, out_hex: st
     print_green('pass')
 
 
+def execute_batch_test(in_asm_files: List[str], ref_hex_files: List[str], ref_lbl_files: List[str], out_dir: str):
+    print("batch...", end='')
+
+    if not execute(f"python3 $UCOMP_DEVROOT/tools/asm.py -x -o {out_dir} -l {out_dir} {' '.join(in_asm_files)}"):
+        print_red('failed')
+        return
+    for ref_hex, ref_lbl in zip(ref_hex_files, ref_lbl_files):
+        name: str = os.path.basename(ref_hex).rpartition('.')[0]
+        if not (execute(f"diff {ref_hex} {out_dir}/{name}.hex") and execute(f"diff {ref_lbl} {out_dir}/{name}.lbl")):
+            print_red('failed')
+            return
+
+    print_green('pass')
+
+
 def execute_tests():
     args: argparse.Namespace = parse_args()
 
@@ -46,7 +62,20 @@ def execute_tests():
     print_green("*.asm -> *.{hex,lbl}")
     for name, in_asm, ref_hex, ref_lbl, out_hex, out_lbl in tests:
         execute_test(name, in_asm, ref_hex, ref_lbl, out_hex, out_lbl)
-    
+    remove_dir(out_dir)
+
+    out_dir = create_tmpdir('asm2hex-')
+    execute_batch_test(in_asm_files, ref_hex_files, ref_lbl_files, out_dir)
+    remove_dir(out_dir)
+
+    in_dir                                  = f"{args.root_dir}/in/asmopt"
+    ref_dir                                 = f"{args.root_dir}/ref/asmopt"
+    out_dir                                 = create_tmpdir('asm2hex-')
+
+    print_green("*.asm -> (-O) -> *.{hex,lbl}")
+    for name in [f"{file.rpartition('.')[0]}" for file in list_files(in_dir, '.asm')]:
+        execute_test(name, f"{in_dir}/{name}.asm", f"{ref_dir}/{name}.hex", f"{ref_dir}/{name}.lbl",
+                     f"{out_dir}/{name}.hex", f"{out_dir}/{name}.lbl", '-O')
     remove_dir(out_dir)
 
 
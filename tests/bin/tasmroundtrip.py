@@ -13,7 +13,7 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def execute_test(name: str, in_asm: str, ref_sys_enter: str, ref_asm: str, out_hex: str, out_lbl: str, out_asm: str):
+def execute_test(name: str, in_asm: str, ref_sys_enter: str, ref_asm: str, out_img: str, out_asm: str):
     print(f"{name}...", end='')
 
     if not execute(f"cp {ref_sys_enter} {ref_asm}"):
@@ -22,10 +22,11 @@ def execute_test(name: str, in_asm: str, ref_sys_enter: str, ref_asm: str, out_h
     if not execute(f"python3 $UCOMP_DEVROOT/tests/bin/fstrip.py < {in_asm} >> {ref_asm}"):
         print_red('failed')
         return
-    if not execute(f"python3 $UCOMP_DEVROOT/tools/asm.py -o {out_hex} -l {out_lbl} {in_asm}"):
+    # the labels go along with the image
+    if not execute(f"python3 $UCOMP_DEVROOT/tools/asm.py -o {out_img} {in_asm}"):
         print_red('failed')
         return
-    if not execute(f"python3 $UCOMP_DEVROOT/tools/disasm.py -o {out_asm} -l {out_lbl} {out_hex}"):
+    if not execute(f"python3 $UCOMP_DEVROOT/tools/disasm.py -o {out_asm} {out_img}"):
         print_red('failed')
         return
     if not execute(f"diff {ref_asm} {out_asm}"):
@@ -44,19 +45,18 @@ def execute_tests():
 
     names: List[str]                        = [f"{file.rpartition('.')[0]}" for file in list_files(in_dir, '.asm')]
     in_asm_files: List[str]                 = [f"{in_dir}/{name}.asm" for name in names]
-    out_hex_files: List[str]                = [f"{out_dir}/{name}.hex" for name in names]
-    out_lbl_files: List[str]                = [f"{out_dir}/{name}.lbl" for name in names]
+    out_img_files: List[str]                = [f"{out_dir}/{name}.img" for name in names]
     out_asm_files: List[str]                = [f"{out_dir}/{name}.asm" for name in names]
 
     ref_sys_enter: str                      = f"{ref_dir}/sys_enter.asm"
     ref_asm: str                            = f"{out_dir}/ref.asm"
 
-    tests: zip[tuple[str, str, str, str, str]] \
-        = zip(names, in_asm_files, out_hex_files, out_lbl_files, out_asm_files)
+    tests: zip[tuple[str, str, str, str]] \
+        = zip(names, in_asm_files, out_img_files, out_asm_files)
 
-    print_green("*.asm -> *.{hex,lbl} -> *.asm")
-    for name, in_asm, out_hex, out_lbl, out_asm in tests:
-        execute_test(name, in_asm, ref_sys_enter, ref_asm, out_hex, out_lbl, out_asm)
+    print_green("*.asm -> *.img -> *.asm")
+    for name, in_asm, out_img, out_asm in tests:
+        execute_test(name, in_asm, ref_sys_enter, ref_asm, out_img, out_asm)
     
     remove_dir(out_dir)
 
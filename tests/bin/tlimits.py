@@ -0,0 +1,90 @@
+import argparse
+
+from typing import List
+
+from utils import *
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Test the VM limits.')
+    parser.add_argument('--root', metavar='ROOT', type=str, dest='root_dir', \
+                        required=False, default='tests', \
+                        help='root directory for in/vm/*.asm and in/limits/*.asm')
+    return parser.parse_args()
+
+
+EXEC_TYPES: List[str] = ['INTERPRETER', 'PREDECODER', 'JIT', 'AOT']
+
+# (option, what vm.py reports once it stops the program)
+LIMITS: List[tuple[str, str]] = [('--max-instrs 100000', 'ran out of instructions'), ('--timeout 100', 'timed out')]
+
+
+def build(in_asm: str, out_img: str, out_so: str) -> bool:
+    return execute(f"python3 $UCOMP_DEVROOT/tools/asm.py -o {out_img} {in_asm}") \
+       and execute(f"python3 $UCOMP_DEVROOT/tools/aot.py -o {out_so} {out_img}")
+
+
+def execute_retired_test(name: str, in_asm: str, out_img: str, out_so: str, out_retired: str):
+    print(f"{name}...", end='')
+
+    if not build(in_asm, out_img, out_so):
+        print_red('failed')
+        return
+    # Every engine retires as many instructions as the interpreter does.
+    for exec_type in EXEC_TYPES:
+        if not execute(f"source env.sh && python3 $UCOMP_DEVROOT/tests/bin/retired.py {exec_type} {out_so} {out_img} "
+                       f"> {out_retired}.{exec_type.lower()}"):
+            print_red('failed')
+            return
+        if not execute(f"diff {out_retired}.interpreter {out_retired}.{exec_type.lower()}"):
+            print_red('failed')
+            return
+
+    print_green('pass')
+
+
+def execute_limit_test(name: str, exec_type: str, limit: str, reason: str, out_img: str, out_so: str, out_stderr: str):
+    print(f"{name} ({exec_type.lower()}, {limit})...", end='')
+
+    if execute(f"source env.sh && python3 $UCOMP_DEVROOT/tools/vm.py -e {exec_type} -n {out_so} {limit} {out_img} "
+               f"2> {out_stderr}"):
+        print_red('failed')
+        return
+    if not execute(f"grep -q '{out_img} {reason}:' {out_stderr}"):
+        print_red('failed')
+        return
+
+    print_green('pass')
+
+
+def execute_tests():
+    args: argparse.Namespace = parse_args()
+
+    vm_dir: str                             = f"{args.root_dir}/in/vm"
+    in_dir: str                             = f"{args.root_dir}/in/limits"
+    out_dir: str                            = create_tmpdir('limits-')
+
+    names: List[str]                        = [f"{file.rpartition('.')[0]}" for file in list_files(vm_dir, '.asm')]
+    loop_names: List[str]                   = [f"{file.rpartition('.')[0]}" for file in list_files(in_dir, '.asm')]
+
+    print_green("*.asm -> *.retired")
+    for name in names:
+        execute_retired_test(name, f"{vm_dir}/{name}.asm", f"{out_dir}/{name}.img", f"{out_dir}/{name}.so",
+                             f"{out_dir}/{name}.retired")
+
+    print_green("*.asm -> (--max-instrs, --timeout) -> *.stderr")
+    for name in loop_names:
+        out_img: str = f"{out_dir}/{name}.img"
+        out_so: str = f"{out_dir}/{name}.so"
+        if not build(f"{in_dir}/{name}.asm", out_img, out_so):
+            print(f"{name}...", end='')
+            print_red('failed')
+            continue
+        for exec_type in EXEC_TYPES:
+            for limit, reason in LIMITS:
+                execute_limit_test(name, exec_type, limit, reason, out_img, out_so, f"{out_dir}/{name}.stderr")
+
+    remove_dir(out_dir)
+
+
+execute_tests()
@@ -0,0 +1,69 @@
+import argparse
+
+from typing import List
+
+from utils import *
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Test the VM linker.')
+    parser.add_argument('--root', metavar='ROOT', type=str, dest='root_dir', \
+                        required=False, default='tests', \
+                        help='root directory for in/link/*.asm, in/link/lib/*.asm and in/ref/link/*.stdout')
+    return parser.parse_args()
+
+
+def execute_test(name: str, in_asm: str, lib_objs: List[str], ref_stdout: str, out_img: str, out_stdout: str,
+                 cache_dir: str):
+    print(f"{name}...", end='')
+
+    if not execute(f"python3 $UCOMP_DEVROOT/tools/link.py --cache {cache_dir} -o {out_img} {in_asm} {' '.join(lib_objs)}"):
+        print_red('failed')
+        return
+    if not execute(f"source env.sh && python3 $UCOMP_DEVROOT/tools/vm.py {out_img} > {out_stdout}"):
+        print_red('failed')
+        return
+    if not execute(f"diff {ref_stdout} {out_stdout}"):
+        print_red('failed')
+        return
+
+    print_green('pass')
+
+
+def execute_tests():
+    args: argparse.Namespace = parse_args()
+
+    in_dir: str                             = f"{args.root_dir}/in/link"
+    lib_dir: str                            = f"{args.root_dir}/in/link/lib"
+    ref_dir: str                            = f"{args.root_dir}/ref/link"
+    out_dir: str                            = create_tmpdir('link2stdout-')
+    cache_dir: str                          = f"{out_dir}/cache"
+
+    libs: List[str]                         = [f"{file.rpartition('.')[0]}" for file in list_files(lib_dir, '.asm')]
+    lib_asm_files: List[str]                = [f"{lib_dir}/{lib}.asm" for lib in libs]
+    lib_obj_files: List[str]                = [f"{out_dir}/{lib}.obj" for lib in libs]
+
+    names: List[str]                        = [f"{file.rpartition('.')[0]}" for file in list_files(in_dir, '.asm')]
+    in_asm_files: List[str]                 = [f"{in_dir}/{name}.asm" for name in names]
+    ref_stdout_files: List[str]             = [f"{ref_dir}/{name}.stdout" for name in names]
+    out_img_files: List[str]                = [f"{out_dir}/{name}.img" for name in names]
+    out_stdout_files: List[str]             = [f"{out_dir}/{name}.stdout" for name in names]
+
+    print_green("*.asm + lib/*.asm -> *.obj -> *.img -> *.stdout")
+    print("lib...", end='')
+    if execute(f"python3 $UCOMP_DEVROOT/tools/asm.py -c --cache {cache_dir} -o {out_dir} {' '.join(lib_asm_files)}"):
+        print_green('pass')
+    else:
+        print_red('failed')
+
+    # The second time around, every source is in the cache already.
+    for suffix in ['', ' (cached)']:
+        tests: zip[tuple[str, str, str, str, str]] \
+            = zip(names, in_asm_files, ref_stdout_files, out_img_files, out_stdout_files)
+        for name, in_asm, ref_stdout, out_img, out_stdout in tests:
+            execute_test(f"{name}{suffix}", in_asm, lib_obj_files, ref_stdout, out_img, out_stdout, cache_dir)
+
+    remove_dir(out_dir)
+
+
+execute_tests()
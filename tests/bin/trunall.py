@@ -4,4 +4,7 @@ from utils import execute
 execute('python3 $UCOMP_DEVROOT/tests/bin/tasm.py')
 execute('python3 $UCOMP_DEVROOT/tests/bin/tdisasm.py')
 execute('python3 $UCOMP_DEVROOT/tests/bin/tasmroundtrip.py')
+execute('python3 $UCOMP_DEVROOT/tests/bin/tlink.py')
 execute('python3 $UCOMP_DEVROOT/tests/bin/tvm.py')
+execute('python3 $UCOMP_DEVROOT/tests/bin/tlimits.py')
+execute('python3 $UCOMP_DEVROOT/tests/bin/tsnapshot.py')
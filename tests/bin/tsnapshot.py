@@ -0,0 +1,68 @@
+import argparse
+
+from typing import List
+
+from utils import *
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Test VM snapshots.')
+    parser.add_argument('--root', metavar='ROOT', type=str, dest='root_dir', \
+                        required=False, default='tests', \
+                        help='root directory for in/snapshot/*.asm and in/ref/snapshot/*.{snapshot,restore}.stdout')
+    return parser.parse_args()
+
+
+EXEC_TYPES: List[str] = ['INTERPRETER', 'PREDECODER', 'JIT', 'AOT']
+
+
+def execute_test(name: str, exec_type: str, in_asm: str, ref_snapshot_stdout: str, ref_restore_stdout: str,
+                 out_img: str, out_so: str, out_snap: str, out_snapshot_stdout: str, out_restore_stdout: str):
+    print(f"{name} ({exec_type.lower()})...", end='')
+
+    if not execute(f"python3 $UCOMP_DEVROOT/tools/asm.py -o {out_img} {in_asm}"):
+        print_red('failed')
+        return
+    if exec_type == 'AOT' and not execute(f"python3 $UCOMP_DEVROOT/tools/aot.py -o {out_so} {out_img}"):
+        print_red('failed')
+        return
+    # The snapshot run stops at the checkpoint; the restored run goes on from there to the end.
+    if not execute(f"source env.sh && python3 $UCOMP_DEVROOT/tools/vm.py -e {exec_type} -n {out_so} "
+                   f"--snapshot-out {out_snap} {out_img} > {out_snapshot_stdout}"):
+        print_red('failed')
+        return
+    if not execute(f"diff {ref_snapshot_stdout} {out_snapshot_stdout}"):
+        print_red('failed')
+        return
+    if not execute(f"source env.sh && python3 $UCOMP_DEVROOT/tools/vm.py -e {exec_type} -n {out_so} "
+                   f"--restore-from {out_snap} {out_img} > {out_restore_stdout}"):
+        print_red('failed')
+        return
+    if not execute(f"diff {ref_restore_stdout} {out_restore_stdout}"):
+        print_red('failed')
+        return
+
+    print_green('pass')
+
+
+def execute_tests():
+    args: argparse.Namespace = parse_args()
+
+    in_dir: str                             = f"{args.root_dir}/in/snapshot"
+    ref_dir: str                            = f"{args.root_dir}/ref/snapshot"
+    out_dir: str                            = create_tmpdir('snapshot-')
+
+    names: List[str]                        = [f"{file.rpartition('.')[0]}" for file in list_files(in_dir, '.asm')]
+
+    print_green("*.asm -> *.snap -> *.{snapshot,restore}.stdout")
+    for name in names:
+        for exec_type in EXEC_TYPES:
+            execute_test(name, exec_type, f"{in_dir}/{name}.asm",
+                         f"{ref_dir}/{name}.snapshot.stdout", f"{ref_dir}/{name}.restore.stdout",
+                         f"{out_dir}/{name}.img", f"{out_dir}/{name}.so", f"{out_dir}/{name}.snap",
+                         f"{out_dir}/{name}.snapshot.stdout", f"{out_dir}/{name}.restore.stdout")
+
+    remove_dir(out_dir)
+
+
+execute_tests()
@@ -13,13 +13,20 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def execute_test(name: str, in_asm: str, ref_stdout: str, out_hex: str, out_stdout: str):
-    print(f"{name}...", end='')
+EXEC_TYPES: List[str] = ['INTERPRETER', 'PREDECODER', 'JIT', 'AOT']
 
-    if not execute(f"python3 $UCOMP_DEVROOT/tools/asm.py -o {out_hex} {in_asm}"):
+
+def execute_test(name: str, exec_type: str, in_asm: str, ref_stdout: str, out_img: str, out_so: str, out_stdout: str,
+                 asm_args: str = ''):
+    print(f"{name} ({exec_type.lower()}{', ' + asm_args if asm_args else ''})...", end='')
+
+    if not execute(f"python3 $UCOMP_DEVROOT/tools/asm.py {asm_args} -o {out_img} {in_asm}"):
+        print_red('failed')
+        return
+    if exec_type == 'AOT' and not execute(f"python3 $UCOMP_DEVROOT/tools/aot.py -o {out_so} {out_img}"):
         print_red('failed')
         return
-    if not execute(f"source env.sh && python3 $UCOMP_DEVROOT/tools/vm.py {out_hex} > {out_stdout}"):
+    if not execute(f"source env.sh && python3 $UCOMP_DEVROOT/tools/vm.py -e {exec_type} -n {out_so} {out_img} > {out_stdout}"):
         print_red('failed')
         return
     if not execute(f"diff {ref_stdout} {out_stdout}"):
@@ -29,6 +36,30 @@ def execute_test(name: str, in_asm: str, ref_stdout: str, out_hex: str, out_stdo
     print_green('pass')
 
 
+def execute_batch_test(exec_type: str, in_asms: List[str], ref_stdouts: List[str], out_imgs: List[str],
+                       out_sos: List[str], ref_stdout: str, out_stdout: str):
+    print(f"batch ({exec_type.lower()})...", end='')
+
+    for in_asm, out_img, out_so in zip(in_asms, out_imgs, out_sos):
+        if not execute(f"python3 $UCOMP_DEVROOT/tools/asm.py -o {out_img} {in_asm}"):
+            print_red('failed')
+            return
+        if exec_type == 'AOT' and not execute(f"python3 $UCOMP_DEVROOT/tools/aot.py -o {out_so} {out_img}"):
+            print_red('failed')
+            return
+    # Each program runs on the native library given with it; the outputs come in the order of the programs.
+    native_args: str = ' '.join([f"-n {out_so}" for out_so in out_sos])
+    if not execute(f"source env.sh && python3 $UCOMP_DEVROOT/tools/vm.py -e {exec_type} -j 2 {native_args} "
+                   f"{' '.join(out_imgs)} > {out_stdout}"):
+        print_red('failed')
+        return
+    if not execute(f"cat {' '.join(ref_stdouts)} > {ref_stdout} && diff {ref_stdout} {out_stdout}"):
+        print_red('failed')
+        return
+
+    print_green('pass')
+
+
 def execute_tests():
     args: argparse.Namespace = parse_args()
 
@@ -39,15 +70,26 @@ def execute_tests():
     names: List[str]                        = [f"{file.rpartition('.')[0]}" for file in list_files(in_dir, '.asm')]
     in_asm_files: List[str]                 = [f"{in_dir}/{name}.asm" for name in names]
     ref_stdout_files: List[str]             = [f"{ref_dir}/{name}.stdout" for name in names]
-    out_hex_files: List[str]                = [f"{out_dir}/{name}.hex" for name in names]
+    out_img_files: List[str]                = [f"{out_dir}/{name}.img" for name in names]
+    out_so_files: List[str]                 = [f"{out_dir}/{name}.so" for name in names]
     out_stdout_files: List[str]             = [f"{out_dir}/{name}.stdout" for name in names]
 
-    tests: zip[tuple[str, str, str, str, str]] \
-        = zip(names, in_asm_files, ref_stdout_files, out_hex_files, out_stdout_files)
+    tests: zip[tuple[str, str, str, str, str, str]] \
+        = zip(names, in_asm_files, ref_stdout_files, out_img_files, out_so_files, out_stdout_files)
 
     print_green("*.asm -> *.stdout")
-    for name, in_asm, ref_stdout, out_hex, out_stdout in tests:
-        execute_test(name, in_asm, ref_stdout, out_hex, out_stdout)
+    for name, in_asm, ref_stdout, out_img, out_so, out_stdout in tests:
+        for exec_type in EXEC_TYPES:
+            execute_test(name, exec_type, in_asm, ref_stdout, out_img, out_so, out_stdout)
+        # optimized code has to run as the code written does
+        execute_test(name, 'INTERPRETER', in_asm, ref_stdout, out_img, out_so, out_stdout, '-O')
+
+    print_green("*.asm -> (batch) -> *.stdout")
+    for exec_type in EXEC_TYPES:
+        execute_batch_test(exec_type, in_asm_files, ref_stdout_files,
+                           [f"{out_dir}/{name}.batch.img" for name in names],
+                           [f"{out_dir}/{name}.batch.so" for name in names],
+                           f"{out_dir}/batch.ref.stdout", f"{out_dir}/batch.stdout")
     
     remove_dir(out_dir)
 
@@ -0,0 +1,18 @@
+# note: addressing mode encoding test; cannot actually be executed
+
+    load r1, [r2]
+    load r1, [r2+4]
+    load r1, [sp+8]
+    load r1, [r2-4]
+    load r1, [r2+r3]
+    load r1, [r2+r3*2]
+    load r1, [r2+r3*4]
+    load r1, [r2+r3*8]
+    store [r2], r1
+    store [r2+4], r1
+    store [sp+8], r1
+    store [r2-4], r1
+    store [r2+r3], r1
+    store [r2+r3*2], r1
+    store [r2+r3*4], r1
+    store [r2+r3*8], r1
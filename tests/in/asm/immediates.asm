@@ -0,0 +1,9 @@
+    mov r0, 0x0
+    mov r1, 0xff
+    add r2, 0XDEADBEEF
+    cmp r3, 4294967295
+    and r4, 0x7fffffff
+    load r5, [r6+0x10]
+    store [r7-0x4], r8
+    call 0x100
+    jmp 0
@@ -0,0 +1,68 @@
+;
+; Each of the peephole optimizations, once, and some look-alikes left as they are.
+;
+
+main:
+    ; xor r0, r0
+    mov r0, 0
+    mov r0, 1
+
+    ; gone, inner pair first
+    push r1
+    push r2
+    pop r2
+    pop r1
+    push r1
+    pop r2
+
+    ; sub r3, 8, and gone
+    add r3, 4
+    sub r3, 12
+    add r4, 4
+    sub r4, 4
+    add r4, r3
+
+    ; load r5, [sp+8], and store [sp], r1, r6 being written next
+    mov r5, sp
+    add r5, 8
+    load r5, [r5]
+    mov r6, sp
+    sub r6, 4
+    store [r6+4], r1
+    mov r6, 1
+
+    ; left, r7 being read next
+    mov r7, sp
+    load r8, [r7]
+    add r7, r8
+
+    ; jmpz .c and jmp .c, past .a and .b; mov r0, 1 and ret gone
+    cmp r7, 0
+    jmpz .a
+    jmp .b
+    mov r0, 1
+.a:
+    jmp .b
+    ret
+.b:
+    jmp .c
+.c:
+    mov r0, 0
+    push r0
+    call $sys_enter
+
+; left as they are, each writing PC
+Mixed:
+    mov pc, 0
+    push pc
+    pop pc
+    add pc, 4
+    add pc, 4
+    mov r9, sp
+    load pc, [r9]
+
+; jmpne .loop, mangled once under a mixed case label
+.loop:
+    cmp r0, 1
+    jmpne .loop
+    ret
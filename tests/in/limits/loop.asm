@@ -0,0 +1,10 @@
+;
+; Loop forever; only --max-instrs or --timeout stop it.
+;
+
+main:
+    mov r0, 0
+
+.loop:
+    add r0, 1
+    jmp .loop
@@ -0,0 +1,54 @@
+;
+; Compute 12! using
+;
+;     factorial(n) {
+;         if (n <= 1)
+;             return 1;
+;         return n * factorial(n-1);
+;     }
+;
+; with multiply from lib/
+;
+
+main:
+    mov r0, 12
+    push r0
+    call factorial
+
+    mov r0, 1
+    push r0
+    call $sys_enter
+
+    add sp, 8
+
+    mov r0, 0
+    push r0
+    call $sys_enter
+
+factorial:
+    load r12, [sp]
+
+    mov r0, sp
+    add r0, 4
+    load r1, [r0]
+
+    mov r0, r1
+    cmp r0, 1
+    jmpeq .return
+
+    push r12
+
+    push r0
+    sub r0, 1
+    push r0
+    call factorial
+    call multiply
+    pop r0
+
+    pop r12
+
+.return:
+    add sp, 8
+    push r0
+    push r12
+    ret
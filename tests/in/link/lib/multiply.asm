@@ -0,0 +1,33 @@
+;
+; multiply(a, b) = a * b, by adding the greater of the two up the lesser number of times
+;
+
+multiply:
+    load r12, [sp]
+
+    mov r0, sp;
+    add r0, 8
+    load r1, [r0];
+    sub r0, 4
+    load r2, [r0]
+
+    cmp r2, r1
+    jmple .do_multiply
+    mov r3, r1
+    mov r1, r2
+    mov r2, r3
+
+.do_multiply:
+    mov r0, 0
+.loop:
+    cmp r2, 0
+    jmpz .return
+    add r0, r1
+    sub r2, 1
+    jmp .loop
+
+.return:
+    add sp, 12
+    push r0
+    push r12
+    ret
@@ -0,0 +1,24 @@
+;
+; square(n) = multiply(n, n)
+;
+
+square:
+    load r12, [sp]
+
+    mov r0, sp
+    add r0, 4
+    load r0, [r0]
+
+    push r12
+
+    push r0
+    push r0
+    call multiply
+    pop r0
+
+    pop r12
+
+    add sp, 8
+    push r0
+    push r12
+    ret
@@ -0,0 +1,21 @@
+;
+; Compute 3^16 as square(square(square(square(3)))), with square from lib/
+;
+
+main:
+    mov r0, 3
+    push r0
+    call square
+    call square
+    call square
+    call square
+
+    mov r0, 1
+    push r0
+    call $sys_enter
+
+    add sp, 8
+
+    mov r0, 0
+    push r0
+    call $sys_enter
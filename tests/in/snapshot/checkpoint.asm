@@ -0,0 +1,62 @@
+;
+; Compute 1 + 2 + ... + 10, keeping the sum in a register and in a heap block, then take a checkpoint.
+; A run restored from it has to find both as they were, and goes on to add 11 + 12 + ... + 20.
+;
+
+main:
+    mov r0, 4
+    push r0
+    mov r0, 5               ; MALLOC
+    push r0
+    call $sys_enter
+    pop r10                 ; block
+    add sp, 4
+
+    mov r5, 0
+    mov r6, 1
+.sum:
+    add r5, r6
+    add r6, 1
+    cmp r6, 10
+    jmple .sum
+    store [r10], r5
+
+    push r5
+    mov r0, 1               ; DISPLAY_INT
+    push r0
+    call $sys_enter
+    add sp, 8
+
+    mov r0, 2               ; CHECKPOINT
+    push r0
+    call $sys_enter
+    add sp, 4
+
+    load r0, [r10]
+    push r0
+    mov r0, 1               ; DISPLAY_INT
+    push r0
+    call $sys_enter
+    add sp, 8
+
+.resum:
+    add r5, r6
+    add r6, 1
+    cmp r6, 20
+    jmple .resum
+
+    push r5
+    mov r0, 1               ; DISPLAY_INT
+    push r0
+    call $sys_enter
+    add sp, 8
+
+    push r10
+    mov r0, 6               ; FREE
+    push r0
+    call $sys_enter
+    add sp, 8
+
+    mov r0, 0
+    push r0
+    call $sys_enter
@@ -0,0 +1,100 @@
+;
+; Fill an array with the first 10 squares, sum it up and read a[7] back twice, using
+;
+;     fill(a, n) {
+;         for (i = 0; i < n; i++)
+;             a[i] = i * i;
+;     }
+;
+;     sum(a, n) {
+;         s = 0;
+;         for (i = 0; i < n; i++)
+;             s += a[i];
+;         return s;
+;     }
+;
+; with the arguments read off the stack as [sp+disp], and the array indexed as [a+i*4] and by byte offset.
+;
+
+main:
+    mov r0, 10
+    push r0
+    mov r0, 1048576
+    push r0
+    call fill
+
+    mov r0, 10
+    push r0
+    mov r0, 1048576
+    push r0
+    call sum
+
+    mov r0, 1
+    push r0
+    call $sys_enter
+
+    add sp, 8
+
+    mov r0, 1048576
+    load r1, [r0+28]
+    push r1
+    mov r1, 1
+    push r1
+    call $sys_enter
+
+    add sp, 8
+
+    mov r0, 1048612
+    load r1, [r0-8]
+    push r1
+    mov r1, 1
+    push r1
+    call $sys_enter
+
+    add sp, 8
+
+    mov r0, 0
+    push r0
+    call $sys_enter
+
+fill:
+    load r0, [sp+4]
+    load r1, [sp+8]
+
+    mov r2, 0
+.loop:
+    cmp r2, r1
+    jmpeq .return
+    mov r3, r2
+    mul r3, r2
+    store [r0+r2*4], r3
+    add r2, 1
+    jmp .loop
+
+.return:
+    load r12, [sp]
+    add sp, 12
+    push r12
+    ret
+
+sum:
+    load r0, [sp+4]
+    load r1, [sp+8]
+    shl r1, 2
+
+    mov r2, 0
+    mov r3, 0
+.loop:
+    cmp r2, r1
+    jmpeq .return
+    load r4, [r0+r2]
+    add r3, r4
+    add r2, 4
+    jmp .loop
+
+.return:
+    load r12, [sp]
+    store [sp+8], r3
+    add sp, 8
+    push r12
+    ret
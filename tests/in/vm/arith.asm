@@ -0,0 +1,79 @@
+;
+; Multiply, divide and shift, signed and unsigned, by registers and immediates;
+; each result is displayed as an unsigned integer.
+;
+
+main:
+    mov r0, 12345
+    mul r0, 6789
+    call display
+
+    mov r0, 0
+    sub r0, 7               ; -7
+    mov r1, 3
+    mul r0, r1
+    call display
+
+    mov r0, 1000
+    mov r1, 7
+    div r0, r1
+    call display
+
+    mov r0, 1000
+    mod r0, 7
+    call display
+
+    mov r0, 0
+    sub r0, 1000            ; -1000
+    div r0, 7
+    call display
+
+    mov r0, 0
+    sub r0, 1000            ; -1000
+    sdiv r0, 7
+    call display
+
+    mov r0, 0
+    sub r0, 1000            ; -1000
+    mov r1, 7
+    smod r0, r1
+    call display
+
+    mov r0, 2147483648      ; INT32_MIN
+    mov r1, 4294967295      ; -1
+    sdiv r0, r1
+    call display
+
+    mov r0, 2147483648      ; INT32_MIN
+    smod r0, 4294967295
+    call display
+
+    mov r0, 1
+    shl r0, 31
+    call display
+
+    mov r0, 1
+    mov r1, 33
+    shl r0, r1
+    call display
+
+    mov r0, 2147483648
+    shr r0, 4
+    call display
+
+    mov r0, 2147483648
+    mov r1, 4
+    sar r0, r1
+    call display
+
+    mov r0, 0
+    push r0
+    call $sys_enter
+
+display:
+    push r0
+    mov r0, 1
+    push r0
+    call $sys_enter
+    add sp, 8
+    ret
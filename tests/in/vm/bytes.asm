@@ -0,0 +1,73 @@
+;
+; Take the word 0x80ff7f81 apart with zero- and sign-extending byte and halfword loads, patch two of
+; its bytes and one of its halfwords back in place, then reverse the string "ucomp" byte by byte.
+;
+
+main:
+    mov r0, 1048576
+    mov r1, 2164227969
+    store [r0], r1
+
+    loadb r1, [r0]
+    call display
+    loadsb r1, [r0]
+    call display
+    loadb r1, [r0+1]
+    call display
+    loadsb r1, [r0+1]
+    call display
+    loadh r1, [r0+2]
+    call display
+    loadsh r1, [r0+2]
+    call display
+    loadh r1, [r0+1]
+    call display
+
+    mov r1, 4660
+    storeb [r0], r1
+    storeb [r0+3], r1
+    load r1, [r0]
+    call display
+
+    mov r1, 4294967295
+    storeh [r0+1], r1
+    load r1, [r0]
+    call display
+
+    mov r1, 1836016501
+    store [r0+4], r1
+    mov r1, 112
+    storeb [r0+8], r1
+
+    mov r2, r0
+    add r2, 4
+    mov r3, r0
+    add r3, 8
+.loop:
+    cmp r2, r3
+    jmpge .done
+    loadb r4, [r2]
+    loadb r5, [r3]
+    storeb [r2], r5
+    storeb [r3], r4
+    add r2, 1
+    sub r3, 1
+    jmp .loop
+
+.done:
+    load r1, [r0+4]
+    call display
+    loadb r1, [r0+8]
+    call display
+
+    mov r0, 0
+    push r0
+    call $sys_enter
+
+display:
+    push r1
+    mov r1, 1
+    push r1
+    call $sys_enter
+    add sp, 8
+    ret
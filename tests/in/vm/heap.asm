@@ -0,0 +1,152 @@
+;
+; Allocate, fill, copy and compare heap blocks, then check that freed blocks are reused, that growing
+; a block keeps its contents and that an oversized request fails.
+;
+
+main:
+    mov r0, 16
+    push r0
+    mov r0, 5               ; MALLOC
+    push r0
+    call $sys_enter
+    pop r10                 ; a
+    add sp, 4
+
+    mov r0, 16
+    push r0
+    mov r0, 7
+    push r0
+    push r10
+    mov r0, 9               ; MEMSET
+    push r0
+    call $sys_enter
+    add sp, 16
+
+    mov r0, 16
+    push r0
+    mov r0, 5               ; MALLOC
+    push r0
+    call $sys_enter
+    pop r11                 ; b
+    add sp, 4
+
+    mov r0, 16
+    push r0
+    push r10
+    push r11
+    mov r0, 8               ; MEMCPY
+    push r0
+    call $sys_enter
+    add sp, 16
+
+    push r10
+    push r11
+    call compare            ; b vs a: 0
+    mov r0, 9
+    storeb [r11+5], r0
+    push r10
+    push r11
+    call compare            ; b vs a: 1
+    push r11
+    push r10
+    call compare            ; a vs b: -1
+
+    push r10
+    mov r0, 6               ; FREE
+    push r0
+    call $sys_enter
+    add sp, 8
+
+    mov r0, 10
+    push r0
+    mov r0, 5               ; MALLOC
+    push r0
+    call $sys_enter
+    pop r0
+    add sp, 4
+    sub r0, r10
+    call display            ; the block freed is reused: 0
+
+    mov r0, 100
+    push r0
+    push r11
+    mov r0, 7               ; REALLOC
+    push r0
+    call $sys_enter
+    pop r12                 ; d
+    add sp, 8
+    loadb r0, [r12+5]
+    call display            ; 9
+    loadb r0, [r12+15]
+    call display            ; 7
+
+    mov r0, 15
+    push r0
+    push r12
+    mov r0, r12
+    add r0, 1
+    push r0
+    mov r0, 8               ; MEMCPY
+    push r0
+    call $sys_enter
+    add sp, 16
+    loadb r0, [r12+6]
+    call display            ; moved along by one: 9
+
+    mov r0, 16
+    push r0
+    mov r0, 5               ; MALLOC
+    push r0
+    call $sys_enter
+    pop r0
+    add sp, 4
+    sub r0, r11
+    call display            ; the block moved out of is reused: 0
+
+    mov r0, 2147483649
+    push r0
+    mov r0, 5               ; MALLOC
+    push r0
+    call $sys_enter
+    pop r0
+    add sp, 4
+    call display            ; 0
+
+    mov r0, 0
+    push r0
+    mov r0, 6               ; FREE
+    push r0
+    call $sys_enter
+    add sp, 8
+
+    mov r0, 0
+    push r0
+    call $sys_enter
+
+; compare(x, y): displays MEMCMP(x, y, 16)
+compare:
+    load r0, [sp+4]
+    load r1, [sp+8]
+    mov r2, 16
+    push r2
+    push r1
+    push r0
+    mov r0, 10              ; MEMCMP
+    push r0
+    call $sys_enter
+    pop r0
+    add sp, 12
+    call display
+    load r0, [sp]
+    add sp, 8
+    push r0
+    ret
+
+; display(r0)
+display:
+    push r0
+    mov r0, 1
+    push r0
+    call $sys_enter
+    add sp, 8
+    ret
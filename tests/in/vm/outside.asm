@@ -0,0 +1,24 @@
+;
+; Run code written past the text: a RET stored at 0x00300002, jumped to by writing PC.
+;
+
+main:
+    mov r1, 3145728         ; 0x00300000
+    mov r2, 28              ; RET
+    storeb [r1+2], r2
+    call .jump
+
+    mov r0, 7
+    push r0
+    mov r0, 1
+    push r0
+    call $sys_enter
+
+    add sp, 8
+
+    mov r0, 0
+    push r0
+    call $sys_enter
+
+.jump:
+    mov pc, r1              ; 0x00300002, as mov pc, r1 moves PC past itself
@@ -0,0 +1,54 @@
+;
+; Jump by writing PC, with mov, add and pop; each jump skips displaying 111. As with any other
+; destination, the instruction moves PC past itself after writing it.
+;
+
+main:
+    call .mov
+.mov:
+    pop r0
+    add r0, 21              ; .mov_to, less the 2 bytes of mov pc, r0
+    mov pc, r0
+    mov r0, 111
+    push r0
+    call display
+.mov_to:
+    mov r0, 222
+    push r0
+    call display
+
+    add pc, 13              ; .add_to, less the 6 bytes of add pc, 13
+    mov r0, 111
+    push r0
+    call display
+.add_to:
+    mov r0, 333
+    push r0
+    call display
+
+    call .pop
+.pop:
+    pop r0
+    add r0, 23              ; .pop_to, less the 2 bytes of pop pc
+    push r0
+    pop pc
+    mov r0, 111
+    push r0
+    call display
+.pop_to:
+    mov r0, 444
+    push r0
+    call display
+
+    mov r0, 0
+    push r0
+    call $sys_enter
+
+display:
+    pop r12
+    mov r0, 1
+    push r0
+    call $sys_enter
+    add sp, 8
+    push r12
+    ret
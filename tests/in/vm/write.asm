@@ -0,0 +1,39 @@
+;
+; Write "Hello, world!\n" from memory in one go.
+;
+
+main:
+    mov r0, 1048576
+    mov r1, 1819043144      ; "Hell"
+    store [r0], r1
+    add r0, 4
+    mov r1, 1998597231      ; "o, w"
+    store [r0], r1
+    add r0, 4
+    mov r1, 1684828783      ; "orld"
+    store [r0], r1
+    add r0, 4
+    mov r1, 2593            ; "!\n"
+    store [r0], r1
+
+    mov r0, 14
+    push r0
+    mov r0, 1048576
+    push r0
+    mov r0, 3
+    push r0
+    call $sys_enter
+
+    pop r0
+    add sp, 8
+
+    push r0
+    mov r0, 1
+    push r0
+    call $sys_enter
+
+    add sp, 8
+
+    mov r0, 0
+    push r0
+    call $sys_enter
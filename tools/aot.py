@@ -0,0 +1,384 @@
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tempfile
+
+from typing import BinaryIO, Dict, List, Optional, TextIO
+
+from asmspec import Instruction, RegImm, Register
+from disasm import VMInstrData, disasm_file, open_program, program
+
+
+SYS_ENTER_ADDR: int = 0x0
+
+EXIT_DISPATCH: int = 0
+EXIT_STORE_TEXT: int = 1
+EXIT_OUT_OF_FUEL: int = 2
+EXIT_DIVIDE_BY_ZERO: int = 3
+
+FLAG_Z: int = 0b00000001
+FLAG_EQ: int = 0b00000010
+FLAG_LT: int = 0b00000100
+FLAG_GT: int = 0x00001000
+
+JMP_CONDITIONS: Dict[Instruction, str] = {
+    Instruction.JMPZ:   f"flags & {FLAG_Z:#x}",
+    Instruction.JMPNZ:  f"!(flags & {FLAG_Z:#x})",
+    Instruction.JMPEQ:  f"flags & {FLAG_EQ:#x}",
+    Instruction.JMPNE:  f"!(flags & {FLAG_EQ:#x})",
+    Instruction.JMPGT:  f"flags & {FLAG_GT:#x}",
+    Instruction.JMPLT:  f"flags & {FLAG_LT:#x}",
+    Instruction.JMPGE:  f"flags & {FLAG_GT | FLAG_EQ:#x}",
+    Instruction.JMPLE:  f"flags & {FLAG_LT | FLAG_EQ:#x}",
+}
+
+ALU_OPERATORS: Dict[Instruction, str] = {
+    Instruction.MOV:    '=',
+    Instruction.ADD:    '+=',
+    Instruction.SUB:    '-=',
+    Instruction.AND:    '&=',
+    Instruction.OR:     '|=',
+    Instruction.XOR:    '^=',
+    Instruction.MUL:    '*=',
+    Instruction.SHL:    '<<=',
+    Instruction.SHR:    '>>=',
+}
+
+DIVISIONS: List[Instruction] = [Instruction.DIV, Instruction.SDIV, Instruction.MOD, Instruction.SMOD]
+
+GUEST_REGS: List[Register] = [r for r in Register if r != Register.PC]
+
+# the C++ type each load and store accesses memory as; loads extend it to 32 bits as it is signed or not
+LOAD_TYPES: Dict[Instruction, str] = {
+    Instruction.LOAD:   'uint32_t',
+    Instruction.LOADX:  'uint32_t',
+    Instruction.LOADB:  'uint8_t',
+    Instruction.LOADSB: 'int8_t',
+    Instruction.LOADH:  'uint16_t',
+    Instruction.LOADSH: 'int16_t',
+}
+STORE_TYPES: Dict[Instruction, str] = {
+    Instruction.STORE:  'uint32_t',
+    Instruction.STOREX: 'uint32_t',
+    Instruction.STOREB: 'uint8_t',
+    Instruction.STOREH: 'uint16_t',
+}
+
+PROLOGUE: str = """\
+// Generated by tools/aot.py; do not edit.
+
+#include <cstddef>
+#include <cstdint>
+#include <cstring>
+
+
+template <typename T = uint32_t>
+static inline T ld(const uint8_t* mem, uint32_t addr)
+{{
+    T val;
+    std::memcpy(&val, mem + addr, sizeof val);
+    return val;
+}}
+
+template <typename T = uint32_t>
+static inline void st(uint8_t* mem, uint32_t addr, T val)
+{{
+    std::memcpy(mem + addr, &val, sizeof val);
+}}
+
+
+extern "C" const uint8_t aot_image[] = {{
+{image}
+}};
+extern "C" const size_t aot_image_size = sizeof aot_image;
+
+
+extern "C" int aot_exec(uint8_t* mem, uint32_t* reg, uint32_t* arg, int64_t* fuel_left)
+{{
+{load_regs}
+    uint32_t pc = reg[{pc}];
+    int64_t fuel = *fuel_left;
+    int exit_code = {exit_dispatch};
+
+dispatch:
+    switch (pc) {{
+{cases}
+    default:
+        goto leave;
+    }}
+
+"""
+
+EPILOGUE: str = """\
+leave:
+{store_regs}
+    reg[{pc}] = pc;
+    *fuel_left = fuel;
+    return exit_code;
+}}
+"""
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='VM ahead-of-time translator.')
+    parser.add_argument('input_file', metavar='IMG', type=str, nargs='?', \
+                        help='input file to process, a VM image or hex text; defaults to STDIN if unspecified')
+    parser.add_argument('-o', '--output', metavar='SO', type=str, dest='output_file', \
+                        required=True, \
+                        help='output file to emit the native library to')
+    parser.add_argument('-S', '--source', dest='source_only', \
+                        required=False, action='store_true', \
+                        help='emit the C++ source instead of compiling it')
+    return parser.parse_args()
+
+
+def reg(r: Register | int | None) -> str:
+    assert type(r) == Register
+    return r.name.lower()                                                   # type: ignore
+
+
+def label(addr: int) -> str:
+    return f"L_{addr:x}"
+
+
+def uses_pc(data: VMInstrData) -> bool:
+    return data.dst == Register.PC or data.src == Register.PC or data.index == Register.PC
+
+
+def address(base: Register | int | None, data: VMInstrData) -> str:
+    # wraps around at 4 GiB, as the VM does
+    if data.index is not None:
+        return f"{reg(base)} + ({reg(data.index)} << {data.scale.bit_length() - 1})"
+    if data.disp is not None:
+        return f"{reg(base)} + {data.disp:#x}u"
+    return reg(base)
+
+
+def out_of_fuel(target: Optional[int]) -> List[str]:
+    # no target: pc is already set
+    return [f"if (fuel <= 0) {{"] \
+        + ([f"    pc = {target:#x};"] if target is not None else []) \
+        + [f"    exit_code = {EXIT_OUT_OF_FUEL};", "    goto leave;", "}"]
+
+
+def goto(target: int, check_fuel: bool) -> List[str]:
+    # the fuel is only looked at on backward jumps, calls and returns; any loop goes through one of them
+    if target in program.keys() and target != SYS_ENTER_ADDR:
+        return (out_of_fuel(target) if check_fuel else []) + [f"goto {label(target)};"]
+    return [f"pc = {target:#x};", "goto leave;"]
+
+
+def leave(addr: int) -> List[str]:
+    return [f"pc = {addr:#x};", "goto leave;"]
+
+
+def translate_load(addr: int, data: VMInstrData) -> List[str]:
+    return [f"{reg(data.dst)} = ld<{LOAD_TYPES[data.instr]}>(mem, {address(data.src, data)});"]
+
+
+def translate_store(addr: int, data: VMInstrData, text_size: int) -> List[str]:
+    if data.index is None and data.disp is None:
+        return translate_store_at(addr, data, text_size, reg(data.dst))
+    return [f"{{", f"    uint32_t addr = {address(data.dst, data)};"] \
+        + [f"    {line}" for line in translate_store_at(addr, data, text_size, 'addr')] \
+        + ["}"]
+
+
+def translate_store_at(addr: int, data: VMInstrData, text_size: int, at: str) -> List[str]:
+    return [
+        f"st<{STORE_TYPES[data.instr]}>(mem, {at}, {reg(data.src)});",
+        f"if ({at} < {text_size:#x}) {{",
+        f"    *arg = {at};",
+        f"    exit_code = {EXIT_STORE_TEXT};",
+        f"    pc = {addr + data.len:#x};",
+        f"    goto leave;",
+        f"}}",
+    ]
+
+
+def translate_alu(addr: int, data: VMInstrData) -> List[str]:
+    src: str = f"{data.src:#x}u" if data.ri == RegImm.IMM else reg(data.src)
+    if data.instr in [Instruction.SHL, Instruction.SHR]:
+        src = f"({src} & 31)"
+    return [f"{reg(data.dst)} {ALU_OPERATORS[data.instr]} {src};"]
+
+
+def translate_sar(addr: int, data: VMInstrData) -> List[str]:
+    dst: str = reg(data.dst)
+    src: str = f"{data.src:#x}u" if data.ri == RegImm.IMM else reg(data.src)
+    return [f"{dst} = uint32_t(int32_t({dst}) >> ({src} & 31));"]
+
+
+def translate_div(addr: int, data: VMInstrData) -> List[str]:
+    dst: str = reg(data.dst)
+    src: str = f"{data.src:#x}u" if data.ri == RegImm.IMM else reg(data.src)
+    # pc is left on the division
+    trap: List[str] = [f"exit_code = {EXIT_DIVIDE_BY_ZERO};"] + leave(addr)
+    if data.ri == RegImm.IMM and data.src == 0:
+        return trap
+    lines: List[str] = []
+    if data.ri == RegImm.REG:
+        lines = [f"if ({src} == 0) {{"] + [f"    {line}" for line in trap] + ["}"]
+    match data.instr:
+        case Instruction.DIV:
+            lines += [f"{dst} /= {src};"]
+        case Instruction.MOD:
+            lines += [f"{dst} %= {src};"]
+        # INT32_MIN / -1 overflows; it wraps around instead, with no remainder
+        case Instruction.SDIV:
+            lines += [f"{dst} = {src} == 0xffffffffu ? 0u - {dst} : uint32_t(int32_t({dst}) / int32_t({src}));"]
+        case Instruction.SMOD:
+            lines += [f"{dst} = {src} == 0xffffffffu ? 0u : uint32_t(int32_t({dst}) % int32_t({src}));"]
+    return lines
+
+
+def translate_not(addr: int, data: VMInstrData) -> List[str]:
+    return [f"{reg(data.dst)} = ~{reg(data.dst)};"]
+
+
+def translate_cmp(addr: int, data: VMInstrData) -> List[str]:
+    dst: str = reg(data.dst)
+    src: str = f"{data.src:#x}u" if data.ri == RegImm.IMM else reg(data.src)
+    return [
+        f"flags = ({dst} == 0 ? {FLAG_Z:#x} : 0)"
+        f" | ({dst} < {src} ? {FLAG_LT:#x} : {dst} > {src} ? {FLAG_GT:#x} : {FLAG_EQ:#x});"
+    ]
+
+
+def translate_push(addr: int, data: VMInstrData) -> List[str]:
+    return ["sp -= 4;", f"st(mem, sp, {reg(data.dst)});"]
+
+
+def translate_pop(addr: int, data: VMInstrData) -> List[str]:
+    return [f"{reg(data.dst)} = ld(mem, sp);", "sp += 4;"]
+
+
+def translate_call(addr: int, data: VMInstrData) -> List[str]:
+    return ["sp -= 4;", f"st(mem, sp, {addr + data.len:#x});"] + goto(data.dst, True)  # type: ignore
+
+
+def translate_ret(addr: int, data: VMInstrData) -> List[str]:
+    return ["pc = ld(mem, sp);", "sp += 4;"] + out_of_fuel(None) + ["goto dispatch;"]
+
+
+def translate_jmp(addr: int, data: VMInstrData) -> List[str]:
+    return goto(data.dst, data.dst <= addr)                                 # type: ignore
+
+
+def translate_jmp_cond(addr: int, data: VMInstrData) -> List[str]:
+    return [f"if ({JMP_CONDITIONS[data.instr]}) {{"] \
+        + [f"    {line}" for line in goto(data.dst, data.dst <= addr)] \
+        + ["}"]                                                             # type: ignore
+
+
+def translate_instruction(addr: int, data: VMInstrData, text_size: int) -> List[str]:
+    # the system call trap and anything touching PC are left to the VM
+    if addr == SYS_ENTER_ADDR or uses_pc(data):
+        return leave(addr)
+    return ["fuel--;"] + translate_body(addr, data, text_size)
+
+
+def translate_body(addr: int, data: VMInstrData, text_size: int) -> List[str]:
+    match data.instr:
+        case instr if instr in LOAD_TYPES:
+            return translate_load(addr, data)
+        case instr if instr in STORE_TYPES:
+            return translate_store(addr, data, text_size)
+        case Instruction.MOV | Instruction.ADD | Instruction.SUB | \
+                Instruction.AND | Instruction.OR | Instruction.XOR | \
+                Instruction.MUL | Instruction.SHL | Instruction.SHR:
+            return translate_alu(addr, data)
+        case Instruction.SAR:
+            return translate_sar(addr, data)
+        case instr if instr in DIVISIONS:
+            return translate_div(addr, data)
+        case Instruction.NOT:
+            return translate_not(addr, data)
+        case Instruction.CMP:
+            return translate_cmp(addr, data)
+        case Instruction.PUSH:
+            return translate_push(addr, data)
+        case Instruction.POP:
+            return translate_pop(addr, data)
+        case Instruction.CALL:
+            return translate_call(addr, data)
+        case Instruction.RET:
+            return translate_ret(addr, data)
+        case Instruction.JMP:
+            return translate_jmp(addr, data)
+        case instr if instr in JMP_CONDITIONS:
+            return translate_jmp_cond(addr, data)
+        case _:
+            sys.exit(f"Instruction '{data.instr}' not supported yet.")
+
+
+def translate_program(image: bytes, output: TextIO):
+    text_size: int = len(image)
+
+    image_lines: List[str] = []
+    for i in range(0, len(image), 16):
+        image_lines.append('    ' + ' '.join([f"{b:#04x}," for b in image[i:i+16]]))
+
+    print(PROLOGUE.format(
+        image='\n'.join(image_lines),
+        load_regs='\n'.join([f"    uint32_t {reg(r)} = reg[{int(r)}];" for r in GUEST_REGS]),
+        pc=int(Register.PC),
+        exit_dispatch=EXIT_DISPATCH,
+        cases='\n'.join([f"    case {addr:#x}: goto {label(addr)};" for addr in program.keys()]),
+    ), end='', file=output)
+
+    next_addr: int = 0
+    for addr, data in program.items():
+        print(f"{label(addr)}:", file=output)
+        for line in translate_instruction(addr, data, text_size):
+            print(f"    {line}", file=output)
+        next_addr = addr + data.len
+    for line in leave(next_addr):
+        print(f"    {line}", file=output)
+    print(file=output)
+
+    print(EPILOGUE.format(
+        store_regs='\n'.join([f"    reg[{int(r)}] = {reg(r)};" for r in GUEST_REGS]),
+        pc=int(Register.PC),
+    ), end='', file=output)
+
+
+def compile_source(source: str, output: str):
+    cxx: str = os.environ.get('CXX', 'g++')
+    process = subprocess.run([cxx, '-std=c++17', '-O2', '-fPIC', '-shared', '-Wno-unused-label',
+                              '-o', output, source])
+    if process.returncode != 0:
+        sys.exit(f"Failed to compile '{source}'.")
+
+
+def translate():
+    args = parse_args()
+
+    input_file: BinaryIO = sys.stdin.buffer
+    if args.input_file is not None:
+        input_file = open(args.input_file, mode='rb')                       # type: ignore
+
+    with input_file as input:
+        program_input, _ = open_program(input.read())
+    with program_input as input:
+        lines: List[str] = [line.strip() for line in input]
+    image: bytes = bytes.fromhex(' '.join(lines))
+
+    disasm_file(io.StringIO('\n'.join(lines)))
+
+    if args.source_only:
+        with open(args.output_file, mode='w', encoding='utf-8') as output:
+            translate_program(image, output)
+        return
+
+    with tempfile.TemporaryDirectory(prefix='aot-') as tmp_dir:
+        source: str = f"{tmp_dir}/program.cc"
+        with open(source, mode='w', encoding='utf-8') as output:
+            translate_program(image, output)
+        compile_source(source, args.output_file)
+
+
+if __name__ == '__main__':
+    translate()
@@ -1,48 +1,133 @@
 import argparse
+import functools
+import hashlib
 import io
+import os
 import re
 import sys
 
-from math import ceil
-from typing import Callable, Dict, List, Optional, TextIO
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from enum import IntEnum, unique
+from typing import Dict, List, Optional, TextIO, Tuple
 
 from asmspec import Instruction, RegImm, Register
+from image import DEFAULT_ENTRY, OBJECT_VERSION, Image, Object, load_object, write_image, write_object
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description='VM assembler.')
-    parser.add_argument('input_file', metavar='ASM', type=str, nargs='?', \
-                        help='input file to process; defaults to STDIN if unspecified')
-    parser.add_argument('-o', '--output', metavar='HEX', type=str, dest='output_file', \
+    parser.add_argument('input_files', metavar='ASM', type=str, nargs='*', \
+                        help='''input file to process; defaults to STDIN if unspecified; several files are
+                                assembled as a batch, in parallel, each to a file of its own''')
+    parser.add_argument('-o', '--output', metavar='IMG', type=str, dest='output_file', \
                         required=False, \
-                        help='output file to emit VM code to; defaults to STDOUT if unspecified')
+                        help='''output file to emit the VM image to; defaults to STDOUT if unspecified;
+                                in a batch, the directory to emit NAME.img to, defaulting to that of NAME.asm''')
+    output_format = parser.add_mutually_exclusive_group()
+    output_format.add_argument('-x', '--hex', dest='format', \
+                               required=False, action='store_const', const=Format.HEX, default=Format.IMAGE, \
+                               help='emit VM code as hex text instead, one instruction per line, to NAME.hex in a batch')
+    output_format.add_argument('-c', '--object', dest='format', \
+                               required=False, action='store_const', const=Format.OBJECT, \
+                               help='''emit a relocatable object instead, to be linked by link.py, to NAME.obj in a batch;
+                                       labels defined elsewhere are left to the linker''')
+    parser.add_argument('--cache', metavar='DIR', type=str, dest='cache_dir', \
+                        required=False, \
+                        help='''with -c, directory to keep objects in, by source, so that an unchanged source is never
+                                assembled twice''')
     parser.add_argument('-l', '--labels', metavar='LBL', type=str, dest='labels_file', \
                         required=False, \
-                        help='output file to emit assembler labels to; defaults to none if unspecified')
+                        help='''output file to emit assembler labels to; defaults to none if unspecified;
+                                in a batch, the directory to emit NAME.lbl to''')
+    parser.add_argument('-O', '--optimize', dest='optimize', \
+                        required=False, action='store_true', \
+                        help='''optimize the code, peephole fashion: drop what cannot run, thread jumps to jumps,
+                                and fold or shorten some instruction sequences''')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, dest='jobs', \
+                        required=False, \
+                        help='the number of files to assemble at once in a batch; defaults to the number of CPUs')
     return parser.parse_args()
 
 
-SYS_ENTER_ASM = io.StringIO("""
+@unique
+class Format(IntEnum):
+    IMAGE   = 0
+    HEX     = 1
+    OBJECT  = 2
+
+
+@unique
+class Operands(IntEnum):
+    NONE    = 0                                 # ret
+    REG     = 1                                 # not r
+    TARGET  = 2                                 # jmp label|imm
+    DST_SRC = 3                                 # add r, r|imm
+    LOAD    = 4                                 # load r, [address]
+    STORE   = 5                                 # store [address], r
+
+
+# mnemonic -> operands, instruction, instruction for [base+index*scale] if any
+MNEMONICS: Dict[str, Tuple[Operands, Instruction, Optional[Instruction]]] = {
+    'LOAD':     (Operands.LOAD,     Instruction.LOAD,   Instruction.LOADX),
+    'STORE':    (Operands.STORE,    Instruction.STORE,  Instruction.STOREX),
+    'MOV':      (Operands.DST_SRC,  Instruction.MOV,    None),
+    'ADD':      (Operands.DST_SRC,  Instruction.ADD,    None),
+    'SUB':      (Operands.DST_SRC,  Instruction.SUB,    None),
+    'AND':      (Operands.DST_SRC,  Instruction.AND,    None),
+    'OR':       (Operands.DST_SRC,  Instruction.OR,     None),
+    'XOR':      (Operands.DST_SRC,  Instruction.XOR,    None),
+    'NOT':      (Operands.REG,      Instruction.NOT,    None),
+    'CMP':      (Operands.DST_SRC,  Instruction.CMP,    None),
+    'PUSH':     (Operands.REG,      Instruction.PUSH,   None),
+    'POP':      (Operands.REG,      Instruction.POP,    None),
+    'CALL':     (Operands.TARGET,   Instruction.CALL,   None),
+    'RET':      (Operands.NONE,     Instruction.RET,    None),
+    'JMP':      (Operands.TARGET,   Instruction.JMP,    None),
+    'JMPZ':     (Operands.TARGET,   Instruction.JMPZ,   None),
+    'JMPNZ':    (Operands.TARGET,   Instruction.JMPNZ,  None),
+    'JMPEQ':    (Operands.TARGET,   Instruction.JMPEQ,  None),
+    'JMPNE':    (Operands.TARGET,   Instruction.JMPNE,  None),
+    'JMPGT':    (Operands.TARGET,   Instruction.JMPGT,  None),
+    'JMPLT':    (Operands.TARGET,   Instruction.JMPLT,  None),
+    'JMPGE':    (Operands.TARGET,   Instruction.JMPGE,  None),
+    'JMPLE':    (Operands.TARGET,   Instruction.JMPLE,  None),
+    'MUL':      (Operands.DST_SRC,  Instruction.MUL,    None),
+    'DIV':      (Operands.DST_SRC,  Instruction.DIV,    None),
+    'SDIV':     (Operands.DST_SRC,  Instruction.SDIV,   None),
+    'MOD':      (Operands.DST_SRC,  Instruction.MOD,    None),
+    'SMOD':     (Operands.DST_SRC,  Instruction.SMOD,   None),
+    'SHL':      (Operands.DST_SRC,  Instruction.SHL,    None),
+    'SHR':      (Operands.DST_SRC,  Instruction.SHR,    None),
+    'SAR':      (Operands.DST_SRC,  Instruction.SAR,    None),
+    'LOADB':    (Operands.LOAD,     Instruction.LOADB,  None),
+    'LOADSB':   (Operands.LOAD,     Instruction.LOADSB, None),
+    'LOADH':    (Operands.LOAD,     Instruction.LOADH,  None),
+    'LOADSH':   (Operands.LOAD,     Instruction.LOADSH, None),
+    'STOREB':   (Operands.STORE,    Instruction.STOREB, None),
+    'STOREH':   (Operands.STORE,    Instruction.STOREH, None),
+}
+
+# the table above as the assembler uses it: mnemonic -> operands, opcode, opcode for [base+index*scale] or 0
+OPCODES: Dict[str, Tuple[Operands, int, int]] = {
+    mnemonic: (operands, instr << 1, indexed << 1 if indexed is not None else 0)
+    for mnemonic, (operands, instr, indexed) in MNEMONICS.items()
+}
+
+REGISTERS: Dict[str, int] = {name: int(reg) for name, reg in Register.__members__.items()}
+
+SCALES: Dict[str, int] = {'1': 0, '2': 1, '4': 2, '8': 3}
+
+SYS_ENTER_ASM: str = """
     $sys_enter:
         jmp $sys_enter
-""")
+"""
 
-REGEX_IMM_HEX               = re.compile(r'^(0x[0-9a-fA-F]+)$')
-REGEX_IMM_DEC               = re.compile(r'^([0-9]+)$')
-REGEX_LABEL                 = re.compile(r'^(.+):$')
-REGEX_INSTR                 = re.compile(r'^([a-zA-Z]+).*$')
-REGEX_LOAD                  = re.compile(r'^LOAD\s+([^\s]+)\s*,\s*\[([^\s]+)\]$')
-REGEX_STORE                 = re.compile(r'^STORE\s+\[([^\s]+)\]\s*,\s*([^\s]+)$')
-REGEX_GENERIC_INSTR_DST_SRC = re.compile(r'^[a-zA-Z]+\s+([^\s]+)\s*,\s*([^\s]+)$')
-REGEX_GENERIC_INSTR_OP      = re.compile(r'^[a-zA-Z]+\s+([^\s]+)\s*$')
+REGEX_IMM_HEX               = re.compile(r'^0X[0-9A-F]+$')
+REGEX_ADDRESS               = re.compile(r'^\[\s*([A-Z0-9]+)\s*(?:([+-])\s*([A-Z0-9]+)(?:\s*\*\s*([0-9]+))?)?\s*\]$')
 
 low_level_label_start: str = '.'
-label_cur_top_level: str = 'n/a'
-label_refs: Dict[str, List[int]] = {}
-label_addr: Dict[str, int] = {}
-
-program: List[int] = []
-program_size: int = 0
 
 
 def is_high_level_label(label: str) -> bool:
@@ -51,354 +136,619 @@ def is_low_level_label(label: str) -> bool:
     return not is_high_level_label(label)
 
 
-def mangle_label(label: str) -> str:
-    return label if is_high_level_label(label) else f"{label_cur_top_level}:{label}"
 def demangle_label(label: str) -> List[str]:
     return label.split(':')
 
 
-def gen_i(imm: int) -> int:
-    big_endian: str = f"{imm:0>8x}"
-    little_endian: str = ''.join(reversed([big_endian[i:i+2] for i in range(0, len(big_endian), 2)]))
-    return int(little_endian, base=16)
-
-
-def gen_opcode(instr: Instruction, ri: RegImm) -> int:
-    return (instr << 1) + ri
-def gen_instr(instr: Instruction) -> int:
-    return gen_opcode(instr, RegImm.REG)
-def gen_rr(dst: Register, src: Register) -> int:
-    return (dst << 4) + src
-def gen_ri(reg: Register, imm: int) -> int:
-    return ((reg << 4) << 32) + gen_i(imm)
-def gen_instr_rr(instr: Instruction, dst: Register, src: Register) -> int:
-    return (gen_opcode(instr, RegImm.REG) << 8) + gen_rr(dst, src)
-def gen_instr_ri(instr: Instruction, dst: Register, src: int) -> int:
-    return (gen_opcode(instr, RegImm.IMM) << 40) + gen_ri(dst, src)
-def gen_r(reg: Register) -> int:
-    return reg << 4
-def gen_instr_r(instr: Instruction, reg: Register) -> int:
-    return (gen_opcode(instr, RegImm.REG) << 8) + gen_r(reg)
-def gen_instr_i(instr: Instruction, imm: int) -> int:
-    return (gen_opcode(instr, RegImm.IMM) << 32) + gen_i(imm)
-
-
-def gen_load_rr(dst: Register, src: Register) -> int:
-    return gen_instr_rr(Instruction.LOAD, dst, src)
-def gen_store_rr(dst: Register, src: Register) -> int:
-    return gen_instr_rr(Instruction.STORE, dst, src)
-def gen_mov_rr(dst: Register, src: Register) -> int:
-    return gen_instr_rr(Instruction.MOV, dst, src)
-def gen_mov_ri(dst: Register, src: int) -> int:
-    return gen_instr_ri(Instruction.MOV, dst, src)
-def gen_add_rr(dst: Register, src: Register) -> int:
-    return gen_instr_rr(Instruction.ADD, dst, src)
-def gen_add_ri(dst: Register, src: int) -> int:
-    return gen_instr_ri(Instruction.ADD, dst, src)
-def gen_sub_rr(dst: Register, src: Register) -> int:
-    return gen_instr_rr(Instruction.SUB, dst, src)
-def gen_sub_ri(dst: Register, src: int) -> int:
-    return gen_instr_ri(Instruction.SUB, dst, src)
-def gen_and_rr(dst: Register, src: Register) -> int:
-    return gen_instr_rr(Instruction.AND, dst, src)
-def gen_and_ri(dst: Register, src: int) -> int:
-    return gen_instr_ri(Instruction.AND, dst, src)
-def gen_or_rr(dst: Register, src: Register) -> int:
-    return gen_instr_rr(Instruction.OR, dst, src)
-def gen_or_ri(dst: Register, src: int) -> int:
-    return gen_instr_ri(Instruction.OR, dst, src)
-def gen_xor_rr(dst: Register, src: Register) -> int:
-    return gen_instr_rr(Instruction.XOR, dst, src)
-def gen_xor_ri(dst: Register, src: int) -> int:
-    return gen_instr_ri(Instruction.XOR, dst, src)
-def gen_not_r(reg: Register) -> int:
-    return gen_instr_r(Instruction.NOT, reg)
-def gen_cmp_rr(dst: Register, src: Register) -> int:
-    return gen_instr_rr(Instruction.CMP, dst, src)
-def gen_cmp_ri(dst: Register, src: int) -> int:
-    return gen_instr_ri(Instruction.CMP, dst, src)
-def gen_push_r(reg: Register) -> int:
-    return gen_instr_r(Instruction.PUSH, reg)
-def gen_pop_r(reg: Register) -> int:
-    return gen_instr_r(Instruction.POP, reg)
-def gen_call_i(imm: int) -> int:
-    return gen_instr_i(Instruction.CALL, imm)
-def gen_ret() -> int:
-    return gen_instr(Instruction.RET)
-def gen_jmp_i(imm: int) -> int:
-    return gen_instr_i(Instruction.JMP, imm)
-def gen_jmpz_i(imm: int) -> int:
-    return gen_instr_i(Instruction.JMPZ, imm)
-def gen_jmpnz_i(imm: int) -> int:
-    return gen_instr_i(Instruction.JMPNZ, imm)
-def gen_jmpeq_i(imm: int) -> int:
-    return gen_instr_i(Instruction.JMPEQ, imm)
-def gen_jmpne_i(imm: int) -> int:
-    return gen_instr_i(Instruction.JMPNE, imm)
-def gen_jmpgt_i(imm: int) -> int:
-    return gen_instr_i(Instruction.JMPGT, imm)
-def gen_jmplt_i(imm: int) -> int:
-    return gen_instr_i(Instruction.JMPLT, imm)
-def gen_jmpge_i(imm: int) -> int:
-    return gen_instr_i(Instruction.JMPGE, imm)
-def gen_jmple_i(imm: int) -> int:
-    return gen_instr_i(Instruction.JMPLE, imm)
-
-
-def asm_generic_instr_dst_src(
-        line: str,
-        pattern: re.Pattern[str],
-        gen_rr: Callable[[Register, Register], int],
-        gen_ri: Callable[[Register, int], int]
-    ) -> int:
-
-    m = pattern.match(line.upper())
-    assert m is not None
-
-    dst, src = Register[m.group(1).upper()], m.group(2).upper()
-
-    m = REGEX_IMM_DEC.match(src)
-    if m is None:
-        m = REGEX_IMM_HEX.match(src)
-    if m is not None:
-        src = int(src)
-        return gen_ri(dst, src)
-
-    src = Register[src]
-    return gen_rr(dst, src)
-
-
-def asm_generic_instr_op(
-        line: str,
-        pattern: re.Pattern[str],
-        gen_r: Optional[Callable[[Register], int]],
-        gen_i: Optional[Callable[[int], int]]
-    ) -> int:
-
-    m = pattern.match(line.upper())
-    assert m is not None
-    
-    op = m.group(1).upper()
-    
-    m = REGEX_IMM_DEC.match(op)
-    if m is None:
-        m = REGEX_IMM_HEX.match(op)
-    if m is not None:
-        op = int(op)
-        assert (gen_r is None) and (gen_i is not None)
-        return gen_i(op)
-
-    if op in dir(Register):
-        op = Register[op]
-        assert (gen_r is not None) and (gen_i is None)
-        return gen_r(op)
-
-    label = mangle_label(op.lower())
-    if label not in label_refs:
-        label_refs[label] = []
-    label_refs[label].append(len(program))
-
-    op = 0
-    assert (gen_r is None) and (gen_i is not None)
-    return gen_i(op)
-
-
-def asm_load(line: str) -> int:
-    m = REGEX_LOAD.match(line.upper())
-    assert m is not None
-    dst, src = Register[m.group(1).upper()], Register[m.group(2).upper()]
-    return gen_load_rr(dst, src)
-def asm_store(line: str) -> int:
-    m = REGEX_STORE.match(line.upper())
-    assert m is not None
-    dst, src = Register[m.group(1).upper()], Register[m.group(2).upper()]
-    return gen_store_rr(dst, src)
-def asm_mov(line: str) -> int:
-    return asm_generic_instr_dst_src(line, REGEX_GENERIC_INSTR_DST_SRC, gen_mov_rr, gen_mov_ri)
-def asm_add(line: str) -> int:
-    return asm_generic_instr_dst_src(line, REGEX_GENERIC_INSTR_DST_SRC, gen_add_rr, gen_add_ri)
-def asm_sub(line: str) -> int:
-    return asm_generic_instr_dst_src(line, REGEX_GENERIC_INSTR_DST_SRC, gen_sub_rr, gen_sub_ri)
-def asm_and(line: str) -> int:
-    return asm_generic_instr_dst_src(line, REGEX_GENERIC_INSTR_DST_SRC, gen_and_rr, gen_and_ri)
-def asm_or(line: str) -> int:
-    return asm_generic_instr_dst_src(line, REGEX_GENERIC_INSTR_DST_SRC, gen_or_rr, gen_or_ri)
-def asm_xor(line: str) -> int:
-    return asm_generic_instr_dst_src(line, REGEX_GENERIC_INSTR_DST_SRC, gen_xor_rr, gen_xor_ri)
-def asm_not(line: str) -> int:
-    return asm_generic_instr_op(line, REGEX_GENERIC_INSTR_OP, gen_not_r, None)
-def asm_cmp(line: str) -> int:
-    return asm_generic_instr_dst_src(line, REGEX_GENERIC_INSTR_DST_SRC, gen_cmp_rr, gen_cmp_ri)
-def asm_push(line: str) -> int:
-    return asm_generic_instr_op(line, REGEX_GENERIC_INSTR_OP, gen_push_r, None)
-def asm_pop(line: str) -> int:
-    return asm_generic_instr_op(line, REGEX_GENERIC_INSTR_OP, gen_pop_r, None)
-def asm_call(line: str) -> int:
-    return asm_generic_instr_op(line, REGEX_GENERIC_INSTR_OP, None, gen_call_i)
-def asm_ret(line: str) -> int:
-    return gen_ret()
-def asm_jmp(line: str) -> int:
-    return asm_generic_instr_op(line, REGEX_GENERIC_INSTR_OP, None, gen_jmp_i)
-def asm_jmpz(line: str) -> int:
-    return asm_generic_instr_op(line, REGEX_GENERIC_INSTR_OP, None, gen_jmpz_i)
-def asm_jmpnz(line: str) -> int:
-    return asm_generic_instr_op(line, REGEX_GENERIC_INSTR_OP, None, gen_jmpnz_i)
-def asm_jmpeq(line: str) -> int:
-    return asm_generic_instr_op(line, REGEX_GENERIC_INSTR_OP, None, gen_jmpeq_i)
-def asm_jmpne(line: str) -> int:
-    return asm_generic_instr_op(line, REGEX_GENERIC_INSTR_OP, None, gen_jmpne_i)
-def asm_jmpgt(line: str) -> int:
-    return asm_generic_instr_op(line, REGEX_GENERIC_INSTR_OP, None, gen_jmpgt_i)
-def asm_jmplt(line: str) -> int:
-    return asm_generic_instr_op(line, REGEX_GENERIC_INSTR_OP, None, gen_jmplt_i)
-def asm_jmpge(line: str) -> int:
-    return asm_generic_instr_op(line, REGEX_GENERIC_INSTR_OP, None, gen_jmpge_i)
-def asm_jmple(line: str) -> int:
-    return asm_generic_instr_op(line, REGEX_GENERIC_INSTR_OP, None, gen_jmple_i)
-
-
-def num_bytes(bin_enc: int) -> int:
-    return ceil(len(f"{bin_enc:x}") / 2)
-
-
-def asm_instr(instr: str, line: str):
-    match instr.upper():
-        case 'LOAD':
-            bin_enc = asm_load(line)
-        case 'STORE':
-            bin_enc = asm_store(line)
-        case 'MOV':
-            bin_enc = asm_mov(line)
-        case 'ADD':
-            bin_enc = asm_add(line)
-        case 'SUB':
-            bin_enc = asm_sub(line)
-        case 'AND':
-            bin_enc = asm_and(line)
-        case 'OR':
-            bin_enc = asm_or(line)
-        case 'XOR':
-            bin_enc = asm_xor(line)
-        case 'NOT':
-            bin_enc = asm_not(line)
-        case 'CMP':
-            bin_enc = asm_cmp(line)
-        case 'PUSH':
-            bin_enc = asm_push(line)
-        case 'POP':
-            bin_enc = asm_pop(line)
-        case 'CALL':
-            bin_enc = asm_call(line)
-        case 'RET':
-            bin_enc = asm_ret(line)
-        case 'JMP':
-            bin_enc = asm_jmp(line)
-        case 'JMPZ':
-            bin_enc = asm_jmpz(line)
-        case 'JMPNZ':
-            bin_enc = asm_jmpnz(line)
-        case 'JMPEQ':
-            bin_enc = asm_jmpeq(line)
-        case 'JMPNE':
-            bin_enc = asm_jmpne(line)
-        case 'JMPGT':
-            bin_enc = asm_jmpgt(line)
-        case 'JMPLT':
-            bin_enc = asm_jmplt(line)
-        case 'JMPGE':
-            bin_enc = asm_jmpge(line)
-        case 'JMPLE':
-            bin_enc = asm_jmple(line)
-        case _:
-            sys.exit(f"Unknown instruction '{instr}'.")
-    
-    program.append(bin_enc)
-
-    global program_size
-    program_size += num_bytes(bin_enc)
-
-
-def asm_label(label: str):
-    global label_cur_top_level
-    if is_high_level_label(label):
-        label_cur_top_level = label
-    label_addr[mangle_label(label)] = program_size
-
-
-def strip_comment(line: str) -> str:
-    pos = line.find(";")
-    if pos != -1:
-        line = line[:pos]
-    return line
-
-
-def strip_whitespaces(line: str) -> str:
-    return line.strip()
-
-
-def asm_line(line: str):
-    line = strip_comment(line)
-    line = strip_whitespaces(line)
-    if not line:
-        return
-
-    m_label = REGEX_LABEL.match(line)
-    if m_label is not None:
-        label = m_label.group(1)
-        asm_label(label)
-        return
-    
-    m_instr = REGEX_INSTR.match(line)
-    if m_instr is not None:
-        instr = m_instr.group(1)
-        asm_instr(instr, line)
-        return
+# decimal or 0x prefixed hexadecimal, upper case
+def asm_immediate(operand: str) -> Optional[int]:
+    if operand.isdecimal() and operand.isascii():
+        imm: int = int(operand)
+    elif REGEX_IMM_HEX.match(operand) is not None:
+        imm = int(operand, base=16)
+    else:
+        return None
+    if imm > 0xffffffff:
+        sys.exit(f"Immediate '{operand.lower()}' out of range.")
+    return imm
 
 
-def link():
-    for label, refs in label_refs.items():
-        addr = label_addr[label]
-        for ref in refs:
-            program[ref] |= gen_i(addr)
+def asm_register(operand: str, line: str) -> int:
+    reg: Optional[int] = REGISTERS.get(operand)
+    if reg is None:
+        sys.exit(f"Invalid operand '{operand.lower()}' in '{line}'.")
+    return reg
+
+
+# [base], [base+disp], [base-disp] or [base+index*scale], as base, disp, index and scale
+def asm_address(address: str) -> Tuple[int, Optional[int], Optional[int], int]:
+    m = REGEX_ADDRESS.match(address)
+    if m is None or m.group(1) not in REGISTERS:
+        sys.exit(f"Invalid address '{address}'.")
+
+    base, sign, offset, scale = REGISTERS[m.group(1)], m.group(2), m.group(3), m.group(4)
+    if sign is None:
+        return base, None, None, 0
+
+    if offset in REGISTERS:
+        if sign != '+' or (scale or '1') not in SCALES:
+            sys.exit(f"Invalid address '{address}'.")
+        return base, None, REGISTERS[offset], SCALES[scale or '1']
+
+    disp: Optional[int] = asm_immediate(offset)
+    if scale is not None or disp is None:
+        sys.exit(f"Invalid address '{address}'.")
+    return base, (disp if sign == '+' else -disp) & 0xffffffff, None, 0
+
+
+@dataclass
+class Assembly:
+    code: bytearray
+    offsets: List[int]                          # where each instruction starts
+    labels: Dict[str, int]                      # mangled label -> address
+
+    def image(self) -> bytes:
+        return bytes(self.code)
+
+    def instructions(self) -> List[bytes]:
+        ends: List[int] = self.offsets[1:] + [len(self.code)]
+        return [bytes(self.code[start:end]) for start, end in zip(self.offsets, ends)]
+
+    def symbols(self) -> List[Tuple[int, str]]:
+        # as emitted by -l: sorted by address, local labels under their own names
+        return sorted([(a, demangle_label(l)[-1]) for (l, a) in self.labels.items()])
+
+    def to_image(self) -> Image:
+        return Image(self.image(), DEFAULT_ENTRY, symbols=self.symbols())
+
+
+def object_symbols(obj: Object) -> List[Tuple[int, str]]:
+    # as Assembly.symbols(), at offsets into the object
+    return sorted([(a, demangle_label(l)[-1]) for (a, l) in obj.symbols])
+
+
+OPERAND_COUNTS: Dict[Operands, int] = {
+    Operands.NONE: 0, Operands.REG: 1, Operands.TARGET: 1, Operands.DST_SRC: 2, Operands.LOAD: 2, Operands.STORE: 2,
+}
+
+
+@dataclass
+class Statement:
+    # A label, as written and mangled, or an instruction, with its operands split as its kind has them: DST_SRC as
+    # dst and src, LOAD as reg and address, STORE as address and reg, TARGET as a mangled label or an immediate;
+    # operands that do not split so are kept whole, and the instruction left alone.
+    label: str                                  = ''
+    mangled: str                                = ''
+    mnemonic: str                               = ''
+    operands: List[str]                         = field(default_factory=list)
+    line: str                                   = ''
+
+    def kind(self) -> Optional[Operands]:
+        entry: Optional[Tuple[Operands, int, int]] = OPCODES.get(self.mnemonic)
+        if entry is None or len(self.operands) != OPERAND_COUNTS[entry[0]]:
+            return None
+        return entry[0]
+
+    def target(self) -> Optional[str]:
+        # the label a jump or call goes to, if it goes to one
+        if self.kind() != Operands.TARGET or self.operands[0][:1].isdigit():
+            return None
+        return self.operands[0]
+
+
+def instr(mnemonic: str, operands: List[str]) -> Statement:
+    return Statement(mnemonic=mnemonic, operands=operands, line=f"{mnemonic} {', '.join(operands)}".lower())
+
+
+def imm_operand(operand: str) -> Optional[int]:
+    return asm_immediate(operand) if operand not in REGISTERS else None
+
+
+def reg_uses(stmt: Statement) -> Optional[Tuple[List[str], List[str]]]:
+    # The registers an instruction reads and writes; None for labels, jumps, calls and returns, past which
+    # nothing is known.
+    kind: Optional[Operands] = stmt.kind()
+    ops: List[str] = stmt.operands
+    if kind == Operands.DST_SRC:
+        src: List[str] = [ops[1]] if ops[1] in REGISTERS else []
+        if stmt.mnemonic == 'MOV':
+            return src, [ops[0]]
+        if stmt.mnemonic == 'CMP':
+            return [ops[0]] + src, []
+        return [ops[0]] + src, [ops[0]]
+    if kind == Operands.REG:
+        if stmt.mnemonic == 'PUSH':
+            return [ops[0], 'SP'], ['SP']
+        if stmt.mnemonic == 'POP':
+            return ['SP'], [ops[0], 'SP']
+        return [ops[0]], [ops[0]]
+    if kind == Operands.LOAD or kind == Operands.STORE:
+        m = REGEX_ADDRESS.match(ops[1] if kind == Operands.LOAD else ops[0])
+        regs: List[str] = [r for r in (m.groups()[::2] if m is not None else []) if r in REGISTERS]
+        if kind == Operands.LOAD:
+            return regs, [ops[0]]
+        return regs + [ops[1]], []
+    return None
+
+
+def is_dead(stmts: List[Statement], start: int, reg: str) -> bool:
+    # Whether reg is written before it is read, from stmts[start] on, within what runs straight through.
+    for stmt in stmts[start:]:
+        uses: Optional[Tuple[List[str], List[str]]] = reg_uses(stmt)
+        # writing PC jumps, as much as a jump does
+        if uses is None or reg in uses[0] or 'PC' in uses[1]:
+            return False
+        if reg in uses[1]:
+            return True
+    return False
+
+
+def drop_unreachable(stmts: List[Statement]) -> List[Statement]:
+    # Nothing runs past an unconditional jump or a return but from a label.
+    result: List[Statement] = []
+    reachable: bool = True
+    for stmt in stmts:
+        if stmt.label:
+            reachable = True
+        if reachable:
+            result.append(stmt)
+        if stmt.mnemonic == 'JMP' or stmt.mnemonic == 'RET':
+            reachable = False
+    return result
+
+
+def thread_jumps(stmts: List[Statement]) -> List[Statement]:
+    # A jump to a jump goes straight to where the latter goes; calls are left alone.
+    jumps: Dict[str, str] = {}                  # label -> label the jump right after it goes to
+    labels: List[str] = []
+    for stmt in stmts:
+        if stmt.label:
+            labels.append(stmt.mangled)
+            continue
+        target: Optional[str] = stmt.target()
+        if stmt.mnemonic == 'JMP' and target is not None:
+            jumps.update({label: target for label in labels})
+        labels = []
+
+    result: List[Statement] = []
+    for stmt in stmts:
+        target = stmt.target()
+        if stmt.mnemonic.startswith('JMP') and target is not None and target in jumps:
+            seen: List[str] = [target]
+            while target in jumps and jumps[target] not in seen:
+                target = jumps[target]
+                seen.append(target)
+            if target != stmt.operands[0]:
+                stmt = instr(stmt.mnemonic, [target])
+        result.append(stmt)
+    return result
+
+
+def fold(stmts: List[Statement]) -> List[Statement]:
+    # Instruction by instruction, with what follows: push and pop of the same register, adds and subs of
+    # immediates to the same register, and mov r, sp (add r, imm) with a load or store at [r] thereafter,
+    # r not being used past it, to a load or store at [sp+imm]; and mov r, 0 to the shorter xor r, r. None of
+    # these touch an instruction writing PC, where execution resumes depending on its length.
+    result: List[Statement] = []
+    i: int = 0
+    while i < len(stmts):
+        cur: Statement = stmts[i]
+        nxt: Optional[Statement] = stmts[i + 1] if i + 1 < len(stmts) else None
+        kind: Optional[Operands] = cur.kind()
+
+        if nxt is not None and cur.mnemonic == 'PUSH' and nxt.mnemonic == 'POP' \
+                and kind is not None and nxt.kind() is not None and cur.operands == nxt.operands \
+                and cur.operands[0] not in ('SP', 'PC'):
+            i += 2
+            continue
+
+        if nxt is not None and cur.mnemonic in ('ADD', 'SUB') and nxt.mnemonic in ('ADD', 'SUB') \
+                and kind is not None and nxt.kind() is not None and cur.operands[0] == nxt.operands[0] != 'PC':
+            cur_imm: Optional[int] = imm_operand(cur.operands[1])
+            nxt_imm: Optional[int] = imm_operand(nxt.operands[1])
+            if cur_imm is not None and nxt_imm is not None:
+                imm: int = (cur_imm if cur.mnemonic == 'ADD' else -cur_imm) \
+                         + (nxt_imm if nxt.mnemonic == 'ADD' else -nxt_imm)
+                imm &= 0xffffffff
+                if imm:
+                    result.append(instr('ADD', [cur.operands[0], f"{imm}"]) if imm < 0x80000000
+                                  else instr('SUB', [cur.operands[0], f"{0x100000000 - imm}"]))
+                i += 2
+                continue
+
+        if cur.mnemonic == 'MOV' and kind is not None and cur.operands[1] == 'SP' \
+                and cur.operands[0] in REGISTERS and cur.operands[0] not in ('SP', 'PC'):
+            folded: Optional[Tuple[Statement, int]] = fold_sp_address(stmts, i)
+            if folded is not None:
+                result.append(folded[0])
+                i = folded[1]
+                continue
+
+        if cur.mnemonic == 'MOV' and kind is not None and cur.operands[0] in REGISTERS and cur.operands[0] != 'PC' \
+                and imm_operand(cur.operands[1]) == 0:
+            cur = instr('XOR', [cur.operands[0], cur.operands[0]])
+
+        result.append(cur)
+        i += 1
+    return result
+
+
+def fold_sp_address(stmts: List[Statement], i: int) -> Optional[Tuple[Statement, int]]:
+    # mov r, sp at stmts[i], maybe add r, imm, then a load or store at [r] or [r+disp]; as the load or store at
+    # [sp+disp] and the index of what follows
+    reg: str = stmts[i].operands[0]
+    disp: int = 0
+    j: int = i + 1
+    if j < len(stmts) and stmts[j].mnemonic in ('ADD', 'SUB') and stmts[j].kind() is not None \
+            and stmts[j].operands[0] == reg:
+        imm: Optional[int] = imm_operand(stmts[j].operands[1])
+        if imm is None:
+            return None
+        disp = imm if stmts[j].mnemonic == 'ADD' else -imm
+        j += 1
+    if j >= len(stmts):
+        return None
+
+    mem: Statement = stmts[j]
+    kind: Optional[Operands] = mem.kind()
+    if kind != Operands.LOAD and kind != Operands.STORE:
+        return None
+    data, address = (mem.operands[0], mem.operands[1]) if kind == Operands.LOAD else (mem.operands[1], mem.operands[0])
+    m = REGEX_ADDRESS.match(address)
+    if m is None or m.group(1) != reg or m.group(3) in REGISTERS or (kind == Operands.STORE and data == reg) \
+            or data == 'PC':
+        return None
+    if m.group(2) is not None:
+        offset: Optional[int] = asm_immediate(m.group(3))
+        if offset is None or m.group(4) is not None:
+            return None
+        disp += offset if m.group(2) == '+' else -offset
+    # r holds sp+disp no more once loaded over, or else must not be read again
+    if not (kind == Operands.LOAD and data == reg) and not is_dead(stmts, j + 1, reg):
+        return None
+
+    disp &= 0xffffffff
+    sp_address: str = '[SP]' if disp == 0 else f"[SP+{disp}]" if disp < 0x80000000 else f"[SP-{0x100000000 - disp}]"
+    return instr(mem.mnemonic, [data, sp_address] if kind == Operands.LOAD else [sp_address, data]), j + 1
+
+
+def peephole(stmts: List[Statement]) -> List[Statement]:
+    # Labels stay put, so that the addresses they get, after this, are those of what follows them still; a
+    # source that jumps or calls to a fixed address other than $sys_enter is left as it is, its layout mattering.
+    if any(stmt.kind() == Operands.TARGET and stmt.target() is None and asm_immediate(stmt.operands[0]) != 0
+           for stmt in stmts):
+        return stmts
+    while True:
+        optimized: List[Statement] = fold(thread_jumps(drop_unreachable(stmts)))
+        if optimized == stmts:
+            return stmts
+        stmts = optimized
+
+
+class Assembler:
+    """Assembles one source at a time; an instance may be reused, but not shared between threads."""
+
+    def __init__(self, optimize: bool = False):
+        self.optimize: bool = optimize
+        self.reset()
+
+    def reset(self):
+        self.label_cur_top_level: str = 'n/a'
+        self.label_refs: Dict[str, List[int]] = {}
+        self.label_addr: Dict[str, int] = {}
+
+        self.code: bytearray = bytearray()
+        self.offsets: List[int] = []
+
+        self.relocations: List[int] = []
+        self.externals: List[Tuple[int, str]] = []
+
+    def assemble(self, input: TextIO) -> Assembly:
+        self.reset()
+        self.asm_file(io.StringIO(SYS_ENTER_ASM))
+        self.asm_source(input)
+        self.link()
+        return Assembly(self.code, self.offsets, self.label_addr)
+
+    def assemble_object(self, input: TextIO) -> Object:
+        # No $sys_enter, which link.py puts first; the text may go anywhere, and may use labels from elsewhere.
+        self.reset()
+        self.asm_source(input)
+        self.link(relocatable=True)
+        return Object(bytes(self.code), [(a, l) for (l, a) in self.label_addr.items()],
+                      sorted(self.relocations), sorted(self.externals))
+
+    def mangle_label(self, label: str) -> str:
+        return label if is_high_level_label(label) else f"{self.label_cur_top_level}:{label}"
+
+    def asm_instr(self, mnemonic: str, operands: str, line: str, mangled: bool = False):
+        # One instruction, encoded straight into the code; label references are left as zeros, for link().
+        # Coming from peephole(), a label the instruction goes to is mangled already.
+        entry: Optional[Tuple[Operands, int, int]] = OPCODES.get(mnemonic.upper())
+        if entry is None:
+            sys.exit(f"Unknown instruction '{mnemonic}'.")
+        kind, opcode, indexed = entry
+
+        code: bytearray = self.code
+        self.offsets.append(len(code))
+
+        if kind == Operands.DST_SRC:
+            dst, comma, src = operands.upper().partition(',')
+            if not comma:
+                sys.exit(f"Invalid operands in '{line}'.")
+            dst_reg: int = asm_register(dst.strip(), line)
+            src = src.strip()
+            src_reg: Optional[int] = REGISTERS.get(src)
+            if src_reg is not None:
+                code += bytes((opcode, (dst_reg << 4) | src_reg))
+                return
+            imm: Optional[int] = asm_immediate(src)
+            if imm is None:
+                sys.exit(f"Invalid operand '{src.lower()}' in '{line}'.")
+            code += bytes((opcode | RegImm.IMM, dst_reg << 4))
+            code += imm.to_bytes(4, byteorder='little')
+
+        elif kind == Operands.TARGET:
+            target: str = operands.strip()
+            imm = asm_immediate(target.upper())
+            code.append(opcode | RegImm.IMM)
+            if imm is None:
+                if not target:
+                    sys.exit(f"Invalid operands in '{line}'.")
+                label: str = target if mangled else self.mangle_label(target.lower())
+                self.label_refs.setdefault(label, []).append(len(code))
+                imm = 0
+            code += imm.to_bytes(4, byteorder='little')
+
+        elif kind == Operands.LOAD or kind == Operands.STORE:
+            if kind == Operands.LOAD:
+                reg, comma, address = operands.upper().partition(',')
+            else:
+                address, comma, reg = operands.upper().rpartition(',')
+            if not comma:
+                sys.exit(f"Invalid operands in '{line}'.")
+            reg_reg: int = asm_register(reg.strip(), line)
+            base, disp, index, scale = asm_address(address.strip())
+            # LOAD dst, [src...] and STORE [dst...], src
+            regs: int = (reg_reg << 4) | base if kind == Operands.LOAD else (base << 4) | reg_reg
+            if index is not None:
+                if not indexed:
+                    sys.exit(f"Invalid address '{address.strip()}'; only words can be indexed.")
+                code += bytes((indexed, regs, (index << 4) | scale))
+            elif disp is not None:
+                code += bytes((opcode | RegImm.IMM, regs))
+                code += disp.to_bytes(4, byteorder='little')
+            else:
+                code += bytes((opcode, regs))
+
+        elif kind == Operands.REG:
+            code += bytes((opcode, asm_register(operands.strip().upper(), line) << 4))
+
+        else:
+            if operands.strip():
+                sys.exit(f"Invalid operands in '{line}'.")
+            code.append(opcode)
+
+    def asm_label(self, label: str):
+        if is_high_level_label(label):
+            self.label_cur_top_level = label
+        self.label_addr[self.mangle_label(label)] = len(self.code)
+
+    def asm_line(self, line: str):
+        line = line.partition(';')[0].strip()
+        if not line:
+            return
+
+        if line[-1] == ':' and len(line) > 1:
+            self.asm_label(line[:-1])
+            return
+        # neither a label nor an instruction, as # comments
+        if not line[0].isalpha():
+            return
+
+        instr: List[str] = line.split(None, 1)
+        self.asm_instr(instr[0], instr[1] if len(instr) > 1 else '', line)
+
+    def link(self, relocatable: bool = False):
+        # Relocatable, the addresses are offsets into the code, to be moved along with it, and references to
+        # top level labels not defined here are left to the linker; local labels are always defined here.
+        code: bytearray = self.code
+        for label, refs in self.label_refs.items():
+            addr: Optional[int] = self.label_addr.get(label)
+            if addr is None:
+                if not relocatable or is_low_level_label(demangle_label(label)[-1]):
+                    sys.exit(f"Unknown label '{demangle_label(label)[-1]}'.")
+                self.externals += [(ref, label) for ref in refs]
+                continue
+            target: bytes = addr.to_bytes(4, byteorder='little')
+            for ref in refs:
+                code[ref:ref + 4] = target
+            if relocatable:
+                self.relocations += refs
+
+    def asm_file(self, input: TextIO):
+        for line in input:
+            self.asm_line(line)
+
+    def asm_source(self, input: TextIO):
+        # Optimizing, the whole source is parsed first, then optimized, then encoded; the labels get their
+        # addresses only then, from what is left.
+        if not self.optimize:
+            self.asm_file(input)
+            return
+        label_cur_top_level: str = self.label_cur_top_level
+        stmts: List[Statement] = peephole([stmt for line in input if (stmt := self.parse_line(line)) is not None])
+        self.label_cur_top_level = label_cur_top_level
+        for stmt in stmts:
+            if stmt.label:
+                self.asm_label(stmt.label)
+            else:
+                self.asm_instr(stmt.mnemonic, ', '.join(stmt.operands), stmt.line, stmt.target() is not None)
+
+    def parse_line(self, line: str) -> Optional[Statement]:
+        # as asm_line(), but into a statement for peephole()
+        line = line.partition(';')[0].strip()
+        if not line:
+            return None
+
+        if line[-1] == ':' and len(line) > 1:
+            label: str = line[:-1]
+            if is_high_level_label(label):
+                self.label_cur_top_level = label
+            return Statement(label=label, mangled=self.mangle_label(label))
+        if not line[0].isalpha():
+            return None
+
+        instr: List[str] = line.split(None, 1)
+        mnemonic: str = instr[0].upper()
+        operands: str = instr[1] if len(instr) > 1 else ''
+        entry: Optional[Tuple[Operands, int, int]] = OPCODES.get(mnemonic)
+        kind: Optional[Operands] = entry[0] if entry is not None else None
+        split: List[str] = [operands]
+        if kind == Operands.NONE and not operands.strip():
+            split = []
+        elif kind == Operands.REG:
+            split = [operands.strip().upper()]
+        elif kind == Operands.TARGET:
+            target: str = operands.strip()
+            split = [target.upper() if asm_immediate(target.upper()) is not None else self.mangle_label(target.lower())]
+        elif kind == Operands.DST_SRC or kind == Operands.LOAD or kind == Operands.STORE:
+            first, comma, second = operands.upper().rpartition(',') if kind == Operands.STORE \
+                                   else operands.upper().partition(',')
+            if comma:
+                split = [first.strip(), second.strip()]
+        return Statement(mnemonic=mnemonic if entry is not None else instr[0], operands=split, line=line)
+
+
+def dump_program(assembly: Assembly, output: TextIO):
+    output.writelines([instr.hex(' ') + '\n' for instr in assembly.instructions()])
+
+
+def dump_labels(symbols: List[Tuple[int, str]], labels: TextIO):
+    for addr, label in symbols:
+        print(f"{addr:>8x}   {label}", file=labels)
+
+
+def write_labels(symbols: List[Tuple[int, str]], labels_file_name: Optional[str]):
+    if labels_file_name is not None:
+        with open(labels_file_name, mode='w', encoding='utf-8') as labels:
+            dump_labels(symbols, labels)
+
+
+def write_program(assembly: Assembly | Object, output_file_name: Optional[str], format: Format):
+    if isinstance(assembly, Assembly) and format == Format.HEX:
+        with open(output_file_name, mode='w', encoding='utf-8') if output_file_name is not None \
+                else nullcontext(sys.stdout) as output:
+            dump_program(assembly, output)
+    else:
+        with open(output_file_name, mode='wb') if output_file_name is not None \
+                else nullcontext(sys.stdout.buffer) as output:
+            if isinstance(assembly, Object):
+                write_object(assembly, output)
+            else:
+                write_image(assembly.to_image(), output)
+
+
+@functools.cache
+def assembler_digest() -> bytes:
+    # Objects are kept by source and by the assembler that made them, so that a change to either misses the cache.
+    digest = hashlib.sha256(f"{OBJECT_VERSION}".encode())
+    for module in ['asm.py', 'asmspec.py', 'image.py']:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module), mode='rb') as file:
+            digest.update(file.read())
+    return digest.digest()
+
+
+def assemble_object(input: TextIO, cache_dir: Optional[str] = None, optimize: bool = False) -> Object:
+    source: str = input.read()
+    if cache_dir is None:
+        return Assembler(optimize).assemble_object(io.StringIO(source))
+
+    key: str = hashlib.sha256(assembler_digest() + bytes([optimize]) + source.encode()).hexdigest()
+    cache_file_name: str = os.path.join(cache_dir, f"{key}.obj")
+    try:
+        return load_object(cache_file_name)
+    except (OSError, ValueError):
+        pass
+    obj: Object = Assembler(optimize).assemble_object(io.StringIO(source))
+    # Written aside and moved in place, as other processes may be after the same object.
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file_name: str = f"{cache_file_name}.{os.getpid()}"
+    with open(tmp_file_name, mode='wb') as output:
+        write_object(obj, output)
+    os.replace(tmp_file_name, cache_file_name)
+    return obj
+
+
+def assemble_input(input: TextIO, format: Format, cache_dir: Optional[str],
+                   optimize: bool) -> Tuple[Assembly | Object, List[Tuple[int, str]]]:
+    if format == Format.OBJECT:
+        obj: Object = assemble_object(input, cache_dir, optimize)
+        return obj, object_symbols(obj)
+    assembly: Assembly = Assembler(optimize).assemble(input)
+    return assembly, assembly.symbols()
+
+
+def assemble_file(input_file_name: str, output_file_name: str, labels_file_name: Optional[str],
+                  format: Format = Format.IMAGE, cache_dir: Optional[str] = None,
+                  optimize: bool = False) -> Optional[str]:
+    # Returns why the file could not be assembled, if it could not; a batch carries on with the others.
+    try:
+        with open(input_file_name, mode='r', encoding='utf-8') as input:
+            program, symbols = assemble_input(input, format, cache_dir, optimize)
+    except SystemExit as e:
+        return f"{input_file_name}: {e.code}"
+    write_program(program, output_file_name, format)
+    write_labels(symbols, labels_file_name)
+    return None
+
+
+def assemble_batch(input_file_names: List[str], output_dir: Optional[str] = None, labels_dir: Optional[str] = None,
+                   jobs: Optional[int] = None, format: Format = Format.IMAGE,
+                   cache_dir: Optional[str] = None, optimize: bool = False) -> List[Optional[str]]:
+    # One process per worker, each assembling a share of the files, so that the interpreter starts once per worker
+    # rather than once per file; returns, in order, why each file could not be assembled, or None.
+    def output_name(input_file_name: str, dir_name: Optional[str], suffix: str) -> str:
+        base: str = os.path.splitext(input_file_name)[0]
+        return base + suffix if dir_name is None else os.path.join(dir_name, os.path.basename(base) + suffix)
+
+    suffix: str = {Format.IMAGE: '.img', Format.HEX: '.hex', Format.OBJECT: '.obj'}[format]
+    output_file_names: List[str] = [output_name(f, output_dir, suffix) for f in input_file_names]
+    labels_file_names: List[Optional[str]] = [output_name(f, labels_dir, '.lbl') if labels_dir is not None else None
+                                              for f in input_file_names]
+
+    workers: int = jobs or os.cpu_count() or 1
+    chunk_size: int = max(1, len(input_file_names) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(assemble_file, input_file_names, output_file_names, labels_file_names,
+                             [format] * len(input_file_names), [cache_dir] * len(input_file_names),
+                             [optimize] * len(input_file_names),
+                             chunksize=chunk_size))
 
 
-def asm_file(input: TextIO):
-    for line in input:
-        asm_line(line)
-    link()
+def assemble():
+    args = parse_args()
 
+    if len(args.input_files) > 1:
+        failed: bool = False
+        for error in assemble_batch(args.input_files, args.output_file, args.labels_file, args.jobs, args.format,
+                                    args.cache_dir, args.optimize):
+            if error is not None:
+                print(error, file=sys.stderr)
+                failed = True
+        if failed:
+            sys.exit(1)
+        return
 
-def dump_program(output: TextIO):
-    for bin_enc in program:
-        hex_enc = f"{bin_enc:x}"
-        if len(hex_enc) % 2 == 1:
-            hex_enc = '0' + hex_enc
-        print(' '.join([hex_enc[i:i+2] for i in range(0, len(hex_enc), 2)]), file=output)
+    input_file: TextIO = sys.stdin
+    if args.input_files:
+        input_file = open(args.input_files[0], mode='r', encoding='utf-8')  # type: ignore
 
+    with input_file as input:
+        program, symbols = assemble_input(input, args.format, args.cache_dir, args.optimize)
+    write_program(program, args.output_file, args.format)
+    write_labels(symbols, args.labels_file)
 
-def assemble():
-    args = parse_args()
 
-    input_file: TextIO = sys.stdin
-    output_file: TextIO = sys.stdout
-    labels_file: TextIO | None = None
-
-    if args.input_file is not None:
-        input_file = open(args.input_file, mode='r', encoding='utf-8')      # type: ignore
-    if args.output_file is not None:
-        output_file = open(args.output_file, mode='w', encoding='utf-8')    # type: ignore
-    if args.labels_file is not None:
-        labels_file = open(args.labels_file, mode='w', encoding='utf-8')    # type: ignore
-
-    with output_file as output:
-        with input_file as input:
-            asm_file(SYS_ENTER_ASM)
-            asm_file(input)
-            dump_program(output)
-        if labels_file is not None:
-            with labels_file as labels:
-                for addr, label in sorted([(a, demangle_label(l)[-1]) for (l, a) in label_addr.items()]):
-                    print(f"{addr:>8x}   {label}", file=labels)
-
-
-assemble()
+if __name__ == '__main__':
+    assemble()
@@ -26,6 +26,22 @@ class Instruction(IntEnum):
     JMPLT   = 21
     JMPGE   = 22
     JMPLE   = 23
+    MUL     = 24
+    DIV     = 25
+    SDIV    = 26
+    MOD     = 27
+    SMOD    = 28
+    SHL     = 29
+    SHR     = 30
+    SAR     = 31
+    LOADX   = 32
+    STOREX  = 33
+    LOADB   = 34
+    LOADSB  = 35
+    LOADH   = 36
+    LOADSH  = 37
+    STOREB  = 38
+    STOREH  = 39
 
     def __repr__(self) -> str:
         return self.name
@@ -1,10 +1,12 @@
 import argparse
+import io
 import sys
 
 from dataclasses import dataclass
-from typing import Dict, List, Set, TextIO, Tuple
+from typing import BinaryIO, Dict, List, Set, TextIO, Tuple
 
 from asmspec import Instruction, RegImm, Register
+from image import IMAGE_MAGIC, Image, read_image
 
 
 @dataclass
@@ -15,10 +17,23 @@ class VMInstrData:
     src: Register | int | None  = None
     label: str | None           = None
     len: int                    = 0
+    disp: int | None            = None             # [base+disp], base in src for LOAD, dst for STORE
+    index: Register | None      = None             # [base+index*scale]
+    scale: int                  = 1
 
 
 LABEL_PREFIX: str = '.l'
 
+# the indexed forms share their mnemonic with the plain ones
+MNEMONICS: Dict[Instruction, Instruction] = {
+    Instruction.LOADX:  Instruction.LOAD,
+    Instruction.STOREX: Instruction.STORE,
+}
+
+LOADS: List[Instruction] = [Instruction.LOAD, Instruction.LOADB, Instruction.LOADSB,
+                            Instruction.LOADH, Instruction.LOADSH]
+STORES: List[Instruction] = [Instruction.STORE, Instruction.STOREB, Instruction.STOREH]
+
 hex_bytes_buffer: List[str] = []
 
 cur_addr: int = 0
@@ -30,14 +45,15 @@ rev_label_addr: Dict[int, str] = {}
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description='VM disassembler.')
-    parser.add_argument('input_file', metavar='HEX', type=str, nargs='?', \
-                        help='input file to process; defaults to STDIN if unspecified')
+    parser.add_argument('input_file', metavar='IMG', type=str, nargs='?', \
+                        help='input file to process, a VM image or hex text; defaults to STDIN if unspecified')
     parser.add_argument('-o', '--output', metavar='ASM', type=str, dest='output_file', \
                         required=False, \
                         help='output file to emit VM asm to; defaults to STDOUT if unspecified')
     parser.add_argument('-l', '--labels', metavar='LBL', type=str, dest='labels_file', \
                         required=False, \
-                        help='input file containing assembler labels; defaults to none if unspecified')
+                        help='''input file containing assembler labels; defaults to the symbols of the image,
+                                if any, if unspecified''')
     return parser.parse_args()
 
 
@@ -130,6 +146,20 @@ def disasm_instr_ri(input: TextIO) -> VMInstrData:
     return VMInstrData(instr, ri, dst=dst, src=disasm_imm(input), len=6)
 
 
+def disasm_instr_rri(input: TextIO) -> VMInstrData:
+    instr, ri = disasm_opcode(input)
+    dst, src = disasm_reg_reg(input)
+    return VMInstrData(instr, ri, dst=dst, src=src, disp=disasm_imm(input), len=6)
+
+
+def disasm_instr_rrr(input: TextIO) -> VMInstrData:
+    instr, ri = disasm_opcode(input)
+    dst, src = disasm_reg_reg(input)
+    index_scale: int = int(get_hex_byte(input), base=16)
+    return VMInstrData(instr, ri, dst=dst, src=src, index=Register(index_scale >> 4), scale=1 << (index_scale & 0x03),
+                       len=3)
+
+
 def disasm_instr_src_dst(input: TextIO) -> VMInstrData:
     opcode: Tuple[Instruction, RegImm] | None = peek_opcode(input)
     assert opcode is not None
@@ -141,10 +171,21 @@ def disasm_instr_src_dst(input: TextIO) -> VMInstrData:
             return disasm_instr_ri(input)
 
 
+def disasm_instr_address(input: TextIO) -> VMInstrData:
+    opcode: Tuple[Instruction, RegImm] | None = peek_opcode(input)
+    assert opcode is not None
+    _, ri = opcode
+    match ri:
+        case RegImm.REG:
+            return disasm_instr_rr(input)
+        case RegImm.IMM:
+            return disasm_instr_rri(input)
+
+
 def disasm_load(input: TextIO) -> VMInstrData:
-    return disasm_instr_src_dst(input)
+    return disasm_instr_address(input)
 def disasm_store(input: TextIO) -> VMInstrData:
-    return disasm_instr_src_dst(input)
+    return disasm_instr_address(input)
 def disasm_mov(input: TextIO) -> VMInstrData:
     return disasm_instr_src_dst(input)
 def disasm_add(input: TextIO) -> VMInstrData:
@@ -187,6 +228,38 @@ def disasm_jmpge(input: TextIO) -> VMInstrData:
     return disasm_instr_i(input)
 def disasm_jmple(input: TextIO) -> VMInstrData:
     return disasm_instr_i(input)
+def disasm_mul(input: TextIO) -> VMInstrData:
+    return disasm_instr_src_dst(input)
+def disasm_div(input: TextIO) -> VMInstrData:
+    return disasm_instr_src_dst(input)
+def disasm_sdiv(input: TextIO) -> VMInstrData:
+    return disasm_instr_src_dst(input)
+def disasm_mod(input: TextIO) -> VMInstrData:
+    return disasm_instr_src_dst(input)
+def disasm_smod(input: TextIO) -> VMInstrData:
+    return disasm_instr_src_dst(input)
+def disasm_shl(input: TextIO) -> VMInstrData:
+    return disasm_instr_src_dst(input)
+def disasm_shr(input: TextIO) -> VMInstrData:
+    return disasm_instr_src_dst(input)
+def disasm_sar(input: TextIO) -> VMInstrData:
+    return disasm_instr_src_dst(input)
+def disasm_loadx(input: TextIO) -> VMInstrData:
+    return disasm_instr_rrr(input)
+def disasm_storex(input: TextIO) -> VMInstrData:
+    return disasm_instr_rrr(input)
+def disasm_loadb(input: TextIO) -> VMInstrData:
+    return disasm_instr_address(input)
+def disasm_loadsb(input: TextIO) -> VMInstrData:
+    return disasm_instr_address(input)
+def disasm_loadh(input: TextIO) -> VMInstrData:
+    return disasm_instr_address(input)
+def disasm_loadsh(input: TextIO) -> VMInstrData:
+    return disasm_instr_address(input)
+def disasm_storeb(input: TextIO) -> VMInstrData:
+    return disasm_instr_address(input)
+def disasm_storeh(input: TextIO) -> VMInstrData:
+    return disasm_instr_address(input)
 
 
 def disasm_instruction(input: TextIO) -> VMInstrData | None:
@@ -240,6 +313,38 @@ def disasm_instruction(input: TextIO) -> VMInstrData | None:
             return disasm_jmpge(input)
         case Instruction.JMPLE:
             return disasm_jmple(input)
+        case Instruction.MUL:
+            return disasm_mul(input)
+        case Instruction.DIV:
+            return disasm_div(input)
+        case Instruction.SDIV:
+            return disasm_sdiv(input)
+        case Instruction.MOD:
+            return disasm_mod(input)
+        case Instruction.SMOD:
+            return disasm_smod(input)
+        case Instruction.SHL:
+            return disasm_shl(input)
+        case Instruction.SHR:
+            return disasm_shr(input)
+        case Instruction.SAR:
+            return disasm_sar(input)
+        case Instruction.LOADX:
+            return disasm_loadx(input)
+        case Instruction.STOREX:
+            return disasm_storex(input)
+        case Instruction.LOADB:
+            return disasm_loadb(input)
+        case Instruction.LOADSB:
+            return disasm_loadsb(input)
+        case Instruction.LOADH:
+            return disasm_loadh(input)
+        case Instruction.LOADSH:
+            return disasm_loadsh(input)
+        case Instruction.STOREB:
+            return disasm_storeb(input)
+        case Instruction.STOREH:
+            return disasm_storeh(input)
         case _:
             sys.exit(f"Instruction '{instr}' not supported yet.")
 
@@ -260,6 +365,19 @@ def load_label_data(labels: TextIO):
         rev_label_addr[addr] = label
 
 
+def load_symbols(image: Image):
+    for addr, label in image.symbols:
+        rev_label_addr[addr] = label
+
+
+def open_program(buffer: bytes) -> Tuple[TextIO, Image | None]:
+    # Images are disassembled as the hex text of their code; hex text as it is.
+    if buffer.startswith(IMAGE_MAGIC):
+        image: Image = read_image(buffer)
+        return io.StringIO(image.text.hex(' ')), image
+    return io.StringIO(buffer.decode('utf-8')), None
+
+
 def compute_label_data():
     addrs: Set[int] = set()
     for addr, data in program.items():
@@ -277,10 +395,18 @@ def apply_label_data():
             data.label = rev_label_addr[addr]
 
 
+def format_address(base: Register | int | str | None, data: VMInstrData) -> str:
+    if data.index is not None:
+        return f"[{base}+{data.index}" + (f"*{data.scale}" if data.scale != 1 else '') + "]"
+    if data.disp is not None:
+        return f"[{base}-{0x100000000 - data.disp}]" if data.disp & 0x80000000 else f"[{base}+{data.disp}]"
+    return f"[{base}]"
+
+
 def dump_program(output: TextIO):
     for _, data in program.items():
 
-        instr: Instruction                  = data.instr
+        instr: Instruction                  = MNEMONICS.get(data.instr, data.instr)
         dst: Register | int | str | None    = None
         src: Register | int | None          = None
 
@@ -300,13 +426,13 @@ def dump_program(output: TextIO):
             asm += f"{data.label}:\n"
         asm += f"    {instr}"
         if dst is not None:
-            if instr == Instruction.STORE:
-                asm += f" [{dst}]"
+            if instr in STORES:
+                asm += f" {format_address(dst, data)}"
             else:
                 asm += f" {dst}"
         if src is not None:
-            if instr == Instruction.LOAD:
-                asm += f", [{src}]"
+            if instr in LOADS:
+                asm += f", {format_address(src, data)}"
             else:
                 asm += f", {src}"
 
@@ -317,27 +443,33 @@ def dump_program(output: TextIO):
 def disassemble():
     args = parse_args()
 
-    input_file: TextIO = sys.stdin
+    input_file: BinaryIO = sys.stdin.buffer
     output_file: TextIO = sys.stdout
     labels_file: TextIO | None = None
 
     if args.input_file is not None:
-        input_file = open(args.input_file, mode='r', encoding='utf-8')      # type: ignore
+        input_file = open(args.input_file, mode='rb')                       # type: ignore
     if args.output_file is not None:
         output_file = open(args.output_file, mode='w', encoding='utf-8')    # type: ignore
     if args.labels_file is not None:
         labels_file = open(args.labels_file, mode='r', encoding='utf-8')    # type: ignore
 
+    with input_file as input:
+        program_input, image = open_program(input.read())
+
     with output_file as output:
-        with input_file as input:
+        with program_input as input:
             disasm_file(input)
             if labels_file is not None:
                 with labels_file as labels:
                     load_label_data(labels)
+            elif image is not None and image.symbols:
+                load_symbols(image)
             else:
                 compute_label_data()
             apply_label_data()
             dump_program(output)
 
 
-disassemble()
+if __name__ == '__main__':
+    disassemble()
@@ -0,0 +1,102 @@
+import argparse
+import re
+import sys
+
+from collections import Counter
+from typing import Dict, List, TextIO, Tuple
+
+
+REGEX_TRACE = re.compile(r'^\[DEBUG\]\s+0x([0-9a-fA-F]{8})\s+((?:[0-9a-f]{2} )+)\s+(.+)$')
+REGEX_REG = re.compile(r'^r[0-9]+$')
+REGEX_IMM = re.compile(r'^(0x[0-9a-fA-F]+|[0-9]+)$')
+
+JUMPS: List[str] = ['call', 'ret', 'jmp', 'jmpz', 'jmpnz', 'jmpeq', 'jmpne', 'jmpgt', 'jmplt', 'jmpge', 'jmple']
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Mine hot instruction sequences from VM execution traces.')
+    parser.add_argument('input_files', metavar='TRACE', type=str, nargs='*', \
+                        help='trace files emitted by vm.py -d; defaults to STDIN if unspecified')
+    parser.add_argument('-n', '--length', metavar='N', type=int, dest='max_length', \
+                        required=False, default=3, \
+                        help='the longest sequence to consider; defaults to 3')
+    parser.add_argument('-t', '--top', metavar='K', type=int, dest='top', \
+                        required=False, default=20, \
+                        help='the number of sequences to report per length; defaults to 20')
+    return parser.parse_args()
+
+
+def load_trace(input: TextIO) -> List[Tuple[int, int, str]]:
+    trace: List[Tuple[int, int, str]] = []
+    for line in input:
+        m = REGEX_TRACE.match(line.strip())
+        if m is None:
+            continue
+        addr, hex_bytes, asm = int(m.group(1), base=16), m.group(2).split(), m.group(3).strip()
+        trace.append((addr, len(hex_bytes), asm))
+    return trace
+
+
+def operand_shape(op: str, names: Dict[str, str]) -> str:
+    if op.startswith('[') and op.endswith(']'):
+        return f"[{operand_shape(op[1:-1], names)}]"
+    if REGEX_REG.match(op):
+        if op not in names:
+            names[op] = chr(ord('a') + len(names))
+        return names[op]
+    if REGEX_IMM.match(op):
+        return 'imm'
+    return op
+
+
+def sequence_shape(asms: List[str]) -> str:
+    # general purpose registers are renamed in order of appearance so data dependencies show
+    names: Dict[str, str] = {}
+    shapes: List[str] = []
+    for asm in asms:
+        mnemonic, _, operands = asm.partition(' ')
+        ops = [operand_shape(op.strip(), names) for op in operands.split(',') if op.strip()]
+        shapes.append(' '.join([mnemonic] + [', '.join(ops)]).strip())
+    return '; '.join(shapes)
+
+
+def mine(trace: List[Tuple[int, int, str]], max_length: int) -> Dict[int, Counter]:
+    sequences: Dict[int, Counter] = {n: Counter() for n in range(2, max_length + 1)}
+    for i in range(len(trace)):
+        for n in range(2, max_length + 1):
+            window = trace[i:i + n]
+            if len(window) < n:
+                break
+            # only fall-through sequences can be fused; a jump may only end one
+            if any(window[k][0] + window[k][1] != window[k + 1][0] for k in range(n - 1)):
+                break
+            if any(asm.split(' ')[0] in JUMPS for _, _, asm in window[:-1]):
+                break
+            sequences[n][sequence_shape([asm for _, _, asm in window])] += 1
+    return sequences
+
+
+def report(sequences: Dict[int, Counter], total: int, top: int, output: TextIO):
+    print(f"{total} instructions traced", file=output)
+    for n, counter in sequences.items():
+        print(file=output)
+        print(f"{n}-instruction sequences", file=output)
+        for shape, count in counter.most_common(top):
+            print(f"{count:>12}  {100 * count / max(total, 1):>6.2f}%   {shape}", file=output)
+
+
+def hotseq():
+    args = parse_args()
+
+    trace: List[Tuple[int, int, str]] = []
+    if not args.input_files:
+        trace = load_trace(sys.stdin)
+    for input_file in args.input_files:
+        with open(input_file, mode='r', encoding='utf-8') as input:
+            trace.extend(load_trace(input))
+
+    report(mine(trace, args.max_length), len(trace), args.top, sys.stdout)
+
+
+if __name__ == '__main__':
+    hotseq()
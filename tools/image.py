@@ -0,0 +1,147 @@
+import struct
+
+from dataclasses import dataclass, field
+from typing import BinaryIO, List, Tuple
+
+
+IMAGE_MAGIC: bytes = b'UCOMPIMG'
+IMAGE_VERSION: int = 1
+OBJECT_MAGIC: bytes = b'UCOMPOBJ'
+OBJECT_VERSION: int = 1
+
+# magic, version, entry, text offset and size, data address, offset and size, symbols offset and count,
+# names offset and size, reserved
+HEADER = struct.Struct('<8sIIIIIIIIIII12x')
+# magic, version, text offset and size, symbols offset and count, relocations offset and count,
+# externals offset and count, names offset and size, reserved
+OBJECT_HEADER = struct.Struct('<8sIIIIIIIIIII12x')
+# address, offset of the NUL terminated name
+SYMBOL = struct.Struct('<II')
+# offset into the text of an address to move along with it
+RELOCATION = struct.Struct('<I')
+
+# right after the JMP at $sys_enter
+DEFAULT_ENTRY: int = 0x5
+
+
+@dataclass
+class Image:
+    text: bytes
+    entry: int                                  = DEFAULT_ENTRY
+    data: bytes                                 = b''
+    data_addr: int                              = 0
+    symbols: List[Tuple[int, str]]              = field(default_factory=list)
+
+
+@dataclass
+class Object:
+    text: bytes
+    # all at offsets into the text: labels, mangled; addresses of labels in the text, as offsets of their own;
+    # addresses of labels elsewhere, left as zeros
+    symbols: List[Tuple[int, str]]              = field(default_factory=list)
+    relocations: List[int]                      = field(default_factory=list)
+    externals: List[Tuple[int, str]]            = field(default_factory=list)
+
+
+def is_image(file_name: str) -> bool:
+    with open(file_name, mode='rb') as file:
+        return file.read(len(IMAGE_MAGIC)) == IMAGE_MAGIC
+
+
+def is_object(file_name: str) -> bool:
+    with open(file_name, mode='rb') as file:
+        return file.read(len(OBJECT_MAGIC)) == OBJECT_MAGIC
+
+
+def pack_symbols(symbols: List[Tuple[int, str]], names: bytearray) -> bytearray:
+    packed: bytearray = bytearray()
+    for addr, name in symbols:
+        packed += SYMBOL.pack(addr, len(names))
+        names += name.encode() + b'\0'
+    return packed
+
+
+def unpack_symbols(buffer: bytes, offset: int, count: int, names: bytes) -> List[Tuple[int, str]]:
+    symbols: List[Tuple[int, str]] = []
+    for i in range(count):
+        addr, name = SYMBOL.unpack_from(buffer, offset + i * SYMBOL.size)
+        symbols.append((addr, names[name:names.index(b'\0', name)].decode()))
+    return symbols
+
+
+def write_image(image: Image, output: BinaryIO):
+    names: bytearray = bytearray()
+    symbols: bytearray = pack_symbols(image.symbols, names)
+
+    text_offset: int = HEADER.size
+    data_offset: int = text_offset + len(image.text)
+    symbol_offset: int = data_offset + len(image.data)
+    name_offset: int = symbol_offset + len(symbols)
+    output.write(HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, image.entry,
+                             text_offset, len(image.text), image.data_addr, data_offset, len(image.data),
+                             symbol_offset, len(image.symbols), name_offset, len(names)))
+    output.write(image.text)
+    output.write(image.data)
+    output.write(symbols)
+    output.write(names)
+
+
+def read_image(buffer: bytes) -> Image:
+    if len(buffer) < HEADER.size:
+        raise ValueError('Not a VM image.')
+    magic, version, entry, text_offset, text_size, data_addr, data_offset, data_size, \
+        symbol_offset, symbol_count, name_offset, name_size = HEADER.unpack_from(buffer)
+    if magic != IMAGE_MAGIC or version != IMAGE_VERSION:
+        raise ValueError('Not a VM image.')
+
+    names: bytes = buffer[name_offset:name_offset + name_size]
+    symbols: List[Tuple[int, str]] = unpack_symbols(buffer, symbol_offset, symbol_count, names)
+    return Image(buffer[text_offset:text_offset + text_size], entry,
+                 buffer[data_offset:data_offset + data_size], data_addr, symbols)
+
+
+def load_image(file_name: str) -> Image:
+    with open(file_name, mode='rb') as file:
+        return read_image(file.read())
+
+
+def write_object(obj: Object, output: BinaryIO):
+    names: bytearray = bytearray()
+    symbols: bytearray = pack_symbols(obj.symbols, names)
+    externals: bytearray = pack_symbols(obj.externals, names)
+    relocations: bytes = b''.join(RELOCATION.pack(offset) for offset in obj.relocations)
+
+    text_offset: int = OBJECT_HEADER.size
+    symbol_offset: int = text_offset + len(obj.text)
+    relocation_offset: int = symbol_offset + len(symbols)
+    external_offset: int = relocation_offset + len(relocations)
+    name_offset: int = external_offset + len(externals)
+    output.write(OBJECT_HEADER.pack(OBJECT_MAGIC, OBJECT_VERSION, text_offset, len(obj.text),
+                                    symbol_offset, len(obj.symbols), relocation_offset, len(obj.relocations),
+                                    external_offset, len(obj.externals), name_offset, len(names)))
+    output.write(obj.text)
+    output.write(symbols)
+    output.write(relocations)
+    output.write(externals)
+    output.write(names)
+
+
+def read_object(buffer: bytes) -> Object:
+    if len(buffer) < OBJECT_HEADER.size:
+        raise ValueError('Not a VM object.')
+    magic, version, text_offset, text_size, symbol_offset, symbol_count, relocation_offset, relocation_count, \
+        external_offset, external_count, name_offset, name_size = OBJECT_HEADER.unpack_from(buffer)
+    if magic != OBJECT_MAGIC or version != OBJECT_VERSION:
+        raise ValueError('Not a VM object.')
+
+    names: bytes = buffer[name_offset:name_offset + name_size]
+    relocations: List[int] = [offset for offset, in RELOCATION.iter_unpack(
+        buffer[relocation_offset:relocation_offset + relocation_count * RELOCATION.size])]
+    return Object(buffer[text_offset:text_offset + text_size],
+                  unpack_symbols(buffer, symbol_offset, symbol_count, names), relocations,
+                  unpack_symbols(buffer, external_offset, external_count, names))
+
+
+def load_object(file_name: str) -> Object:
+    with open(file_name, mode='rb') as file:
+        return read_object(file.read())
@@ -0,0 +1,90 @@
+import argparse
+import io
+import sys
+
+from contextlib import nullcontext
+from typing import Dict, List, Optional, Tuple
+
+from asm import SYS_ENTER_ASM, Assembler, assemble_object, demangle_label, is_high_level_label, write_labels
+from image import Image, Object, is_object, load_object, write_image
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='VM linker.')
+    parser.add_argument('input_files', metavar='OBJ', type=str, nargs='+', \
+                        help='''input file to link, an object from asm.py -c or a source to assemble as one;
+                                laid out in the given order, the first one starting at the entry point''')
+    parser.add_argument('-o', '--output', metavar='IMG', type=str, dest='output_file', \
+                        required=False, \
+                        help='output file to emit the VM image to; defaults to STDOUT if unspecified')
+    parser.add_argument('-l', '--labels', metavar='LBL', type=str, dest='labels_file', \
+                        required=False, \
+                        help='output file to emit assembler labels to; defaults to none if unspecified')
+    parser.add_argument('--cache', metavar='DIR', type=str, dest='cache_dir', \
+                        required=False, \
+                        help='''directory to keep the objects of sources in, as asm.py --cache does, so that an
+                                unchanged source is never assembled twice''')
+    parser.add_argument('-O', '--optimize', dest='optimize', \
+                        required=False, action='store_true', \
+                        help='optimize the sources, as asm.py -O does; objects are taken as they are')
+    return parser.parse_args()
+
+
+def load_input(input_file_name: str, cache_dir: Optional[str], optimize: bool) -> Object:
+    if is_object(input_file_name):
+        return load_object(input_file_name)
+    try:
+        with open(input_file_name, mode='r', encoding='utf-8') as input:
+            return assemble_object(input, cache_dir, optimize)
+    except SystemExit as e:
+        sys.exit(f"{input_file_name}: {e.code}")
+
+
+def link(objects: List[Object]) -> Image:
+    # $sys_enter goes first, as in any image, and the entry point right after it.
+    objects = [Assembler().assemble_object(io.StringIO(SYS_ENTER_ASM))] + objects
+
+    text: bytearray = bytearray()
+    bases: List[int] = []
+    addrs: Dict[str, int] = {}                  # top level label -> address
+    symbols: List[Tuple[int, str]] = []
+    for obj in objects:
+        base: int = len(text)
+        bases.append(base)
+        text += obj.text
+        for offset, label in obj.symbols:
+            name: str = demangle_label(label)[-1]
+            if is_high_level_label(name):
+                if label in addrs:
+                    sys.exit(f"Duplicate label '{label}'.")
+                addrs[label] = base + offset
+            symbols.append((base + offset, name))
+
+    for obj, base in zip(objects, bases):
+        for offset in obj.relocations:
+            ref: int = base + offset
+            addr: Optional[int] = int.from_bytes(text[ref:ref + 4], byteorder='little') + base
+            text[ref:ref + 4] = addr.to_bytes(4, byteorder='little')
+        for offset, label in obj.externals:
+            ref = base + offset
+            addr = addrs.get(label)
+            if addr is None:
+                sys.exit(f"Unknown label '{label}'.")
+            text[ref:ref + 4] = addr.to_bytes(4, byteorder='little')
+
+    return Image(bytes(text), bases[1], symbols=sorted(symbols))
+
+
+def link_files():
+    args = parse_args()
+
+    image: Image = link([load_input(input_file_name, args.cache_dir, args.optimize)
+                         for input_file_name in args.input_files])
+    with open(args.output_file, mode='wb') if args.output_file is not None \
+            else nullcontext(sys.stdout.buffer) as output:
+        write_image(image, output)
+    write_labels(image.symbols, args.labels_file)
+
+
+if __name__ == '__main__':
+    link_files()
@@ -0,0 +1,100 @@
+from bisect import bisect_right
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, TextIO, Tuple
+
+
+LOW_LEVEL_LABEL_START: str = '.'
+
+
+@dataclass
+class CallStack:
+    func: int                                   # the address called
+    caller: int                                 # index of the calling stack; the entry point is its own caller
+    calls: int
+    instrs: int                                 # retired in the function itself, not in its callees
+
+
+@dataclass
+class Profile:
+    pcs: Dict[int, int]
+    calls: List[CallStack]
+
+    def total(self) -> int:
+        return sum(self.pcs.values())
+
+
+class Symbolizer:
+    """Names addresses after the closest function label, as emitted by asm.py -l, or as held by an image,
+    at or before them."""
+
+    def __init__(self, labels: Optional[TextIO] = None, symbols: Optional[List[Tuple[int, str]]] = None):
+        symbols = list(symbols or [])
+        if labels is not None:
+            for line in labels:
+                addr, label = line.strip().split('   ')
+                symbols.append((int(addr, base=16), label))
+        # local labels name jump targets within a function, not functions
+        funcs: List[Tuple[int, str]] = [(addr, label) for addr, label in symbols
+                                        if not label.startswith(LOW_LEVEL_LABEL_START)]
+        funcs.sort()
+        self.addrs: List[int] = [addr for addr, _ in funcs]
+        self.names: List[str] = [name for _, name in funcs]
+
+    def lookup(self, addr: int) -> Tuple[str, int]:
+        i: int = bisect_right(self.addrs, addr) - 1
+        if i < 0:
+            return f"{addr:#010x}", 0
+        return self.names[i], addr - self.addrs[i]
+
+    def func(self, addr: int) -> str:
+        return self.lookup(addr)[0]
+
+    def addr(self, addr: int) -> str:
+        name, offset = self.lookup(addr)
+        return f"{name}+{offset:#x}" if offset != 0 else name
+
+
+def stacks(profile: Profile, symbolizer: Symbolizer) -> List[List[str]]:
+    # entry point first
+    frames: List[List[str]] = []
+    for i, stack in enumerate(profile.calls):
+        caller: List[str] = frames[stack.caller] if i != 0 else []
+        frames.append(caller + [symbolizer.func(stack.func)])
+    return frames
+
+
+def folded_stacks(profile: Profile, symbolizer: Symbolizer) -> Counter:
+    folded: Counter = Counter()
+    for frames, stack in zip(stacks(profile, symbolizer), profile.calls):
+        if stack.instrs != 0:
+            folded[';'.join(frames)] += stack.instrs
+    return folded
+
+
+def write_folded_stacks(profile: Profile, symbolizer: Symbolizer, output: TextIO):
+    for frames, instrs in sorted(folded_stacks(profile, symbolizer).items()):
+        print(f"{frames} {instrs}", file=output)
+
+
+def write_flat_table(profile: Profile, symbolizer: Symbolizer, output: TextIO, top: int = 20):
+    self_instrs: Counter = Counter()
+    total: Counter = Counter()
+    calls: Counter = Counter()
+    for frames, stack in zip(stacks(profile, symbolizer), profile.calls):
+        self_instrs[frames[-1]] += stack.instrs
+        calls[frames[-1]] += stack.calls
+        # a recursive function counts once per stack
+        for func in set(frames):
+            total[func] += stack.instrs
+
+    instrs: int = max(profile.total(), 1)
+    print(f"{'self':>14} {'%':>6} {'total':>14} {'%':>6} {'calls':>12}  function", file=output)
+    for func, count in sorted(self_instrs.items(), key=lambda item: (-item[1], item[0])):
+        print(f"{count:>14} {100 * count / instrs:>6.2f} {total[func]:>14} {100 * total[func] / instrs:>6.2f} "
+              f"{calls[func]:>12}  {func}", file=output)
+
+    print(file=output)
+    print(f"{'instrs':>14} {'%':>6}  address", file=output)
+    for addr, count in sorted(profile.pcs.items(), key=lambda item: (-item[1], item[0]))[:top]:
+        print(f"{count:>14} {100 * count / instrs:>6.2f}  {addr:#010x} {symbolizer.addr(addr)}", file=output)
@@ -0,0 +1,123 @@
+import argparse
+import struct
+import sys
+
+from typing import BinaryIO, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from asmspec import Instruction, RegImm, Register
+
+
+TRACE_MAGIC: bytes = b'UCOMPTRC'
+TRACE_VERSION: int = 1
+
+# magic, version, record size, capacity, count
+HEADER = struct.Struct('<8sIIQQ')
+# pc, code, written register, unused, value written
+RECORD = struct.Struct('<I6sBBI')
+
+NO_REG: int = 0xff
+
+REGS_ONLY: List[Instruction] = [Instruction.NOT, Instruction.PUSH, Instruction.POP]
+INDEXED: List[Instruction] = [Instruction.LOADX, Instruction.STOREX]
+# the indexed forms share their mnemonic with the plain ones
+MNEMONICS: Dict[Instruction, Instruction] = {
+    Instruction.LOADX:  Instruction.LOAD,
+    Instruction.STOREX: Instruction.STORE,
+}
+LOADS: List[Instruction] = [Instruction.LOAD, Instruction.LOADX, Instruction.LOADB, Instruction.LOADSB,
+                            Instruction.LOADH, Instruction.LOADSH]
+STORES: List[Instruction] = [Instruction.STORE, Instruction.STOREX, Instruction.STOREB, Instruction.STOREH]
+JUMPS: List[Instruction] = [Instruction.CALL, Instruction.JMP, Instruction.JMPZ, Instruction.JMPNZ,
+                            Instruction.JMPEQ, Instruction.JMPNE, Instruction.JMPGT, Instruction.JMPLT,
+                            Instruction.JMPGE, Instruction.JMPLE]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Decode VM execution traces.')
+    parser.add_argument('input_file', metavar='TRACE', type=str,
+                        help='trace file written by vm.py -t')
+    parser.add_argument('-o', '--output', metavar='FILE', type=str, dest='output_file',
+                        required=False,
+                        help='output file to emit the trace to, as vm.py -d does; defaults to STDOUT if unspecified')
+    parser.add_argument('-r', '--registers', dest='registers',
+                        required=False, action='store_true',
+                        help='follow each instruction with the register it wrote and its new value')
+    return parser.parse_args()
+
+
+def load_trace(input: BinaryIO) -> Iterator[Tuple[int, bytes, Optional[Register], int]]:
+    magic, version, record_size, capacity, count = HEADER.unpack(input.read(HEADER.size))
+    if magic != TRACE_MAGIC or version != TRACE_VERSION or record_size != RECORD.size:
+        raise ValueError('Not a VM trace.')
+    records: bytes = input.read(capacity * record_size)
+    # oldest first
+    for i in range(max(count - capacity, 0), count):
+        pc, code, reg, _, val = RECORD.unpack_from(records, (i % capacity) * record_size)
+        yield pc, code, Register(reg) if reg != NO_REG else None, val
+
+
+def instruction_size(instr: Instruction, ri: RegImm) -> int:
+    if instr == Instruction.RET:
+        return 1
+    if instr in JUMPS:
+        return 5
+    if instr in INDEXED:
+        return 3
+    return 6 if ri == RegImm.IMM and instr not in REGS_ONLY else 2
+
+
+def format_address(base: str, instr: Instruction, ri: RegImm, code: bytes) -> str:
+    if instr in INDEXED:
+        index, scale = Register(code[2] >> 4).name.lower(), 1 << (code[2] & 0x03)
+        return f"[{base}+{index}" + (f"*{scale}" if scale != 1 else '') + "]"
+    if ri == RegImm.IMM:
+        disp: int = int.from_bytes(code[2:6], byteorder='little')
+        return f"[{base}-{0x100000000 - disp}]" if disp & 0x80000000 else f"[{base}+{disp}]"
+    return f"[{base}]"
+
+
+def format_instruction(pc: int, code: bytes) -> str:
+    instr, ri = Instruction(code[0] >> 1), RegImm(code[0] & 0x01)
+    size: int = instruction_size(instr, ri)
+    dst, src = Register(code[1] >> 4).name.lower(), Register(code[1] & 0x0f).name.lower()
+    iv: int = int.from_bytes(code[1:5] if instr in JUMPS else code[2:6], byteorder='little')
+
+    mnemonic: str = MNEMONICS.get(instr, instr).name.lower()
+    if instr == Instruction.RET:
+        asm = mnemonic
+    elif instr in JUMPS:
+        asm = f"{mnemonic} {iv:#010x}"
+    elif instr in LOADS:
+        asm = f"{mnemonic} {dst}, {format_address(src, instr, ri, code)}"
+    elif instr in STORES:
+        asm = f"{mnemonic} {format_address(dst, instr, ri, code)}, {src}"
+    elif instr in REGS_ONLY:
+        asm = f"{mnemonic} {dst}"
+    else:
+        asm = f"{mnemonic} {dst}, {iv if ri == RegImm.IMM else src}"
+
+    hex_dump: str = ''.join([f"{b:02x} " for b in code[:size]]) + '   ' * (6 - size)
+    return f"[DEBUG] \t{pc:#010x}   {hex_dump}   {asm}"
+
+
+def decode(input: BinaryIO, output: TextIO, registers: bool):
+    for pc, code, reg, val in load_trace(input):
+        line: str = format_instruction(pc, code)
+        if registers and reg is not None:
+            line += f"   ; {reg.name.lower()} = {val:#010x}"
+        print(line, file=output)
+
+
+def decode_trace():
+    args = parse_args()
+
+    output_file: TextIO = sys.stdout
+    if args.output_file is not None:
+        output_file = open(args.output_file, mode='w', encoding='utf-8')    # type: ignore
+
+    with output_file as output:
+        with open(args.input_file, mode='rb') as input:
+            decode(input, output, args.registers)
+
+
+decode_trace()
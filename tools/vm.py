@@ -1,45 +1,553 @@
 import argparse
 import ctypes
+import os
+import sys
+import threading
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, nullcontext
+from dataclasses import dataclass
 from enum import IntEnum, unique
+from typing import Any, Dict, List, Optional
+
+from asmspec import Register
+from image import is_image, load_image
+from prof import CallStack, Profile, Symbolizer, write_flat_table, write_folded_stacks
 
 
 VM_LIB = 'vm.so'
 
+# the code of a program, or the name of its image file, which the VM maps itself
+Program = bytes | str
+
 
 @unique
 class ExecType(IntEnum):
     INTERPRETER = 1
+    PREDECODER  = 2
+    JIT         = 3
+    AOT         = 4
+
+
+@unique
+class OutputType(IntEnum):
+    STDOUT      = 1
+    BUFFER      = 2
+    FD          = 3
+
+
+@unique
+class Status(IntEnum):
+    RUNNING         = 0
+    EXITED          = 1
+    CHECKPOINT      = 2
+    OUT_OF_FUEL     = 3
+    TIMED_OUT       = 4
+    DIVIDE_BY_ZERO  = 5
+
+
+@dataclass
+class MappedFile:
+    path: str
+    addr: int
+    writable: bool = False
+
+
+@dataclass
+class RunResult:
+    status: Status
+    output: bytes
+    regs: List[int]
+
+
+class _PcProfile(ctypes.Structure):
+    _fields_ = [('addr', ctypes.c_uint32), ('instrs', ctypes.c_uint64)]
+
+
+class _CallProfile(ctypes.Structure):
+    _fields_ = [('func', ctypes.c_uint32), ('caller', ctypes.c_uint32),
+                ('calls', ctypes.c_uint64), ('instrs', ctypes.c_uint64)]
+
+
+_vm_lib: Optional[ctypes.CDLL] = None
+
+
+def vm_lib() -> ctypes.CDLL:
+    global _vm_lib
+    if _vm_lib is None:
+        lib = ctypes.cdll.LoadLibrary(VM_LIB)
+        lib.vm_run.argtypes = [ctypes.c_char_p, ctypes.c_size_t, ctypes.c_size_t, ctypes.c_bool,
+                               ctypes.c_int, ctypes.c_bool, ctypes.c_char_p,
+                               ctypes.c_uint64, ctypes.c_uint64, ctypes.POINTER(ctypes.c_uint32)]
+        lib.vm_run.restype = ctypes.c_int
+        lib.vm_snapshot.argtypes = [ctypes.c_char_p, ctypes.c_size_t, ctypes.c_size_t, ctypes.c_bool,
+                                    ctypes.c_int, ctypes.c_bool, ctypes.c_char_p, ctypes.c_char_p]
+        lib.vm_snapshot.restype = ctypes.c_bool
+        lib.vm_restore.argtypes = [ctypes.c_char_p, ctypes.c_size_t,
+                                   ctypes.c_int, ctypes.c_bool, ctypes.c_char_p, ctypes.c_char_p]
+        lib.vm_restore.restype = None
+        lib.vm_create.argtypes = [ctypes.c_size_t, ctypes.c_bool, ctypes.c_int, ctypes.c_bool, ctypes.c_char_p]
+        lib.vm_create.restype = ctypes.c_void_p
+        lib.vm_load.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_size_t]
+        lib.vm_load.restype = None
+        lib.vm_load_file.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+        lib.vm_load_file.restype = None
+        lib.vm_exec.argtypes = [ctypes.c_void_p]
+        lib.vm_exec.restype = ctypes.c_int
+        lib.vm_step.argtypes = [ctypes.c_void_p, ctypes.c_uint64]
+        lib.vm_step.restype = ctypes.c_uint64
+        lib.vm_set_limits.argtypes = [ctypes.c_void_p, ctypes.c_uint64, ctypes.c_uint64]
+        lib.vm_set_limits.restype = None
+        lib.vm_status.argtypes = [ctypes.c_void_p]
+        lib.vm_status.restype = ctypes.c_int
+        lib.vm_retired.argtypes = [ctypes.c_void_p]
+        lib.vm_retired.restype = ctypes.c_uint64
+        lib.vm_get_reg.argtypes = [ctypes.c_void_p, ctypes.c_uint32]
+        lib.vm_get_reg.restype = ctypes.c_uint32
+        lib.vm_set_reg.argtypes = [ctypes.c_void_p, ctypes.c_uint32, ctypes.c_uint32]
+        lib.vm_set_reg.restype = None
+        lib.vm_memory.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_size_t)]
+        lib.vm_memory.restype = ctypes.c_void_p
+        lib.vm_registers.argtypes = [ctypes.c_void_p]
+        lib.vm_registers.restype = ctypes.c_void_p
+        lib.vm_set_output.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int]
+        lib.vm_set_output.restype = None
+        lib.vm_output.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_size_t]
+        lib.vm_output.restype = ctypes.c_size_t
+        lib.vm_set_input_fd.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.vm_set_input_fd.restype = None
+        lib.vm_set_input.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_size_t]
+        lib.vm_set_input.restype = None
+        lib.vm_set_profiling.argtypes = [ctypes.c_void_p, ctypes.c_bool]
+        lib.vm_set_profiling.restype = None
+        lib.vm_profile_pcs.argtypes = [ctypes.c_void_p, ctypes.POINTER(_PcProfile), ctypes.c_size_t]
+        lib.vm_profile_pcs.restype = ctypes.c_size_t
+        lib.vm_profile_calls.argtypes = [ctypes.c_void_p, ctypes.POINTER(_CallProfile), ctypes.c_size_t]
+        lib.vm_profile_calls.restype = ctypes.c_size_t
+        lib.vm_set_trace.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint64]
+        lib.vm_set_trace.restype = None
+        lib.vm_set_coverage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
+        lib.vm_set_coverage.restype = None
+        lib.vm_fork_server.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+        lib.vm_fork_server.restype = ctypes.c_bool
+        lib.vm_set_snapshot_out.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+        lib.vm_set_snapshot_out.restype = None
+        lib.vm_snapshot_saved.argtypes = [ctypes.c_void_p]
+        lib.vm_snapshot_saved.restype = ctypes.c_bool
+        lib.vm_set_restore_from.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+        lib.vm_set_restore_from.restype = None
+        lib.vm_map_file.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint32, ctypes.c_bool]
+        lib.vm_map_file.restype = None
+        lib.vm_reset.argtypes = [ctypes.c_void_p]
+        lib.vm_reset.restype = None
+        lib.vm_destroy.argtypes = [ctypes.c_void_p]
+        lib.vm_destroy.restype = None
+        _vm_lib = lib
+    return _vm_lib
+
+
+class VM:
+    """A reusable VM; memory and the execution engine are set up once and kept across programs."""
+
+    def __init__(self, ram_size_mb: int = 4, exec_type: ExecType = ExecType.INTERPRETER,
+                 sparse_mem: bool = False, debug: bool = False, native_lib: Optional[str] = None,
+                 output: OutputType = OutputType.STDOUT, output_fd: int = -1,
+                 max_instrs: int = 0, timeout_ms: int = 0):
+        self.lib: ctypes.CDLL = vm_lib()
+        self.handle: Optional[int] = self.lib.vm_create(
+            ram_size_mb, sparse_mem, exec_type, debug,
+            os.path.abspath(native_lib).encode() if native_lib is not None else None)
+        self.loaded: bool = False
+        self.coverage: Optional[Any] = None
+        self.set_output(output, output_fd)
+        self.set_limits(max_instrs, timeout_ms)
+
+    def __enter__(self) -> 'VM':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if getattr(self, 'handle', None) is not None:
+            self.lib.vm_destroy(self.handle)
+            self.handle = None
+
+    def load(self, program: Program):
+        if isinstance(program, str):
+            self.lib.vm_load_file(self.handle, program.encode())
+        else:
+            self.lib.vm_load(self.handle, program, len(program))
+        self.loaded = True
+
+    def run(self) -> Status:
+        self._check_loaded()
+        return Status(self.lib.vm_exec(self.handle))
+
+    def step(self, count: int = 1) -> int:
+        self._check_loaded()
+        return self.lib.vm_step(self.handle, count)
+
+    def reset(self):
+        self._check_loaded()
+        self.lib.vm_reset(self.handle)
+
+    def set_limits(self, max_instrs: int = 0, timeout_ms: int = 0):
+        self.lib.vm_set_limits(self.handle, max_instrs, timeout_ms)
+
+    def status(self) -> Status:
+        self._check_loaded()
+        return Status(self.lib.vm_status(self.handle))
+
+    def retired(self) -> int:
+        self._check_loaded()
+        return self.lib.vm_retired(self.handle)
+
+    def set_output(self, output: OutputType, fd: int = -1):
+        if output == OutputType.FD and fd < 0:
+            raise ValueError('No file descriptor to write the output to.')
+        self.lib.vm_set_output(self.handle, OutputType(output), fd)
+
+    def output(self) -> bytes:
+        size: int = self.lib.vm_output(self.handle, None, 0)
+        buf = ctypes.create_string_buffer(size)
+        self.lib.vm_output(self.handle, buf, size)
+        return buf.raw
+
+    def set_input(self, data: bytes):
+        self.lib.vm_set_input(self.handle, data, len(data))
+
+    def set_input_fd(self, fd: int):
+        self.lib.vm_set_input_fd(self.handle, fd)
+
+    def set_profiling(self, profiling: bool):
+        self.lib.vm_set_profiling(self.handle, profiling)
+
+    def profile(self) -> Profile:
+        pcs = (_PcProfile * self.lib.vm_profile_pcs(self.handle, None, 0))()
+        self.lib.vm_profile_pcs(self.handle, pcs, len(pcs))
+        calls = (_CallProfile * self.lib.vm_profile_calls(self.handle, None, 0))()
+        self.lib.vm_profile_calls(self.handle, calls, len(calls))
+        return Profile({pc.addr: pc.instrs for pc in pcs},
+                       [CallStack(call.func, call.caller, call.calls, call.instrs) for call in calls])
+
+    def set_trace(self, trace: Optional[str], size: int = 1 << 20):
+        self.lib.vm_set_trace(self.handle, trace.encode() if trace is not None else None, size)
+
+    def set_coverage(self, bitmap: Optional[bytearray]):
+        # Kept here for as long as the VM writes to it.
+        self.coverage = (ctypes.c_uint8 * len(bitmap)).from_buffer(bitmap) if bitmap is not None else None
+        self.lib.vm_set_coverage(self.handle, self.coverage, len(bitmap) if bitmap is not None else 0)
+
+    def fork_server(self, input: Optional[str] = None) -> bool:
+        self._check_loaded()
+        return self.lib.vm_fork_server(self.handle, os.path.abspath(input).encode() if input is not None else None)
+
+    def set_snapshot_out(self, snapshot: Optional[str]):
+        self.lib.vm_set_snapshot_out(self.handle, snapshot.encode() if snapshot is not None else None)
+
+    def snapshot_saved(self) -> bool:
+        return self.lib.vm_snapshot_saved(self.handle)
+
+    def set_restore_from(self, snapshot: Optional[str]):
+        self.lib.vm_set_restore_from(self.handle, snapshot.encode() if snapshot is not None else None)
+
+    def map_file(self, path: Optional[str], addr: int = 0, writable: bool = False):
+        self.lib.vm_map_file(self.handle, os.path.abspath(path).encode() if path is not None else None,
+                             addr, writable)
+
+    def get_reg(self, reg: Register) -> int:
+        self._check_loaded()
+        return self.lib.vm_get_reg(self.handle, Register(reg))
+
+    def set_reg(self, reg: Register, val: int):
+        self._check_loaded()
+        self.lib.vm_set_reg(self.handle, Register(reg), val & 0xffffffff)
+
+    def regs(self) -> List[int]:
+        return [self.get_reg(reg) for reg in Register]
+
+    def memory(self) -> memoryview:
+        # In place, no copy; valid until the VM is closed or, restoring from a snapshot, reset. Writes to
+        # the text are not seen by code already decoded or compiled; touching a guard page terminates.
+        self._check_loaded()
+        size = ctypes.c_size_t()
+        addr: int = self.lib.vm_memory(self.handle, ctypes.byref(size))
+        return memoryview((ctypes.c_uint8 * size.value).from_address(addr)).cast('B')
+
+    def registers(self) -> memoryview:
+        # In place, indexed by Register.
+        self._check_loaded()
+        addr: int = self.lib.vm_registers(self.handle)
+        return memoryview((ctypes.c_uint32 * len(Register)).from_address(addr)).cast('B').cast('I')
+
+    def memory_array(self, dtype: Any = 'uint8', offset: int = 0, count: int = -1) -> Any:
+        # A view of memory() as a NumPy array; NumPy is only needed here.
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError('NumPy is required for memory_array(); memory() needs nothing.') from None
+        return numpy.frombuffer(self.memory(), dtype=dtype, count=count, offset=offset)
+
+    def _check_loaded(self):
+        if self.handle is None:
+            raise ValueError('VM closed.')
+        if not self.loaded:
+            raise ValueError('No program loaded.')
+
+
+def run_batch(programs: List[Program], jobs: Optional[int] = None, inputs: Optional[List[bytes]] = None,
+              files: Optional[List[MappedFile]] = None, native_libs: Optional[List[Optional[str]]] = None,
+              **options: Any) -> List[RunResult]:
+    # One VM per worker thread, reused from one program to the next as long as they share the native library;
+    # the VM runs without the GIL.
+    local = threading.local()
+    vms: List[VM] = []
+    lock = threading.Lock()
+
+    if inputs is None:
+        inputs = [b''] * len(programs)
+    if len(inputs) != len(programs):
+        raise ValueError('One input per program expected.')
+    if native_libs is None:
+        native_libs = [None] * len(programs)
+    if len(native_libs) != len(programs):
+        raise ValueError('One native library per program expected.')
+
+    def run_one(program: Program, input: bytes, native_lib: Optional[str]) -> RunResult:
+        vm: Optional[VM] = getattr(local, 'vm', None)
+        if vm is None or local.native_lib != native_lib:
+            if vm is not None:
+                vm.close()
+            vm = local.vm = VM(output=OutputType.BUFFER, native_lib=native_lib, **options)
+            local.native_lib = native_lib
+            with lock:
+                vms.append(vm)
+            for file in files or []:
+                vm.map_file(file.path, file.addr, file.writable)
+        vm.set_input(input)
+        vm.load(program)
+        status: Status = vm.run()
+        return RunResult(status, vm.output(), vm.regs())
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            return list(pool.map(run_one, programs, inputs, native_libs))
+    finally:
+        for vm in vms:
+            vm.close()
+
+
+def load_program(file_name: str) -> Program:
+    # Images are left to the VM to map; hex text is read here.
+    if is_image(file_name):
+        return file_name
+    with open(file_name, mode='r', encoding='utf-8') as hex_file:
+        return bytes.fromhex(' '.join([line.strip() for line in hex_file]))
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description='VM wrapper.')
-    parser.add_argument('program', metavar='HEX', type=str, nargs=1,
-                        help='the program to execute')
-    parser.add_argument('-m', '--memory', metavar='MEM', type=str, dest='memory',
+    parser.add_argument('programs', metavar='IMG', type=str, nargs='+',
+                        help='''the program to execute, a VM image or hex text; several programs are run as a batch,
+                                in parallel, with their outputs written in order''')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, dest='jobs',
+                        required=False, default=os.cpu_count(),
+                        help='the number of programs to run at once in a batch; defaults to the number of CPUs')
+    parser.add_argument('-m', '--memory', metavar='MEM', type=int, dest='memory',
                         required=False, default=4,
                         help='the size of memory to use (in MiB); defaults to 4')
+    parser.add_argument('-s', '--sparse', dest='sparse_mem',
+                        required=False, action='store_true',
+                        help='''reserve the whole 4 GiB address space, committing pages on first use,
+                                with guard pages past the text and below the stack; overrides -m''')
     parser.add_argument('-e', '--execution-type', metavar='EXEC_TYPE', dest='exec_type',
-                        required=False, choices=['INTERPRETER'], default='INTERPRETER',
+                        required=False, choices=[e.name for e in ExecType], default='INTERPRETER',
                         help='''the execution type; defaults to INTERPRETER;
-                                possible values: INTERPRETER''')
+                                possible values: INTERPRETER, PREDECODER, JIT, AOT''')
+    parser.add_argument('-n', '--native', metavar='SO', type=str, dest='native_libs',
+                        required=False, action='append', default=[],
+                        help='''the native library translated from the program by aot.py; required by AOT;
+                                given once per program, in the same order, to a batch''')
+    snapshot = parser.add_mutually_exclusive_group()
+    snapshot.add_argument('--snapshot-out', metavar='FILE', type=str, dest='snapshot_out',
+                          required=False,
+                          help='stop at the first checkpoint system call and save the VM state to FILE')
+    snapshot.add_argument('--restore-from', metavar='FILE', type=str, dest='restore_from',
+                          required=False,
+                          help='''start from the VM state saved in FILE rather than from scratch;
+                                  the memory configuration is taken from FILE''')
+    parser.add_argument('--max-instrs', metavar='N', type=int, dest='max_instrs',
+                        required=False, default=0,
+                        help='''stop the program after about N instructions; only checked on backward jumps,
+                                calls and returns, so it may run a little over''')
+    parser.add_argument('--timeout', metavar='MS', type=int, dest='timeout_ms',
+                        required=False, default=0,
+                        help='stop the program after about MS milliseconds; checked like --max-instrs')
+    parser.add_argument('--map', metavar='FILE@ADDR', type=str, dest='maps',
+                        required=False, action='append', default=[],
+                        help='''map FILE read-only at ADDR, page aligned and in the heap; stores to it
+                                terminate the VM; may be given more than once''')
+    parser.add_argument('--map-cow', metavar='FILE@ADDR', type=str, dest='cow_maps',
+                        required=False, action='append', default=[],
+                        help='map FILE copy-on-write at ADDR, as --map does; FILE itself is never written')
+    parser.add_argument('-i', '--input', metavar='FILE', type=str, dest='input',
+                        required=False,
+                        help='''read the program input from FILE rather than from STDIN;
+                                in a batch every program reads all of FILE, and nothing otherwise''')
+    parser.add_argument('-o', '--output', metavar='FILE', type=str, dest='output',
+                        required=False,
+                        help='''write the program output to FILE rather than to STDOUT; under --fork-server
+                                the output of all runs, one after the other''')
+    parser.add_argument('-p', '--profile', metavar='FILE', type=str, dest='profile',
+                        required=False,
+                        help='''count the instructions run per address and per call stack; writes the call stacks
+                                to FILE, folded for flame graph tools, and a per function table to STDERR''')
+    parser.add_argument('-l', '--labels', metavar='LBL', type=str, dest='labels_file',
+                        required=False,
+                        help='''the labels emitted by asm.py -l, to name functions in the profile after;
+                                defaults to the symbols of the image, if any''')
+    parser.add_argument('-t', '--trace', metavar='FILE', type=str, dest='trace',
+                        required=False,
+                        help='''keep a binary record of the last instructions run in FILE, even if the VM aborts;
+                                trace.py turns it into the text -d emits''')
+    parser.add_argument('--trace-size', metavar='N', type=int, dest='trace_size',
+                        required=False, default=1 << 20,
+                        help='the number of instructions to keep in the trace, rounded up to a power of 2; defaults to 1Mi')
+    parser.add_argument('--fork-server', dest='fork_server',
+                        required=False, action='store_true',
+                        help='''run under AFL as a fork server: load the program once and fork a run of it per
+                                input, from -i FILE or STDIN, counting the edges taken in AFL's bitmap''')
     parser.add_argument('-d', '--debug', dest='debug',
                         required=False, action='store_true',
                         help='emit debug info')
     return parser.parse_args()
 
 
+def parse_mapped_file(arg: str, writable: bool) -> MappedFile:
+    path, sep, addr = arg.rpartition('@')
+    try:
+        if not sep or not path:
+            raise ValueError
+        return MappedFile(path, int(addr, 0), writable)
+    except ValueError:
+        sys.exit(f"Invalid file mapping '{arg}'; FILE@ADDR expected.")
+
+
+def stopped(name: str, status: Status, regs: List[int]) -> str:
+    reasons: Dict[Status, str] = {
+        Status.CHECKPOINT:      'stopped at a checkpoint',
+        Status.OUT_OF_FUEL:     'ran out of instructions',
+        Status.TIMED_OUT:       'timed out',
+        Status.DIVIDE_BY_ZERO:  'divided by zero',
+    }
+    reason: str = reasons[status]
+    state: str = ' '.join([f"{reg.name.lower()}={regs[reg]:#010x}" for reg in Register])
+    return f"{name} {reason}: {state}"
+
+
+def write_profile(profile: Profile, folded_file_name: str, labels_file_name: Optional[str], program: Program):
+    symbolizer: Symbolizer = Symbolizer()
+    if labels_file_name is not None:
+        with open(labels_file_name, mode='r', encoding='utf-8') as labels_file:
+            symbolizer = Symbolizer(labels_file)
+    elif isinstance(program, str):
+        symbolizer = Symbolizer(symbols=load_image(program).symbols)
+    with open(folded_file_name, mode='w', encoding='utf-8') as folded_file:
+        write_folded_stacks(profile, symbolizer, folded_file)
+    write_flat_table(profile, symbolizer, sys.stderr)
+
+
 def run():
     args = parse_args()
 
-    program: bytes
-    with open(args.program[0], mode='r', encoding='utf-8') as hex_file:
-        program = bytes.fromhex(' '.join([line.strip() for line in hex_file]))
+    programs: List[Program] = [load_program(program) for program in args.programs]
     ram_size_mb: int = args.memory
+    sparse_mem: bool = args.sparse_mem
     exec_type: ExecType = ExecType[args.exec_type]
     debug: bool = args.debug
+    native_libs: List[str] = args.native_libs
+    if not native_libs and exec_type == ExecType.AOT:
+        sys.exit('AOT requires a native library.')
+    if native_libs and len(native_libs) != len(programs):
+        sys.exit(f"One native library per program expected; {len(native_libs)} given for {len(programs)}.")
+    native_lib: Optional[str] = native_libs[0] if native_libs else None
+    limits: Dict[str, int] = {'max_instrs': args.max_instrs, 'timeout_ms': args.timeout_ms}
+    files: List[MappedFile] = [parse_mapped_file(arg, False) for arg in args.maps] \
+                            + [parse_mapped_file(arg, True) for arg in args.cow_maps]
+
+    if len(programs) > 1:
+        if args.snapshot_out is not None or args.restore_from is not None:
+            sys.exit('Snapshots are taken from, and restored to, one program at a time.')
+        if args.profile is not None:
+            sys.exit('Programs are profiled one at a time.')
+        if args.trace is not None:
+            sys.exit('Programs are traced one at a time.')
+        if args.fork_server:
+            sys.exit('Programs are fuzzed one at a time.')
+        input: bytes = b''
+        if args.input is not None:
+            with open(args.input, mode='rb') as input_file:
+                input = input_file.read()
+        results: List[RunResult] = run_batch(programs, args.jobs, [input] * len(programs), files,
+                                             native_libs or None, ram_size_mb=ram_size_mb, exec_type=exec_type,
+                                             sparse_mem=sparse_mem, debug=debug, **limits)
+        with open(args.output, mode='wb') if args.output is not None else nullcontext(sys.stdout.buffer) as output:
+            for result in results:
+                output.write(result.output)
+            output.flush()
+        failed: List[str] = [stopped(name, result.status, result.regs)
+                             for name, result in zip(args.programs, results) if result.status != Status.EXITED]
+        if failed:
+            sys.exit('\n'.join(failed))
+        return
+
+    if args.fork_server:
+        if args.snapshot_out is not None or args.profile is not None:
+            sys.exit('Runs under a fuzzer are neither snapshotted nor profiled.')
+        with ExitStack() as stack:
+            # Shared by all runs, each one writing its output after that of the one before.
+            output_file = stack.enter_context(open(args.output, mode='wb')) if args.output is not None else None
+            vm: VM = stack.enter_context(VM(ram_size_mb, exec_type, sparse_mem, debug, native_lib, **limits))
+            if output_file is not None:
+                vm.set_output(OutputType.FD, output_file.fileno())
+            vm.set_restore_from(args.restore_from)
+            for file in files:
+                vm.map_file(file.path, file.addr, file.writable)
+            vm.load(programs[0])
+            vm.set_trace(args.trace, args.trace_size)
+            # The input file is opened anew by every run; the fuzzer rewrites it in between.
+            if not vm.fork_server(args.input):
+                sys.exit('No fuzzer to serve.')
+        return
 
-    ctypes.cdll.LoadLibrary(VM_LIB).vm_run(program, len(program), ram_size_mb, exec_type, debug)
+    with ExitStack() as stack:
+        # Entered first so that they are closed last, once the VM has written out what is left.
+        input_file = stack.enter_context(open(args.input, mode='rb')) if args.input is not None else None
+        output_file = stack.enter_context(open(args.output, mode='wb')) if args.output is not None else None
+        vm: VM = stack.enter_context(VM(ram_size_mb, exec_type, sparse_mem, debug, native_lib, **limits))
+        if input_file is not None:
+            vm.set_input_fd(input_file.fileno())
+        if output_file is not None:
+            vm.set_output(OutputType.FD, output_file.fileno())
+        vm.set_snapshot_out(args.snapshot_out)
+        vm.set_restore_from(args.restore_from)
+        for file in files:
+            vm.map_file(file.path, file.addr, file.writable)
+        vm.load(programs[0])
+        vm.set_profiling(args.profile is not None)
+        vm.set_trace(args.trace, args.trace_size)
+        status: Status = vm.run()
+        if args.profile is not None:
+            write_profile(vm.profile(), args.profile, args.labels_file, programs[0])
+        if status in (Status.OUT_OF_FUEL, Status.TIMED_OUT, Status.DIVIDE_BY_ZERO):
+            sys.exit(stopped(args.programs[0], status, vm.regs()))
+        if args.snapshot_out is not None and status != Status.CHECKPOINT:
+            sys.exit('Program exited before reaching a checkpoint; no snapshot saved.')
 
 
-run()
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,111 @@
+#include <algorithm>
+#include <cstdlib>
+#include <cstring>
+
+#include <dlfcn.h>
+
+#include "exe.h"
+
+
+AOTExecutor::AOTExecutor(size_t ram_size_mb, bool sparse_mem, bool debug, const char* native_lib)
+: ExecutionEngine(ram_size_mb, sparse_mem, debug)
+, native_lib(native_lib ? native_lib : ""), handle(nullptr), native_exec(nullptr)
+, image(nullptr), image_size(nullptr), text_modified(false)
+{
+    DBG("\ttype 'aot'" << endl);
+    DBG("\tnative library " << (native_lib ? native_lib : "n/a") << endl);
+}
+
+
+AOTExecutor::~AOTExecutor()
+{
+    if (handle != nullptr)
+        dlclose(handle);
+}
+
+
+void AOTExecutor::init_execution()
+{
+    DBG("Loading native library ..." << endl);
+    if (native_lib.empty()) {
+        cout << "No native library given." << endl;
+        std::abort();
+    }
+    handle = dlopen(native_lib.c_str(), RTLD_NOW | RTLD_LOCAL);
+    if (handle == nullptr) {
+        cout << dlerror() << endl;
+        std::abort();
+    }
+    native_exec = reinterpret_cast<native_exec_t>(dlsym(handle, "aot_exec"));
+    image = static_cast<const uint8_t*>(dlsym(handle, "aot_image"));
+    image_size = static_cast<const size_t*>(dlsym(handle, "aot_image_size"));
+    if (native_exec == nullptr || image == nullptr || image_size == nullptr) {
+        cout << "'" << native_lib << "' is not a native program." << endl;
+        std::abort();
+    }
+    DBG("\tNative code @" << (void*) native_exec << endl);
+}
+
+
+void AOTExecutor::load_program()
+{
+    if (*image_size != prog_size || std::memcmp(image, prog.data(), prog_size) != 0) {
+        cout << "'" << native_lib << "' was not translated from this program." << endl;
+        std::abort();
+    }
+    text_modified = false;
+
+    copy_program();
+    // A restored snapshot may hold text modified since the translation.
+    code_modified(0, prog_size);
+}
+
+
+void AOTExecutor::exec_program()
+{
+    DBG("Running program ..." << endl);
+
+    // Once the text no longer matches the translated image the native code is stale; keep stepping.
+    while (!text_modified) {
+        uint32_t arg = 0;
+        switch (native_exec(mem.get(), reg, &arg, &fuel)) {
+        case EXIT_DISPATCH:
+            if (!step() || out_of_fuel())
+                return;
+            break;
+        case EXIT_STORE_TEXT:
+            code_modified(arg, 4);
+            break;
+        case EXIT_OUT_OF_FUEL:
+            if (!refuel())
+                return;
+            break;
+        case EXIT_DIVIDE_BY_ZERO:
+            divide_by_zero();
+            return;
+        default:
+            std::abort();
+        }
+    }
+
+    while (step() && !out_of_fuel())
+        ;
+}
+
+
+void AOTExecutor::fini_execution()
+{
+    dump_registers();
+}
+
+
+void AOTExecutor::code_modified(uint32_t addr, uint32_t size)
+{
+    if (addr >= prog_size || text_modified)
+        return;
+    size = std::min<uint32_t>(size, prog_size - addr);
+    if (std::memcmp(&mem[addr], &prog[addr], size) != 0) {
+        DBG("Text modified at " << HEX(8, addr) << "; leaving native code ..." << endl);
+        text_modified = true;
+    }
+}
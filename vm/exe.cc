@@ -1,18 +1,862 @@
+#include <algorithm>
+#include <cerrno>
+#include <cstdlib>
+#include <cstring>
+
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
 #include "exe.h"
 
 
-ExecutionEngine::ExecutionEngine(const void* prog, size_t prog_size, size_t ram_size_mb, bool debug)
-: prog(prog), prog_size(prog_size), ram_size(ram_size_mb << 20), debug(debug)
-, mem(nullptr)
+ExecutionEngine::ExecutionEngine(size_t ram_size_mb, bool sparse_mem, bool debug)
+: prog_size(0), entry(PROG_ENTRY), data_addr(0), ram_size(sparse_mem ? ADDR_SPACE_SIZE : ram_size_mb << 20)
+, sparse_mem(sparse_mem), debug(debug)
+, snapshot_saved(false)
+, out(cout.rdbuf())
+, in_fd(STDIN_FILENO), in_pos(0)
+, mem(nullptr, mem_deleter_t{0}), text_guard(0)
+, fuel(0), fuel_granted(0), retired(0), max_instrs(0), timeout_ms(0), fuel_limit(0), status(RUNNING)
+, profiling(false), call_node(0)
+, trace_header(nullptr), trace_ring(nullptr), trace_mask(0), trace_pending(nullptr)
+, coverage(nullptr), coverage_shift(0), coverage_prev(0)
 {
     DBG("Initializing VM with:" << endl);
-    DBG("\tprogram at " << prog << ", size " << prog_size << endl);
-    DBG("\tmemory " << ram_size_mb << " MiB" << endl);
+    DBG("\tmemory " << (ram_size >> 20) << " MiB" << (sparse_mem ? ", sparse" : "") << endl);
 }
 
 
 ExecutionEngine::~ExecutionEngine()
 {
+    close_trace();
+}
+
+
+void ExecutionEngine::load(const void* prog, size_t prog_size, uint32_t entry,
+                           const void* data, size_t data_size, uint32_t data_addr)
+{
+    DBG("Loading program at " << prog << ", size " << prog_size << " ..." << endl);
+    this->prog.assign(static_cast<const uint8_t*>(prog), static_cast<const uint8_t*>(prog) + prog_size);
+    this->prog_size = prog_size;
+    this->entry = entry;
+    this->data.assign(static_cast<const uint8_t*>(data), static_cast<const uint8_t*>(data) + data_size);
+    this->data_addr = data_addr;
+    reset();
+}
+
+
+void ExecutionEngine::reset()
+{
+    if (out_buffer != nullptr)
+        out_buffer->str("");
+    in_pos = 0;
+    snapshot_saved = false;
+    fuel = fuel_granted = 0;
+    retired = 0;
+    status = RUNNING;
+    if (mem == nullptr) {
+        init_memory();
+        init_execution();
+    } else {
+        reset_memory();
+    }
+    map_files();
+    init_registers();
+    load_program();
+    reset_profile();
+    reset_trace();
+    coverage_prev = 0;
+}
+
+
+ExecutionEngine::status_t ExecutionEngine::run()
+{
+    start_limits();
+    if (instrumented())
+        exec_instrumented();
+    else
+        exec_program();
+    trace_done();
+    fini_execution();
+    out.flush();
+    return status;
+}
+
+
+uint64_t ExecutionEngine::run_for(uint64_t count)
+{
+    start_limits();
+    uint64_t n = 0;
+    while (n < count && (instrumented() ? step_instrumented() : step())) {
+        n++;
+        if (out_of_fuel())
+            break;
+    }
+    trace_done();
+    out.flush();
+    return n;
+}
+
+
+void ExecutionEngine::set_limits(uint64_t max_instrs, uint64_t timeout_ms)
+{
+    this->max_instrs = max_instrs;
+    this->timeout_ms = timeout_ms;
+}
+
+
+void ExecutionEngine::start_limits()
+{
+    retired = get_retired();
+    fuel = fuel_granted = 0;
+    fuel_limit = max_instrs != 0 ? retired + max_instrs : UINT64_MAX;
+    if (timeout_ms != 0)
+        deadline = std::chrono::steady_clock::now() + std::chrono::milliseconds(timeout_ms);
+    status = RUNNING;
+    refuel();
+}
+
+
+bool ExecutionEngine::refuel()
+{
+    retired = get_retired();
+    fuel = fuel_granted = 0;
+    if (retired >= fuel_limit) {
+        DBG("Out of fuel after " << retired << " instructions" << endl);
+        status = OUT_OF_FUEL;
+        return false;
+    }
+    uint64_t grant = fuel_limit - retired;
+    if (timeout_ms != 0) {
+        if (std::chrono::steady_clock::now() >= deadline) {
+            DBG("Timed out after " << retired << " instructions" << endl);
+            status = TIMED_OUT;
+            return false;
+        }
+        if (grant > DEADLINE_INTERVAL)
+            grant = DEADLINE_INTERVAL;
+    }
+    fuel = fuel_granted = static_cast<int64_t>(std::min<uint64_t>(grant, INT64_MAX));
+    return true;
+}
+
+
+void ExecutionEngine::set_output_stdout()
+{
+    out.flush();
+    out.rdbuf(cout.rdbuf());
+    out_buffer.reset();
+    out_fd.reset();
+}
+
+
+void ExecutionEngine::set_output_buffer()
+{
+    out.flush();
+    out_buffer.reset(new std::stringbuf());
+    out.rdbuf(out_buffer.get());
+    out_fd.reset();
+}
+
+
+void ExecutionEngine::set_output_fd(int fd)
+{
+    out.flush();
+    out_fd.reset(new FdSink(fd));
+    out.rdbuf(out_fd.get());
+    out_buffer.reset();
+}
+
+
+void ExecutionEngine::set_input_fd(int fd)
+{
+    in_fd = fd;
+    in_buffer.clear();
+    in_pos = 0;
+}
+
+
+void ExecutionEngine::set_input(const void* data, size_t size)
+{
+    in_fd = -1;
+    in_buffer.assign(static_cast<const char*>(data), size);
+    in_pos = 0;
+}
+
+
+void ExecutionEngine::mem_deleter_t::operator()(uint8_t* mem) const
+{
+    munmap(mem, size);
+}
+
+
+void ExecutionEngine::init_memory()
+{
+    DBG("Initializing memory ..." << endl);
+    if (!restore_from.empty())
+        restore_snapshot(restore_from.c_str());
+    else
+        map_memory();
+    DBG("\tMemory @" << (void*) mem.get() << "[" << HEX(0, ram_size) << "]" << endl);
+}
+
+
+void ExecutionEngine::map_memory()
+{
+    // Map a huge page more than needed so that the memory can be aligned for transparent huge pages,
+    // plus a guard so that accesses straddling the top of memory fault.
+    size_t size = ram_size + GUARD_SIZE;
+    int flags = MAP_PRIVATE | MAP_ANONYMOUS | (sparse_mem ? MAP_NORESERVE : 0);
+    void* addr = mmap(nullptr, size + HUGE_PAGE_SIZE, PROT_READ | PROT_WRITE, flags, -1, 0);
+    if (addr == MAP_FAILED) {
+        cout << "Cannot allocate " << (ram_size >> 20) << " MiB of memory." << endl;
+        std::abort();
+    }
+    uint8_t* base = static_cast<uint8_t*>(addr);
+    uint8_t* aligned = reinterpret_cast<uint8_t*>(
+        (reinterpret_cast<uintptr_t>(base) + HUGE_PAGE_SIZE - 1) & ~(HUGE_PAGE_SIZE - 1));
+    if (aligned != base)
+        munmap(base, aligned - base);
+    munmap(aligned + size, base + HUGE_PAGE_SIZE - aligned);
+    mem = std::unique_ptr<uint8_t[], mem_deleter_t>(aligned, mem_deleter_t{size});
+    protect_memory(ram_size, GUARD_SIZE);
+
+    text_guard = 0;
+    file_ranges.clear();
+    if (sparse_mem) {
+        // Lay out the address space as documented: guarded text at the bottom, the heap backed by
+        // huge pages and the stack at the top, guarded against overflowing into the heap.
+        guard_text();
+        protect_memory(STACK_END, GUARD_SIZE);
+        madvise(&mem[HEAP_START], HEAP_END - HEAP_START, MADV_HUGEPAGE);
+    }
+}
+
+
+void ExecutionEngine::reset_memory()
+{
+    DBG("Resetting memory ..." << endl);
+    if (!restore_from.empty()) {
+        restore_snapshot(restore_from.c_str());
+        return;
+    }
+    // Dropping the pages is cheaper than clearing them; they read back as zeros.
+    madvise(mem.get(), ram_size, MADV_DONTNEED);
+    if (sparse_mem)
+        guard_text();
+}
+
+
+void ExecutionEngine::guard_text()
+{
+    size_t page_size = sysconf(_SC_PAGESIZE);
+    size_t text_end = (prog_size + page_size - 1) & ~(page_size - 1);
+    if (text_end == text_guard)
+        return;
+    if (text_end + GUARD_SIZE > HEAP_START) {
+        cout << "Program too large; text must end below " << HEX(8, HEAP_START - GUARD_SIZE) << "." << endl;
+        std::abort();
+    }
+    if (text_guard != 0)
+        unprotect_memory(text_guard, GUARD_SIZE);
+    protect_memory(text_end, GUARD_SIZE);
+    text_guard = text_end;
+}
+
+
+void ExecutionEngine::protect_memory(size_t addr, size_t size)
+{
+    DBG("\tGuard @" << HEX(8, addr) << "[" << HEX(0, size) << "]" << endl);
+    if (mprotect(&mem[addr], size, PROT_NONE) != 0) {
+        cout << "Cannot protect memory at " << HEX(8, addr) << "." << endl;
+        std::abort();
+    }
+}
+
+
+void ExecutionEngine::unprotect_memory(size_t addr, size_t size)
+{
+    if (mprotect(&mem[addr], size, PROT_READ | PROT_WRITE) != 0) {
+        cout << "Cannot unprotect memory at " << HEX(8, addr) << "." << endl;
+        std::abort();
+    }
+}
+
+
+void ExecutionEngine::map_file(const char* path, uint32_t addr, bool writable)
+{
+    if (path == nullptr)
+        mapped_files.clear();
+    else
+        mapped_files.push_back({ path, addr, writable });
+}
+
+
+void ExecutionEngine::map_files()
+{
+    // Back to plain memory first; the files may have changed, or be mapped elsewhere, since.
+    int flags = MAP_PRIVATE | MAP_ANONYMOUS | MAP_FIXED | (sparse_mem ? MAP_NORESERVE : 0);
+    for (const auto& [addr, size] : file_ranges) {
+        if (mmap(&mem[addr], size, PROT_READ | PROT_WRITE, flags, -1, 0) == MAP_FAILED) {
+            cout << "Cannot unmap file at " << HEX(8, addr) << "." << endl;
+            std::abort();
+        }
+    }
+    file_ranges.clear();
+
+    size_t page_size = sysconf(_SC_PAGESIZE);
+    uint32_t heap_start, heap_end;
+    heap_bounds(heap_start, heap_end);
+    for (const auto& file : mapped_files) {
+        int fd = open(file.path.c_str(), O_RDONLY);
+        struct stat st;
+        if (fd < 0 || fstat(fd, &st) != 0) {
+            cout << "Cannot open '" << file.path << "'." << endl;
+            std::abort();
+        }
+        size_t size = (size_t(st.st_size) + page_size - 1) & ~(page_size - 1);
+        DBG("	File '" << file.path << "' @" << HEX(8, file.addr) << "[" << HEX(0, st.st_size) << "]" << endl);
+        bool overlaps = std::any_of(file_ranges.begin(), file_ranges.end(), [&](const auto& range) {
+            return file.addr < range.first + range.second && range.first < file.addr + size;
+        });
+        if (file.addr % page_size != 0 || file.addr < heap_start || file.addr + size > heap_end || overlaps) {
+            cout << "Cannot map '" << file.path << "' at " << HEX(8, file.addr)
+                 << "; it must be page aligned, in the heap and clear of other files." << endl;
+            std::abort();
+        }
+        if (size > 0) {
+            int prot = PROT_READ | (file.writable ? PROT_WRITE : 0);
+            if (mmap(&mem[file.addr], size, prot, MAP_PRIVATE | MAP_FIXED, fd, 0) == MAP_FAILED) {
+                cout << "Cannot map '" << file.path << "'." << endl;
+                std::abort();
+            }
+            file_ranges.emplace_back(file.addr, size);
+        }
+        close(fd);
+    }
+}
+
+
+bool ExecutionEngine::is_file_mapped(size_t addr) const
+{
+    return std::any_of(file_ranges.begin(), file_ranges.end(), [&](const auto& range) {
+        return addr >= range.first && addr < range.first + range.second;
+    });
+}
+
+
+void ExecutionEngine::init_registers()
+{
+    DBG("Initializing registers ..." << endl);
+    // Restored along with memory.
+    if (!restore_from.empty())
+        return;
+    std::memset(&reg, 0, sizeof reg);
+    // Wraps to 0 for the full address space; the first push then lands just below 4 GiB.
+    reg[SP] = static_cast<uint32_t>(ram_size);
+    reg[PC] = entry;
+}
+
+
+void ExecutionEngine::copy_program()
+{
+    DBG("Loading program ..." << endl);
+    // The restored memory already holds the text, as it was when the snapshot was taken.
+    if (!restore_from.empty())
+        return;
+    std::memmove(mem.get(), prog.data(), prog_size);
+    if (!data.empty())
+        std::memmove(&mem[data_addr], data.data(), data.size());
+}
+
+
+void ExecutionEngine::divide_by_zero()
+{
+    DBG("Division by zero at " << HEX(8, reg[PC]) << endl);
+    status = DIVIDE_BY_ZERO;
+}
+
+
+bool ExecutionEngine::sys_enter()
+{
+    uint32_t syscall_id = imm_val(mem[reg[SP] + 4]);
+    switch (syscall_id) {
+    case SYSCALL_VM_EXIT:
+        status = EXITED;
+        return false;
+    case SYSCALL_DISPLAY_INT: {
+        int32_t val = imm_val(mem[reg[SP] + 8]);
+        // No flush; the output goes out in batches, at the latest when the run ends.
+        out << val << '\n';
+        break;
+    }
+    case SYSCALL_CHECKPOINT:
+        if (snapshot_out.empty())
+            break;
+        save_snapshot(snapshot_out.c_str());
+        status = CHECKPOINT;
+        return false;
+    case SYSCALL_WRITE:
+        // The result replaces the system call ID on the stack.
+        uint8_to_uint32(mem[reg[SP] + 4]) = sys_write(imm_val(mem[reg[SP] + 8]), imm_val(mem[reg[SP] + 12]));
+        break;
+    case SYSCALL_READ:
+        uint8_to_uint32(mem[reg[SP] + 4]) = sys_read(imm_val(mem[reg[SP] + 8]), imm_val(mem[reg[SP] + 12]));
+        break;
+    case SYSCALL_MALLOC:
+        uint8_to_uint32(mem[reg[SP] + 4]) = sys_malloc(imm_val(mem[reg[SP] + 8]));
+        break;
+    case SYSCALL_FREE:
+        sys_free(imm_val(mem[reg[SP] + 8]));
+        break;
+    case SYSCALL_REALLOC:
+        uint8_to_uint32(mem[reg[SP] + 4]) = sys_realloc(imm_val(mem[reg[SP] + 8]), imm_val(mem[reg[SP] + 12]));
+        break;
+    case SYSCALL_MEMCPY:
+        uint8_to_uint32(mem[reg[SP] + 4]) = sys_memcpy(
+            imm_val(mem[reg[SP] + 8]), imm_val(mem[reg[SP] + 12]), imm_val(mem[reg[SP] + 16]));
+        break;
+    case SYSCALL_MEMSET:
+        uint8_to_uint32(mem[reg[SP] + 4]) = sys_memset(
+            imm_val(mem[reg[SP] + 8]), imm_val(mem[reg[SP] + 12]), imm_val(mem[reg[SP] + 16]));
+        break;
+    case SYSCALL_MEMCMP:
+        uint8_to_uint32(mem[reg[SP] + 4]) = sys_memcmp(
+            imm_val(mem[reg[SP] + 8]), imm_val(mem[reg[SP] + 12]), imm_val(mem[reg[SP] + 16]));
+        break;
+    default:
+        out.flush();
+        std::abort();
+    }
+    return true;
+}
+
+
+uint32_t ExecutionEngine::sys_write(uint32_t addr, uint32_t size)
+{
+    check_buffer(addr, size);
+    out.write(reinterpret_cast<const char*>(&mem[addr]), size);
+    return size;
+}
+
+
+uint32_t ExecutionEngine::sys_read(uint32_t addr, uint32_t size)
+{
+    check_buffer(addr, size);
+    uint32_t n = 0;
+    if (in_fd >= 0) {
+        // Whatever was written so far, a prompt say, shows before blocking on input.
+        out.flush();
+        ssize_t r;
+        do
+            r = read(in_fd, &mem[addr], size);
+        while (r < 0 && errno == EINTR);
+        if (r < 0)
+            return static_cast<uint32_t>(-1);
+        n = r;
+    } else {
+        n = std::min<size_t>(size, in_buffer.size() - in_pos);
+        std::memcpy(&mem[addr], in_buffer.data() + in_pos, n);
+        in_pos += n;
+    }
+    code_modified(addr, n);
+    return n;
+}
+
+
+void ExecutionEngine::check_buffer(uint32_t addr, uint32_t size) const
+{
+    if (size_t(addr) + size > ram_size) {
+        out.flush();
+        cout << "Invalid buffer at " << HEX(8, addr) << "[" << HEX(0, size) << "]." << endl;
+        std::abort();
+    }
+}
+
+
+uint32_t ExecutionEngine::sys_memcpy(uint32_t dst, uint32_t src, uint32_t size)
+{
+    check_buffer(dst, size);
+    check_buffer(src, size);
+    // The buffers may overlap.
+    std::memmove(&mem[dst], &mem[src], size);
+    code_modified(dst, size);
+    return dst;
+}
+
+
+uint32_t ExecutionEngine::sys_memset(uint32_t addr, uint32_t val, uint32_t size)
+{
+    check_buffer(addr, size);
+    std::memset(&mem[addr], static_cast<uint8_t>(val), size);
+    code_modified(addr, size);
+    return addr;
+}
+
+
+uint32_t ExecutionEngine::sys_memcmp(uint32_t addr1, uint32_t addr2, uint32_t size)
+{
+    check_buffer(addr1, size);
+    check_buffer(addr2, size);
+    int r = std::memcmp(&mem[addr1], &mem[addr2], size);
+    return static_cast<uint32_t>(r < 0 ? -1 : r > 0 ? 1 : 0);
+}
+
+
+bool ExecutionEngine::step()
+{
+    const uint8_t* ip = &mem[reg[PC]];
+    uint8_t ri = reg_imm(ip[0]);
+    uint8_t dst = reg_dst(ip[1]);
+    uint8_t src = reg_src(ip[1]);
+    uint32_t val = ri == IMM ? imm_val(ip[2]) : reg[src];
+    uint32_t len = ri == IMM ? 6 : 2;
+    uint32_t target = imm_val(ip[1]);
+
+    auto jump_if = [&](bool cond) {
+        reg[PC] = cond ? target : reg[PC] + 5;
+    };
+
+    fuel--;
+
+    switch (instr(ip[0])) {
+    case LOAD: {
+        uint32_t addr = ri == IMM ? reg[src] + val : reg[src];
+        reg[dst] = uint8_to_uint32(mem[addr]);
+        reg[PC] += len;
+        break;
+    }
+    case STORE: {
+        uint32_t addr = ri == IMM ? reg[dst] + val : reg[dst];
+        uint8_to_uint32(mem[addr]) = reg[src];
+        code_modified(addr, 4);
+        reg[PC] += len;
+        break;
+    }
+    case LOADB:
+    case LOADSB:
+    case LOADH:
+    case LOADSH: {
+        uint32_t addr = ri == IMM ? reg[src] + val : reg[src];
+        switch (instr(ip[0])) {
+        case LOADB:  reg[dst] = zext8(mem[addr]);                       break;
+        case LOADSB: reg[dst] = sext8(mem[addr]);                       break;
+        case LOADH:  reg[dst] = zext16(uint8_to_uint16(mem[addr]));     break;
+        case LOADSH: reg[dst] = sext16(uint8_to_uint16(mem[addr]));     break;
+        }
+        reg[PC] += len;
+        break;
+    }
+    case STOREB: {
+        uint32_t addr = ri == IMM ? reg[dst] + val : reg[dst];
+        mem[addr] = static_cast<uint8_t>(reg[src]);
+        code_modified(addr, 1);
+        reg[PC] += len;
+        break;
+    }
+    case STOREH: {
+        uint32_t addr = ri == IMM ? reg[dst] + val : reg[dst];
+        uint8_to_uint16(mem[addr]) = static_cast<uint16_t>(reg[src]);
+        code_modified(addr, 2);
+        reg[PC] += len;
+        break;
+    }
+    case LOADX: {
+        uint32_t addr = reg[src] + (reg[reg_dst(ip[2])] << scale(ip[2]));
+        reg[dst] = uint8_to_uint32(mem[addr]);
+        reg[PC] += 3;
+        break;
+    }
+    case STOREX: {
+        uint32_t addr = reg[dst] + (reg[reg_dst(ip[2])] << scale(ip[2]));
+        uint8_to_uint32(mem[addr]) = reg[src];
+        code_modified(addr, 4);
+        reg[PC] += 3;
+        break;
+    }
+    case MOV:
+        reg[dst] = val;
+        reg[PC] += len;
+        break;
+    case ADD:
+        reg[dst] += val;
+        reg[PC] += len;
+        break;
+    case SUB:
+        reg[dst] -= val;
+        reg[PC] += len;
+        break;
+    case AND:
+        reg[dst] &= val;
+        reg[PC] += len;
+        break;
+    case OR:
+        reg[dst] |= val;
+        reg[PC] += len;
+        break;
+    case XOR:
+        reg[dst] ^= val;
+        reg[PC] += len;
+        break;
+    case MUL:
+        reg[dst] *= val;
+        reg[PC] += len;
+        break;
+    case DIV:
+    case SDIV:
+    case MOD:
+    case SMOD:
+        if (val == 0) {
+            divide_by_zero();
+            return false;
+        }
+        switch (instr(ip[0])) {
+        case DIV:  reg[dst] /= val;                 break;
+        case SDIV: reg[dst] = sdiv(reg[dst], val);  break;
+        case MOD:  reg[dst] %= val;                 break;
+        case SMOD: reg[dst] = smod(reg[dst], val);  break;
+        }
+        reg[PC] += len;
+        break;
+    case SHL:
+        reg[dst] <<= val & 31;
+        reg[PC] += len;
+        break;
+    case SHR:
+        reg[dst] >>= val & 31;
+        reg[PC] += len;
+        break;
+    case SAR:
+        reg[dst] = sar(reg[dst], val);
+        reg[PC] += len;
+        break;
+    case NOT:
+        reg[dst] = ~reg[dst];
+        reg[PC] += 2;
+        break;
+    case CMP:
+        reg[FLAGS] = 0;
+        if (reg[dst] == 0)
+            reg[FLAGS] |= FLAG_Z;
+        if (reg[dst] < val)
+            reg[FLAGS] |= FLAG_LT;
+        else if (reg[dst] > val)
+            reg[FLAGS] |= FLAG_GT;
+        else
+            reg[FLAGS] |= FLAG_EQ;
+        reg[PC] += len;
+        break;
+    case PUSH:
+        reg[SP] -= 4;
+        uint8_to_uint32(mem[reg[SP]]) = reg[dst];
+        reg[PC] += 2;
+        break;
+    case POP:
+        reg[dst] = uint8_to_uint32(mem[reg[SP]]);
+        reg[SP] += 4;
+        reg[PC] += 2;
+        break;
+    case CALL:
+        reg[SP] -= 4;
+        uint8_to_uint32(mem[reg[SP]]) = reg[PC] + 5;
+        reg[PC] = target;
+        break;
+    case RET:
+        reg[PC] = uint8_to_uint32(mem[reg[SP]]);
+        reg[SP] += 4;
+        break;
+    case JMP:
+        if (reg[PC] == SYS_ENTER_ADDR) {
+            if (!sys_enter())
+                return false;
+            reg[PC] = uint8_to_uint32(mem[reg[SP]]);
+            reg[SP] += 4;
+            break;
+        }
+        reg[PC] = target;
+        break;
+    case JMPZ:
+        jump_if(reg[FLAGS] & FLAG_Z);
+        break;
+    case JMPNZ:
+        jump_if(!(reg[FLAGS] & FLAG_Z));
+        break;
+    case JMPEQ:
+        jump_if(reg[FLAGS] & FLAG_EQ);
+        break;
+    case JMPNE:
+        jump_if(!(reg[FLAGS] & FLAG_EQ));
+        break;
+    case JMPGT:
+        jump_if(reg[FLAGS] & FLAG_GT);
+        break;
+    case JMPLT:
+        jump_if(reg[FLAGS] & FLAG_LT);
+        break;
+    case JMPGE:
+        jump_if(reg[FLAGS] & (FLAG_GT | FLAG_EQ));
+        break;
+    case JMPLE:
+        jump_if(reg[FLAGS] & (FLAG_LT | FLAG_EQ));
+        break;
+    default:
+        std::abort();
+    }
+    return true;
+}
+
+
+void ExecutionEngine::exec_instrumented()
+{
+    DBG("Running program, instrumented ..." << endl);
+    while (step_instrumented() && !out_of_fuel())
+        ;
+}
+
+
+bool ExecutionEngine::step_instrumented()
+{
+    uint32_t pc = reg[PC];
+    uint8_t op = instr(mem[pc]);
+    if (profiling)
+        profile_retire(pc);
+    if (trace_header != nullptr)
+        trace_instr(pc);
+    if (!step())
+        return false;
+    // Taken branches only; a system call returns straight from $sys_enter.
+    if (coverage != nullptr && (op == CALL || op == RET || (op >= JMP && op <= JMPLE && reg[PC] != pc + 5)))
+        cover(reg[PC]);
+    if (profiling) {
+        if (op == CALL)
+            profile_call(reg[PC]);
+        // A system call returns straight from $sys_enter.
+        else if (op == RET || (op == JMP && pc == SYS_ENTER_ADDR))
+            profile_ret();
+    }
+    return true;
+}
+
+
+void ExecutionEngine::trace(uint8_t ri, uint8_t dst, uint8_t src, uint32_t iv) const
+{
+    if (!debug)
+        return;
+
+    static const char* const R[] = {
+        "r0", "r1", "r2", "r3", "r4", "r5", "r6", "r7", "r8", "r9", "r10", "r11", "r12", "flags", "sp", "pc"
+    };
+    auto HEX_DUMP = [this](uint8_t num_bytes) {
+        uint8_t* addr = &mem[reg[PC]];
+        for (uint8_t i = 0; i < num_bytes; i++)
+            DBG_(HEX_(2, ((int) *(addr + i))) << " ");
+        for (uint8_t i = 0; i < 6 - num_bytes; i++)
+            DBG_("   ");
+        DBG_("   ");
+    };
+    // [base+disp], [base-disp] or [base+index*scale]
+    auto ADDR = [this](uint8_t base, uint8_t ri, uint32_t disp) {
+        uint8_t idx = mem[reg[PC] + 2];
+        DBG_("[" << R[base]);
+        if (instr(mem[reg[PC]]) == LOADX || instr(mem[reg[PC]]) == STOREX) {
+            DBG_("+" << R[reg_dst(idx)]);
+            if (scale(idx) != 0)
+                DBG_("*" << (1 << scale(idx)));
+        } else if (ri == IMM) {
+            if (static_cast<int32_t>(disp) < 0)
+                DBG_("-" << 0 - disp)
+            else
+                DBG_("+" << disp)
+        }
+        DBG_("]");
+    };
+
+    DBG("\t" << HEX(8, reg[PC]) << "   ");
+    switch (instr(mem[reg[PC]])) {
+    case LOAD:
+        HEX_DUMP(ri?6:2); DBG_("load " << R[dst] << ", "); ADDR(src, ri, iv);                 break;
+    case STORE:
+        HEX_DUMP(ri?6:2); DBG_("store "); ADDR(dst, ri, iv); DBG_(", " << R[src]);            break;
+    case LOADB:
+        HEX_DUMP(ri?6:2); DBG_("loadb " << R[dst] << ", "); ADDR(src, ri, iv);                break;
+    case LOADSB:
+        HEX_DUMP(ri?6:2); DBG_("loadsb " << R[dst] << ", "); ADDR(src, ri, iv);               break;
+    case LOADH:
+        HEX_DUMP(ri?6:2); DBG_("loadh " << R[dst] << ", "); ADDR(src, ri, iv);                break;
+    case LOADSH:
+        HEX_DUMP(ri?6:2); DBG_("loadsh " << R[dst] << ", "); ADDR(src, ri, iv);               break;
+    case STOREB:
+        HEX_DUMP(ri?6:2); DBG_("storeb "); ADDR(dst, ri, iv); DBG_(", " << R[src]);           break;
+    case STOREH:
+        HEX_DUMP(ri?6:2); DBG_("storeh "); ADDR(dst, ri, iv); DBG_(", " << R[src]);           break;
+    case LOADX:
+        HEX_DUMP(3);      DBG_("load " << R[dst] << ", "); ADDR(src, ri, iv);                 break;
+    case STOREX:
+        HEX_DUMP(3);      DBG_("store "); ADDR(dst, ri, iv); DBG_(", " << R[src]);            break;
+    case MOV:
+        HEX_DUMP(ri?6:2); DBG_("mov " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
+    case ADD:
+        HEX_DUMP(ri?6:2); DBG_("add " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
+    case SUB:
+        HEX_DUMP(ri?6:2); DBG_("sub " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
+    case AND:
+        HEX_DUMP(ri?6:2); DBG_("and " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
+    case OR:
+        HEX_DUMP(ri?6:2); DBG_("or " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]);  break;
+    case XOR:
+        HEX_DUMP(ri?6:2); DBG_("xor " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
+    case NOT:
+        HEX_DUMP(2);      DBG_("not " << R[dst]);                                             break;
+    case CMP:
+        HEX_DUMP(ri?6:2); DBG_("cmp " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
+    case MUL:
+        HEX_DUMP(ri?6:2); DBG_("mul " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
+    case DIV:
+        HEX_DUMP(ri?6:2); DBG_("div " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
+    case SDIV:
+        HEX_DUMP(ri?6:2); DBG_("sdiv " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
+    case MOD:
+        HEX_DUMP(ri?6:2); DBG_("mod " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
+    case SMOD:
+        HEX_DUMP(ri?6:2); DBG_("smod " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
+    case SHL:
+        HEX_DUMP(ri?6:2); DBG_("shl " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
+    case SHR:
+        HEX_DUMP(ri?6:2); DBG_("shr " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
+    case SAR:
+        HEX_DUMP(ri?6:2); DBG_("sar " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
+    case PUSH:
+        HEX_DUMP(2);      DBG_("push " << R[dst]);                                            break;
+    case POP:
+        HEX_DUMP(2);      DBG_("pop " << R[dst]);                                             break;
+    case CALL:
+        HEX_DUMP(5);      DBG_("call " << HEX(8, iv));                                        break;
+    case RET:
+        HEX_DUMP(1);      DBG_("ret");                                                        break;
+    case JMP:
+        HEX_DUMP(5);      DBG_("jmp " << HEX(8, iv));                                         break;
+    case JMPZ:
+        HEX_DUMP(5);      DBG_("jmpz " << HEX(8, iv));                                        break;
+    case JMPNZ:
+        HEX_DUMP(5);      DBG_("jmpnz " << HEX(8, iv));                                       break;
+    case JMPEQ:
+        HEX_DUMP(5);      DBG_("jmpeq " << HEX(8, iv));                                       break;
+    case JMPNE:
+        HEX_DUMP(5);      DBG_("jmpne " << HEX(8, iv));                                       break;
+    case JMPGT:
+        HEX_DUMP(5);      DBG_("jmpgt " << HEX(8, iv));                                       break;
+    case JMPLT:
+        HEX_DUMP(5);      DBG_("jmplt " << HEX(8, iv));                                       break;
+    case JMPGE:
+        HEX_DUMP(5);      DBG_("jmpge " << HEX(8, iv));                                       break;
+    case JMPLE:
+        HEX_DUMP(5);      DBG_("jmple " << HEX(8, iv));                                       break;
+    default:
+        std::abort();
+    }
+    DBG_(endl);
 }
 
 
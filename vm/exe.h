@@ -1,17 +1,26 @@
 #pragma once
 
 
+#include <algorithm>
+#include <chrono>
 #include <cstddef>
 #include <cstdint>
 #include <iomanip>
 #include <iostream>
 #include <memory>
+#include <sstream>
+#include <string>
+#include <unordered_map>
+#include <utility>
+#include <vector>
+
+#include "sink.h"
 
 
 using std::cout, std:: endl;
 
 
-#define DBG_(DATA) { if (debug) { cout << DATA; } }
+#define DBG_(DATA) { if (debug) { out << DATA; } }
 #define DBG(DATA) DBG_("[DEBUG] " << DATA)
 #define HEX_(WIDTH, DATA) \
     std::setw(WIDTH) << \
@@ -20,31 +29,193 @@ using std::cout, std:: endl;
 #define HEX(WIDTH, DATA) "0x" << HEX_(WIDTH, DATA)
 
 class ExecutionEngine {
+public:
+    typedef enum : uint8_t {
+        RUNNING         = 0,
+        EXITED          = 1,
+        CHECKPOINT      = 2,
+        OUT_OF_FUEL     = 3,
+        TIMED_OUT       = 4,
+        DIVIDE_BY_ZERO  = 5
+    } status_t;
+
+    // One per distinct call stack; the first one stands for the entry point and is its own caller.
+    typedef struct {
+        uint32_t func;                          // the address called
+        uint32_t caller;                        // index of the calling stack
+        uint64_t calls;
+        uint64_t instrs;                        // retired in the function itself, not in its callees
+    } call_node_t;
+
+    // One per instruction run, in the trace ring.
+    typedef struct {
+        uint32_t pc;
+        uint8_t code[6];                        // the instruction as encoded, only as long as it is
+        uint8_t reg;                            // the register it wrote, NO_REG if none
+        uint8_t unused;
+        uint32_t val;                           // the value written
+    } trace_record_t;
+
 protected:
-    const void* prog;
+    struct mem_deleter_t {
+        size_t size;
+        void operator()(uint8_t* mem) const;
+    };
+
+    std::vector<uint8_t> prog;
     size_t prog_size;
+    // Where execution starts; the data, if any, is copied to memory along with the text.
+    uint32_t entry;
+    std::vector<uint8_t> data;
+    uint32_t data_addr;
     size_t ram_size;
+    bool sparse_mem;
     bool debug;
 
-    std::unique_ptr<uint8_t[]> mem;
+    std::string snapshot_out;
+    std::string restore_from;
+    bool snapshot_saved;
+
+    // Where the program, and debug info, goes: std::cout, out_buffer or out_fd; flushed after each run.
+    mutable std::ostream out;
+    std::unique_ptr<std::stringbuf> out_buffer;
+    std::unique_ptr<FdSink> out_fd;
+
+    // Where SYSCALL_READ takes input from: in_fd or, when negative, in_buffer.
+    int in_fd;
+    std::string in_buffer;
+    size_t in_pos;
+
+    std::unique_ptr<uint8_t[], mem_deleter_t> mem;
+    size_t text_guard;
+
+    // Host files mapped into the heap on every load or reset, and where they went the last time.
+    typedef struct {
+        std::string path;
+        uint32_t addr;
+        bool writable;                          // copy-on-write; the file itself is never written
+    } mapped_file_t;
+    std::vector<mapped_file_t> mapped_files;
+    std::vector<std::pair<uint32_t, size_t>> file_ranges;
     uint32_t reg[16];
 
+    // Counted down as instructions retire, and only looked at on backward jumps, calls and returns;
+    // once it runs out refuel() checks the limits and hands out more.
+    int64_t fuel;
+    int64_t fuel_granted;
+    uint64_t retired;
+    uint64_t max_instrs;
+    uint64_t timeout_ms;
+    uint64_t fuel_limit;
+    std::chrono::steady_clock::time_point deadline;
+    status_t status;
+
+    // Retired instructions per address, and per call stack, from the last load or reset on.
+    bool profiling;
+    std::vector<uint64_t> profile_pcs;          // text addresses
+    std::unordered_map<uint32_t, uint64_t> profile_far_pcs;
+    std::vector<call_node_t> call_nodes;
+    std::unordered_map<uint64_t, uint32_t> call_edges;
+    uint32_t call_node;
+
+    // The last instructions run, in a ring of records in a file mapped to memory, so that they are
+    // there even when the VM aborts; the record of the instruction running is completed by the next one.
+    struct trace_header_t;
+    trace_header_t* trace_header;
+    trace_record_t* trace_ring;
+    uint64_t trace_mask;
+    trace_record_t* trace_pending;
+
+    // AFL style edge coverage: a hit count per pair of consecutive branch targets, hashed, bumped on
+    // every taken branch, call and return; the bitmap is the caller's, shared memory say.
+    uint8_t* coverage;
+    uint32_t coverage_shift;
+    uint32_t coverage_prev;
+
+    // Once per engine, after memory is mapped.
     virtual void init_execution() = 0;
+    // Every time a program is loaded, after memory and registers are initialized.
     virtual void load_program() = 0;
     virtual void exec_program() = 0;
+    // Like exec_program, profiling, tracing or following coverage; single steps unless the engine knows better.
+    virtual void exec_instrumented();
     virtual void fini_execution() = 0;
 
 public:
-    ExecutionEngine(const void* prog, size_t prog_size, size_t ram_size_mb, bool debug);
+    static const uint32_t NUM_REGS              = 16;
+
+    ExecutionEngine(size_t ram_size_mb, bool sparse_mem, bool debug);
     virtual ~ExecutionEngine();
 
-    virtual void execute() final {
-        init_execution();
-        load_program();
-        exec_program();
-        fini_execution();
+    // Start over with a copy of the given program; memory and registers are reinitialized.
+    void load(const void* prog, size_t prog_size, uint32_t entry = PROG_ENTRY,
+              const void* data = nullptr, size_t data_size = 0, uint32_t data_addr = 0);
+    // Start over with the program in the given image file, as written by asm.py.
+    void load_image(const char* path);
+    // Start over with the program loaded last.
+    void reset();
+    // Run until the program exits, stops at a checkpoint or hits a limit.
+    status_t run();
+    // Run at most count instructions; returns how many ran, fewer than count once the program stops.
+    uint64_t run_for(uint64_t count);
+
+    // Limit each run to about max_instrs instructions and timeout_ms milliseconds; 0 for no limit.
+    // Both are only checked on backward jumps, calls and returns, so a run may go a little over.
+    void set_limits(uint64_t max_instrs, uint64_t timeout_ms);
+    status_t get_status() const { return status; }
+    // Instructions retired since the last load or reset.
+    uint64_t get_retired() const { return retired + (fuel_granted - fuel); }
+
+    // Write the output to std::cout, the default.
+    void set_output_stdout();
+    // Keep the output of each run, from the last load or reset on, in memory.
+    void set_output_buffer();
+    // Write the output to the given file descriptor, in large batches.
+    void set_output_fd(int fd);
+    std::string output() const { return out_buffer != nullptr ? out_buffer->str() : std::string(); }
+
+    // Count the instructions retired per address and per call stack; a separate, slower, way to run.
+    void set_profiling(bool profiling);
+    // Nonzero counts only, by address.
+    std::vector<std::pair<uint32_t, uint64_t>> get_profile_pcs() const;
+    const std::vector<call_node_t>& get_profile_calls() const { return call_nodes; }
+
+    // Keep the last size instructions run, at least, in a ring in the given file; nullptr to stop tracing.
+    void set_trace(const char* path, uint64_t size);
+
+    // Read the input from the given file descriptor; STDIN by default.
+    void set_input_fd(int fd);
+    // Read the input from a copy of the given data, from the start again on every load or reset.
+    void set_input(const void* data, size_t size);
+
+    uint32_t get_reg(uint32_t r) const { return reg[r]; }
+    void set_reg(uint32_t r, uint32_t val) { reg[r] = val; }
+    // Guest memory and registers, in place; memory moves when restored from a snapshot.
+    uint8_t* get_mem() { return mem.get(); }
+    size_t get_mem_size() const { return ram_size; }
+    uint32_t* get_regs() { return reg; }
+
+    virtual status_t execute(const void* prog, size_t prog_size) final {
+        load(prog, prog_size);
+        return run();
     }
 
+    // Stop at the first checkpoint and save the VM state there.
+    void set_snapshot_out(const char* path) { snapshot_out = path != nullptr ? path : ""; }
+    // Start from a saved VM state, memory configuration included, instead of from scratch.
+    void set_restore_from(const char* path) { restore_from = path != nullptr ? path : ""; }
+
+    // Count the edges taken in the given bitmap, of a power of 2 size; nullptr to stop.
+    void set_coverage(uint8_t* bitmap, size_t size);
+    // Serve AFL's fork server on its file descriptors: each run is a fork of the program as loaded, reading
+    // its input from the file at input_path, if given; returns false if no fuzzer is listening.
+    bool serve_forks(const char* input_path);
+
+    // Map a host file read-only, or copy-on-write, at a page aligned address in the heap, from the next
+    // load or reset on; nullptr to map none.
+    void map_file(const char* path, uint32_t addr, bool writable);
+    bool is_snapshot_saved() const { return snapshot_saved; }
+
 protected:
     typedef enum : uint8_t {
         LOAD    =  1,
@@ -69,7 +240,23 @@ protected:
         JMPGT   = 20,
         JMPLT   = 21,
         JMPGE   = 22,
-        JMPLE   = 23
+        JMPLE   = 23,
+        MUL     = 24,
+        DIV     = 25,
+        SDIV    = 26,
+        MOD     = 27,
+        SMOD    = 28,
+        SHL     = 29,
+        SHR     = 30,
+        SAR     = 31,
+        LOADX   = 32,
+        STOREX  = 33,
+        LOADB   = 34,
+        LOADSB  = 35,
+        LOADH   = 36,
+        LOADSH  = 37,
+        STOREB  = 38,
+        STOREH  = 39
     } instruction_t;
     
     typedef enum : uint8_t {
@@ -96,9 +283,33 @@ protected:
         IMM     =  1
     } reg_imm_t;
 
+    static const uint8_t NO_REG                 = 0xff;
+
     static const uint32_t SYS_ENTER_ADDR        = 0x0;
     static const uint32_t SYSCALL_VM_EXIT       = 0;
     static const uint32_t SYSCALL_DISPLAY_INT   = 1;
+    static const uint32_t SYSCALL_CHECKPOINT    = 2;
+    static const uint32_t SYSCALL_WRITE         = 3;
+    static const uint32_t SYSCALL_READ          = 4;
+    static const uint32_t SYSCALL_MALLOC        = 5;
+    static const uint32_t SYSCALL_FREE          = 6;
+    static const uint32_t SYSCALL_REALLOC       = 7;
+    static const uint32_t SYSCALL_MEMCPY        = 8;
+    static const uint32_t SYSCALL_MEMSET        = 9;
+    static const uint32_t SYSCALL_MEMCMP        = 10;
+
+    // Right after the JMP at $sys_enter.
+    static const uint32_t PROG_ENTRY            = 5;
+
+    static const uint32_t HEAP_START            = 0x40000000;
+    static const uint32_t HEAP_END              = 0xe0000000;
+    static const uint32_t STACK_END             = 0xe0000000;
+    static const size_t ADDR_SPACE_SIZE         = size_t(1) << 32;
+    static const size_t GUARD_SIZE              = 64 << 10;
+    static const size_t HUGE_PAGE_SIZE          = 2 << 20;
+
+    // How many instructions may retire between two looks at the clock.
+    static const uint64_t DEADLINE_INTERVAL     = 1 << 16;
 
     static const uint32_t FLAG_Z                = 0b00000001;
     static const uint32_t FLAG_EQ               = 0b00000010;
@@ -109,31 +320,269 @@ protected:
     static const uint8_t REG_IMM_MASK           = 0x01;
     static const uint8_t REG_DST_MASK           = 0xf0;
     static const uint8_t REG_SRC_MASK           = 0x0f;
+    static const uint8_t SCALE_MASK             = 0x03;
 
     static uint8_t instr(uint8_t byte) { return (byte & OPCODE_MASK) >> 1; }
     static uint8_t reg_imm(uint8_t byte) { return byte & REG_IMM_MASK; }
     static uint8_t reg_dst(uint8_t byte) { return (byte & REG_DST_MASK) >> 4; }
     static uint8_t reg_src(uint8_t byte) { return byte & REG_SRC_MASK; }
+    // Indexed addressing: index register, as reg_dst(), and the log2 of the scale.
+    static uint8_t scale(uint8_t byte) { return byte & SCALE_MASK; }
     static uint32_t imm_val(const uint8_t& data) { return uint8_to_uint32(const_cast<uint8_t&>(data)); }
 
     static int32_t& uint32_to_int32(uint32_t& val) { return reinterpret_cast<int32_t&>(val); }
+
+    // Signed division rounds toward zero; INT32_MIN / -1 wraps around to INT32_MIN, leaving 0.
+    static uint32_t sdiv(uint32_t dst, uint32_t src) {
+        return src == UINT32_MAX ? 0 - dst : static_cast<uint32_t>(static_cast<int32_t>(dst) / static_cast<int32_t>(src));
+    }
+    static uint32_t smod(uint32_t dst, uint32_t src) {
+        return src == UINT32_MAX ? 0 : static_cast<uint32_t>(static_cast<int32_t>(dst) % static_cast<int32_t>(src));
+    }
+    // Shift counts are taken modulo 32.
+    static uint32_t sar(uint32_t dst, uint32_t src) {
+        return static_cast<uint32_t>(static_cast<int32_t>(dst) >> (src & 31));
+    }
     static uint32_t& uint8_to_uint32(uint8_t& val) { return reinterpret_cast<uint32_t&>(val); }
+    static uint16_t& uint8_to_uint16(uint8_t& val) { return reinterpret_cast<uint16_t&>(val); }
+    // Byte and halfword loads, zero or sign extended.
+    static uint32_t zext8(uint8_t val) { return val; }
+    static uint32_t sext8(uint8_t val) { return static_cast<uint32_t>(static_cast<int8_t>(val)); }
+    static uint32_t zext16(uint16_t val) { return val; }
+    static uint32_t sext16(uint16_t val) { return static_cast<uint32_t>(static_cast<int16_t>(val)); }
+
+    void init_memory();
+    void map_memory();
+    void reset_memory();
+    void guard_text();
+    void protect_memory(size_t addr, size_t size);
+    void unprotect_memory(size_t addr, size_t size);
+    void map_files();
+    bool is_file_mapped(size_t addr) const;
+    void init_registers();
+    void copy_program();
+    // End of the text and data, whichever is further.
+    size_t image_end() const { return std::max(prog_size, data.empty() ? 0 : data_addr + data.size()); }
+
+    struct image_header_t;
+
+    void start_limits();
+    bool refuel();
+    bool out_of_fuel() { return fuel <= 0 && !refuel(); }
+
+    // Stops the VM at the division by zero at PC.
+    void divide_by_zero();
+
+    bool sys_enter();
+    uint32_t sys_write(uint32_t addr, uint32_t size);
+    uint32_t sys_read(uint32_t addr, uint32_t size);
+    void check_buffer(uint32_t addr, uint32_t size) const;
+    // The heap allocator keeps all of its state in the heap itself; see heap.cc.
+    struct heap_header_t;
+    void heap_bounds(uint32_t& start, uint32_t& end) const;
+    heap_header_t* heap_header(uint32_t start);
+    uint32_t check_block(uint32_t addr, uint32_t start);
+    uint32_t sys_malloc(uint32_t size);
+    void sys_free(uint32_t addr);
+    uint32_t sys_realloc(uint32_t addr, uint32_t size);
+    uint32_t sys_memcpy(uint32_t dst, uint32_t src, uint32_t size);
+    uint32_t sys_memset(uint32_t addr, uint32_t val, uint32_t size);
+    uint32_t sys_memcmp(uint32_t addr1, uint32_t addr2, uint32_t size);
+    bool step();
+    bool instrumented() const { return profiling || trace_header != nullptr || coverage != nullptr; }
+    bool step_instrumented();
+    virtual void code_modified(uint32_t addr, uint32_t size) {}
+
+    void reset_profile();
+    void profile_retire(uint32_t pc) {
+        if (pc < profile_pcs.size())
+            profile_pcs[pc]++;
+        else
+            profile_far_pcs[pc]++;
+        call_nodes[call_node].instrs++;
+    }
+    void profile_call(uint32_t func);
+    void profile_ret();
+
+    void cover(uint32_t target) {
+        uint32_t loc = (target * 0x9e3779b1) >> coverage_shift;
+        coverage[loc ^ coverage_prev]++;
+        coverage_prev = loc >> 1;
+    }
+
+    void reset_trace();
+    void close_trace();
+    void trace_instr(uint32_t pc);
+    void trace_done() {
+        if (trace_pending != nullptr && trace_pending->reg != NO_REG)
+            trace_pending->val = reg[trace_pending->reg];
+        trace_pending = nullptr;
+    }
+
+    void save_snapshot(const char* path);
+    void restore_snapshot(const char* path);
 
     void dump_registers() const;
+    void trace(uint8_t ri, uint8_t dst, uint8_t src, uint32_t iv) const;
 };
 
 
 class Interpreter final : public ExecutionEngine {
 public:
-    Interpreter(const void* prog, size_t prog_size, size_t ram_size_mb, bool debug);
+    Interpreter(size_t ram_size_mb, bool sparse_mem, bool debug);
 
 private:
     void init_execution();
     void load_program();
     void exec_program();
+    void exec_instrumented() { exec_program(); }
     void fini_execution();
 
-    void sys_enter();
+    // Instantiated once per mode, picked at the start of a run, so that a run without profiling,
+    // tracing or coverage does not pay for them; coverage goes with tracing.
+    template <bool PROFILE, bool TRACED> void dispatch();
+};
 
-    void trace(uint8_t ri, uint8_t dst, uint8_t src, uint32_t iv) const;
+
+class PreDecoder final : public ExecutionEngine {
+public:
+    PreDecoder(size_t ram_size_mb, bool sparse_mem, bool debug);
+
+private:
+    typedef struct {
+        const void* handler;
+        uint32_t iv;
+        uint32_t next;
+        uint32_t target;                        // fused compare and jump: branch target; indexed: index register
+        uint16_t mask;                          // fused compare and jump: flags taking the branch; indexed: scale
+        uint8_t dst;
+        uint8_t src;                            // fused register pairs: second register
+    } decoded_instr_t;
+
+    typedef struct {
+        const void* const (*instr)[2];
+        const void* sys_enter;
+        const void* undecoded;
+        const void* cmp_jcc[2][2];              // [reg_imm_t][FLAGS observable]
+        const void* load_sp;                    // mov rX, sp; add rX, imm; load rY, [rX]
+        const void* push_call;                  // push rX; call imm
+        const void* push_push;                  // push rX; push rY
+        const void* pop_pop;                    // pop rX; pop rY
+        const void* step;                       // anything with PC as its destination
+    } handlers_t;
+
+    static const uint32_t MAX_FUSED_SIZE        = 11;
+
+    // Not architectural; lets fused branches test for a non-zero operand like the other conditions.
+    static const uint32_t FLAG_NZ               = 0x00002000;
+
+    uint32_t text_size;
+    std::unique_ptr<decoded_instr_t[]> code;
+    std::vector<bool> flags_deps;
+    // Where code_modified() sends the instructions written over; set when the program starts running.
+    const void* decode_handler;
+
+    void init_execution();
+    void load_program();
+    void exec_program();
+    void fini_execution();
+
+    void decode(uint32_t addr, const handlers_t& handlers);
+    void fuse(uint32_t addr, const handlers_t& handlers);
+    void invalidate(uint32_t addr, uint32_t size, const void* handler);
+    // Writes to the text from outside the dispatch loop, by system calls.
+    void code_modified(uint32_t addr, uint32_t size);
+    bool is_cmp(uint32_t addr) const;
+
+    static uint32_t compare(uint32_t dst, uint32_t src) {
+        return (dst == 0 ? FLAG_Z : FLAG_NZ) | (dst < src ? FLAG_LT : dst > src ? FLAG_GT : FLAG_EQ);
+    }
+};
+
+
+class AOTExecutor final : public ExecutionEngine {
+public:
+    AOTExecutor(size_t ram_size_mb, bool sparse_mem, bool debug, const char* native_lib);
+    ~AOTExecutor();
+
+private:
+    typedef int (*native_exec_t)(uint8_t* mem, uint32_t* reg, uint32_t* arg, int64_t* fuel);
+
+    static const int EXIT_DISPATCH              = 0;
+    static const int EXIT_STORE_TEXT            = 1;
+    static const int EXIT_OUT_OF_FUEL           = 2;
+    static const int EXIT_DIVIDE_BY_ZERO        = 3;
+
+    std::string native_lib;
+    void* handle;
+    native_exec_t native_exec;
+    const uint8_t* image;
+    const size_t* image_size;
+    bool text_modified;
+
+    void init_execution();
+    void load_program();
+    void exec_program();
+    void fini_execution();
+
+    void code_modified(uint32_t addr, uint32_t size);
+};
+
+
+class JITCompiler final : public ExecutionEngine {
+public:
+    JITCompiler(size_t ram_size_mb, bool sparse_mem, bool debug);
+    ~JITCompiler();
+
+private:
+    typedef struct {
+        uintptr_t code;
+        uintptr_t addr;
+    } exit_t;
+    typedef exit_t (*entry_t)(uint32_t* reg, uint8_t* mem, const void* block);
+
+    typedef struct {
+        uint32_t addr;
+        uint32_t iv;
+        uint8_t op;
+        uint8_t ri;
+        uint8_t dst;
+        uint8_t src;
+        uint8_t idx;                            // indexed: index register
+        uint8_t scale;                          // indexed: log2 of the scale
+        uint8_t len;
+        uint16_t used;
+        uint16_t written;
+    } guest_instr_t;
+
+    static const size_t CODE_BUFFER_SIZE        = 16 << 20;
+    static const size_t CODE_BUFFER_SLACK       = 64 << 10;
+    static const size_t MAX_BLOCK_INSTRS        = 64;
+    static const uintptr_t EXIT_DISPATCH        = 0;
+    static const uintptr_t EXIT_STORE_TEXT      = 1;
+    static const uintptr_t EXIT_OUT_OF_FUEL     = 2;
+    static const uintptr_t EXIT_DIVIDE_BY_ZERO  = 3;
+
+    uint32_t text_size;
+    uint8_t* code_buf;
+    uint8_t* code_start;
+    uint8_t* code_top;
+    const uint8_t* epilogue;
+    entry_t enter;
+    uint64_t generation;
+    std::vector<const uint8_t*> blocks;
+    std::vector<bool> compiled;
+
+    void init_execution();
+    void load_program();
+    void exec_program();
+    void fini_execution();
+
+    void code_modified(uint32_t addr, uint32_t size);
+
+    void flush();
+    const uint8_t* lookup(uint32_t addr);
+    const uint8_t* compile(uint32_t addr);
+    bool decode(uint32_t addr, guest_instr_t& i) const;
+    void chain(uint8_t* site, uint32_t addr);
 };
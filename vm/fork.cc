@@ -0,0 +1,90 @@
+#include <cstdlib>
+#include <cstring>
+
+#include <fcntl.h>
+#include <signal.h>
+#include <sys/shm.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+#include "exe.h"
+
+
+// AFL's fork server protocol, on two file descriptors inherited from the fuzzer: a 4 byte hello on the
+// status one; then, for each run, a 4 byte request on the control one, answered with the pid of the
+// run and, once it is over, with its wait status. The coverage bitmap is the fuzzer's shared memory.
+
+static const int FORKSRV_FD                 = 198;
+static const char* const SHM_ENV_VAR        = "__AFL_SHM_ID";
+static const char* const MAP_SIZE_ENV_VAR   = "AFL_MAP_SIZE";
+static const size_t MAP_SIZE                = 1 << 16;
+
+
+void ExecutionEngine::set_coverage(uint8_t* bitmap, size_t size)
+{
+    coverage = nullptr;
+    if (bitmap == nullptr)
+        return;
+    if (size < 2 || size > (size_t(1) << 31) || (size & (size - 1)) != 0) {
+        cout << "Invalid coverage bitmap size " << size << "; a power of 2 expected." << endl;
+        std::abort();
+    }
+    coverage = bitmap;
+    coverage_shift = 32;
+    while ((size_t(1) << (32 - coverage_shift)) < size)
+        coverage_shift--;
+    coverage_prev = 0;
+}
+
+
+bool ExecutionEngine::serve_forks(const char* input_path)
+{
+    uint32_t msg = 0;
+    if (write(FORKSRV_FD + 1, &msg, sizeof msg) != sizeof msg)
+        return false;
+
+    const char* shm_id = getenv(SHM_ENV_VAR);
+    if (shm_id != nullptr) {
+        void* bitmap = shmat(atoi(shm_id), nullptr, 0);
+        if (bitmap == reinterpret_cast<void*>(-1)) {
+            cout << "Cannot attach the coverage bitmap." << endl;
+            std::abort();
+        }
+        const char* map_size = getenv(MAP_SIZE_ENV_VAR);
+        set_coverage(static_cast<uint8_t*>(bitmap), map_size != nullptr ? strtoul(map_size, nullptr, 0) : MAP_SIZE);
+    }
+    DBG("Serving forks" << (coverage != nullptr ? ", with coverage" : "") << " ..." << endl);
+
+    while (read(FORKSRV_FD, &msg, sizeof msg) == sizeof msg) {
+        pid_t pid = fork();
+        if (pid < 0) {
+            cout << "Cannot fork." << endl;
+            std::abort();
+        }
+        if (pid == 0) {
+            close(FORKSRV_FD);
+            close(FORKSRV_FD + 1);
+            // The fuzzer writes each input anew, to a new file even.
+            if (input_path != nullptr) {
+                int fd = open(input_path, O_RDONLY);
+                if (fd < 0) {
+                    cout << "Cannot open '" << input_path << "'." << endl;
+                    std::abort();
+                }
+                set_input_fd(fd);
+            }
+            status_t status = run();
+            // A division by zero is a crash, as it would be natively.
+            if (status == DIVIDE_BY_ZERO)
+                kill(getpid(), SIGFPE);
+            _exit(status == EXITED ? 0 : status);
+        }
+        int status;
+        if (write(FORKSRV_FD + 1, &pid, sizeof pid) != sizeof pid || waitpid(pid, &status, 0) < 0
+                || write(FORKSRV_FD + 1, &status, sizeof status) != sizeof status) {
+            cout << "Cannot report to the fuzzer." << endl;
+            std::abort();
+        }
+    }
+    return true;
+}
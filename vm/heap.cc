@@ -0,0 +1,135 @@
+#include <algorithm>
+#include <cstdlib>
+#include <cstring>
+
+#include "exe.h"
+
+
+// Heap layout:
+//     header
+//     blocks, from the end of the header up to header.top
+// Each block is a 8 byte block header, its capacity and its state, followed by the block itself,
+// 8 byte aligned. Capacities are powers of 2, from 8 up; a freed block goes onto the free list of its
+// capacity, linked through its first word, and is handed out again before the top moves. Everything
+// lives in guest memory, so that the heap is saved and restored with snapshots, and memory reading
+// back as zeros, as it does after a reset, is an empty heap.
+
+static const uint32_t HEAP_BLOCK_USED       = 1;
+static const uint32_t HEAP_BLOCK_FREE       = 2;
+static const uint32_t HEAP_BLOCK_HEADER     = 8;
+static const uint32_t HEAP_MAX_CAPACITY     = 0x80000000;
+
+struct ExecutionEngine::heap_header_t {
+    uint32_t top;                               // 0 for an empty heap
+    uint32_t free[32];                          // [log2(capacity)]
+    uint32_t unused;
+};
+
+static uint32_t heap_bin(uint32_t size)
+{
+    // The smallest capacity, 8 bytes, is bin 3.
+    uint32_t bin = 3;
+    while ((uint32_t(1) << bin) < size)
+        bin++;
+    return bin;
+}
+
+
+void ExecutionEngine::heap_bounds(uint32_t& start, uint32_t& end) const
+{
+    // Memory short of the documented heap gets one right after the text and data, leaving a quarter of
+    // it to the stack.
+    end = ram_size >= HEAP_END ? HEAP_END : (ram_size / 4 * 3) & ~7;
+    start = end > HEAP_START ? HEAP_START : (image_end() + 7) & ~7;
+}
+
+
+ExecutionEngine::heap_header_t* ExecutionEngine::heap_header(uint32_t start)
+{
+    // Keeps the blocks 8 byte aligned.
+    static_assert(sizeof(heap_header_t) % 8 == 0);
+    heap_header_t* header = reinterpret_cast<heap_header_t*>(&mem[start]);
+    if (header->top == 0)
+        header->top = start + sizeof(heap_header_t);
+    return header;
+}
+
+
+uint32_t ExecutionEngine::check_block(uint32_t addr, uint32_t start)
+{
+    // Returns the capacity of the block at addr, which must be in use.
+    heap_header_t* header = heap_header(start);
+    if (addr % 8 != 0 || addr < start + sizeof(heap_header_t) + HEAP_BLOCK_HEADER || addr >= header->top
+            || imm_val(mem[addr - 4]) != HEAP_BLOCK_USED) {
+        out.flush();
+        cout << "Invalid heap block at " << HEX(8, addr) << "." << endl;
+        std::abort();
+    }
+    return imm_val(mem[addr - 8]);
+}
+
+
+uint32_t ExecutionEngine::sys_malloc(uint32_t size)
+{
+    uint32_t start, end;
+    heap_bounds(start, end);
+    // Blocks stay clear of the files mapped into the heap.
+    for (const auto& file : mapped_files)
+        if (file.addr >= start)
+            end = std::min(end, file.addr);
+    if (size > HEAP_MAX_CAPACITY || size_t(start) + sizeof(heap_header_t) > end)
+        return 0;
+
+    uint32_t bin = heap_bin(size);
+    uint32_t capacity = uint32_t(1) << bin;
+
+    heap_header_t* header = heap_header(start);
+    uint32_t addr = header->free[bin];
+    if (addr != 0) {
+        header->free[bin] = imm_val(mem[addr]);
+    } else {
+        if (size_t(header->top) + HEAP_BLOCK_HEADER + capacity > end)
+            return 0;
+        addr = header->top + HEAP_BLOCK_HEADER;
+        uint8_to_uint32(mem[addr - 8]) = capacity;
+        header->top = addr + capacity;
+    }
+    uint8_to_uint32(mem[addr - 4]) = HEAP_BLOCK_USED;
+    return addr;
+}
+
+
+void ExecutionEngine::sys_free(uint32_t addr)
+{
+    if (addr == 0)
+        return;
+    uint32_t start, end;
+    heap_bounds(start, end);
+    uint32_t capacity = check_block(addr, start);
+
+    uint32_t bin = heap_bin(capacity);
+    heap_header_t* header = heap_header(start);
+    uint8_to_uint32(mem[addr - 4]) = HEAP_BLOCK_FREE;
+    uint8_to_uint32(mem[addr]) = header->free[bin];
+    header->free[bin] = addr;
+}
+
+
+uint32_t ExecutionEngine::sys_realloc(uint32_t addr, uint32_t size)
+{
+    if (addr == 0)
+        return sys_malloc(size);
+    uint32_t start, end;
+    heap_bounds(start, end);
+    uint32_t capacity = check_block(addr, start);
+    if (size <= capacity)
+        return addr;
+
+    // On failure the block is left as it is.
+    uint32_t moved = sys_malloc(size);
+    if (moved == 0)
+        return 0;
+    std::memcpy(&mem[moved], &mem[addr], capacity);
+    sys_free(addr);
+    return moved;
+}
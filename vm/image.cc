@@ -0,0 +1,84 @@
+#include <algorithm>
+#include <cstdlib>
+#include <cstring>
+
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#include "exe.h"
+
+
+// Image file layout:
+//     header
+//     text, loaded at 0
+//     data, loaded at header.data_addr
+//     symbols[header.symbol_count], { address, offset of the name }
+//     names, NUL terminated
+// Offsets are from the start of the file; the symbols are for the tools only, the VM skips them.
+
+static const char IMAGE_MAGIC[8]            = { 'U', 'C', 'O', 'M', 'P', 'I', 'M', 'G' };
+static const uint32_t IMAGE_VERSION         = 1;
+
+struct ExecutionEngine::image_header_t {
+    char magic[8];
+    uint32_t version;
+    uint32_t entry;
+    uint32_t text_offset;
+    uint32_t text_size;
+    uint32_t data_addr;
+    uint32_t data_offset;
+    uint32_t data_size;
+    uint32_t symbol_offset;
+    uint32_t symbol_count;
+    uint32_t name_offset;
+    uint32_t name_size;
+    uint32_t reserved[3];
+};
+
+
+void ExecutionEngine::load_image(const char* path)
+{
+    static_assert(sizeof(image_header_t) == 64);
+
+    DBG("Loading image '" << path << "' ..." << endl);
+    int fd = open(path, O_RDONLY);
+    struct stat st;
+    if (fd < 0 || fstat(fd, &st) != 0) {
+        cout << "Cannot open image '" << path << "'." << endl;
+        std::abort();
+    }
+    size_t size = st.st_size;
+    void* map = size != 0 ? mmap(nullptr, size, PROT_READ, MAP_PRIVATE, fd, 0) : MAP_FAILED;
+    close(fd);
+    if (map == MAP_FAILED) {
+        cout << "Cannot map image '" << path << "'." << endl;
+        std::abort();
+    }
+
+    const uint8_t* image = static_cast<const uint8_t*>(map);
+    const image_header_t* header = static_cast<const image_header_t*>(map);
+    auto in_file = [&](uint32_t offset, uint32_t length) { return size_t(offset) + length <= size; };
+    if (size < sizeof(image_header_t) || std::memcmp(header->magic, IMAGE_MAGIC, sizeof IMAGE_MAGIC) != 0
+            || header->version != IMAGE_VERSION
+            || !in_file(header->text_offset, header->text_size) || !in_file(header->data_offset, header->data_size)
+            || header->entry >= header->text_size) {
+        cout << "'" << path << "' is not a VM image." << endl;
+        std::abort();
+    }
+
+    // The data goes between the text and the heap, clear of the guard right after the text.
+    size_t page_size = sysconf(_SC_PAGESIZE);
+    size_t data_start = sparse_mem ? ((header->text_size + page_size - 1) & ~(page_size - 1)) + GUARD_SIZE
+                                   : header->text_size;
+    size_t data_end = size_t(header->data_addr) + header->data_size;
+    if (header->data_size != 0 && (header->data_addr < data_start || data_end > std::min<size_t>(ram_size, HEAP_START))) {
+        cout << "Data at " << HEX(8, header->data_addr) << " does not fit between the text and the heap." << endl;
+        std::abort();
+    }
+
+    load(&image[header->text_offset], header->text_size, header->entry,
+         &image[header->data_offset], header->data_size, header->data_addr);
+    munmap(map, size);
+}
@@ -1,19 +1,43 @@
 #include <cstdlib>
-#include <cstring>
 
 #include "exe.h"
 
 
+#define NEXT() { \
+    if (PROFILE) \
+        profile_retire(reg[PC]); \
+    if (TRACED && trace_header != nullptr) \
+        trace_instr(reg[PC]); \
+    goto *instr_exec_handle[instr(mem[reg[PC]])]; \
+}
 #define DISPATCH(OFFSET) { \
     reg[PC] += OFFSET; \
-    goto *instr_exec_handle[instr(mem[reg[PC]])]; \
+    fuel--; \
+    NEXT(); \
 }
 
-#define TRACE() if (debug) { trace(ri, dst, src, iv); }
+// The fuel is only looked at on backward jumps, calls and returns; any loop goes through one of them.
+#define DISPATCH_CHECKED() { \
+    fuel--; \
+    if (out_of_fuel()) \
+        return; \
+    NEXT(); \
+}
+#define JUMP(TARGET) { \
+    bool backward = (TARGET) <= reg[PC]; \
+    reg[PC] = TARGET; \
+    COVER(); \
+    if (backward) \
+        DISPATCH_CHECKED(); \
+    DISPATCH(+0); \
+}
 
+#define TRACE() if (TRACED && debug) { trace(ri, dst, src, iv); }
+#define COVER() if (TRACED && coverage != nullptr) { cover(reg[PC]); }
 
-Interpreter::Interpreter(const void* prog, size_t prog_size, size_t ram_size_mb, bool debug)
-: ExecutionEngine(prog, prog_size, ram_size_mb, debug)
+
+Interpreter::Interpreter(size_t ram_size_mb, bool sparse_mem, bool debug)
+: ExecutionEngine(ram_size_mb, sparse_mem, debug)
 {
     DBG("\ttype 'interpreter'" << endl);
 }
@@ -21,28 +45,35 @@ Interpreter::Interpreter(const void* prog, size_t prog_size, size_t ram_size_mb,
 
 void Interpreter::init_execution()
 {
-    DBG("Initializing memory ..." << endl);
-    mem = std::unique_ptr<uint8_t[]>(new uint8_t[ram_size]);
-    DBG("\tMemory @" << (void*) mem.get() << "[" << HEX(0, ram_size) << "]" << endl);
-
-    DBG("Initializing registers ..." << endl);
-    std::memset(&reg, 0, sizeof reg);
-    reg[SP] = ram_size;
-    reg[PC] = 5;
 }
 
 
 void Interpreter::load_program()
 {
-    DBG("Loading program ..." << endl);
-    std::memmove(mem.get(), prog, prog_size);
+    copy_program();
 }
 
 
 void Interpreter::exec_program()
 {
     DBG("Running program ..." << endl);
+    bool traced = debug || trace_header != nullptr || coverage != nullptr;
+    if (profiling)
+        traced ? dispatch<true, true>() : dispatch<true, false>();
+    else
+        traced ? dispatch<false, true>() : dispatch<false, false>();
+}
+
+
+void Interpreter::fini_execution()
+{
+    dump_registers();
+}
+
 
+template <bool PROFILE, bool TRACED>
+void Interpreter::dispatch()
+{
     static void* instr_exec_handle[] = {
         nullptr,
         &&_load,
@@ -68,27 +99,185 @@ void Interpreter::exec_program()
         &&_jmplt,
         &&_jmpge,
         &&_jmple,
+        &&_mul,
+        &&_div,
+        &&_sdiv,
+        &&_mod,
+        &&_smod,
+        &&_shl,
+        &&_shr,
+        &&_sar,
+        &&_loadx,
+        &&_storex,
+        &&_loadb,
+        &&_loadsb,
+        &&_loadh,
+        &&_loadsh,
+        &&_storeb,
+        &&_storeh,
     };
 
     uint8_t ri, dst, src;
     uint32_t iv;
 
-    DISPATCH(+0);
+    // The first instruction is charged here, as any other is when dispatched to.
+    fuel--;
+    NEXT();
 
     _load: {
+        ri = reg_imm(mem[reg[PC]]);
         dst = reg_dst(mem[reg[PC] + 1]);
         src = reg_src(mem[reg[PC] + 1]);
-        TRACE();
-        reg[dst] = uint8_to_uint32(mem[reg[src]]);
-        DISPATCH(+2);
+        switch (ri) {
+        case REG:
+            TRACE();
+            reg[dst] = uint8_to_uint32(mem[reg[src]]);
+            DISPATCH(+2);
+        case IMM:
+            iv = imm_val(mem[reg[PC] + 2]);
+            TRACE();
+            reg[dst] = uint8_to_uint32(mem[reg[src] + iv]);
+            DISPATCH(+6);
+        }
     }
 
     _store: {
+        ri = reg_imm(mem[reg[PC]]);
+        dst = reg_dst(mem[reg[PC] + 1]);
+        src = reg_src(mem[reg[PC] + 1]);
+        switch (ri) {
+        case REG:
+            TRACE();
+            uint8_to_uint32(mem[reg[dst]]) = reg[src];
+            DISPATCH(+2);
+        case IMM:
+            iv = imm_val(mem[reg[PC] + 2]);
+            TRACE();
+            uint8_to_uint32(mem[reg[dst] + iv]) = reg[src];
+            DISPATCH(+6);
+        }
+    }
+
+    _loadb: {
+        ri = reg_imm(mem[reg[PC]]);
+        dst = reg_dst(mem[reg[PC] + 1]);
+        src = reg_src(mem[reg[PC] + 1]);
+        switch (ri) {
+        case REG:
+            TRACE();
+            reg[dst] = zext8(mem[reg[src]]);
+            DISPATCH(+2);
+        case IMM:
+            iv = imm_val(mem[reg[PC] + 2]);
+            TRACE();
+            reg[dst] = zext8(mem[reg[src] + iv]);
+            DISPATCH(+6);
+        }
+    }
+
+    _loadsb: {
+        ri = reg_imm(mem[reg[PC]]);
+        dst = reg_dst(mem[reg[PC] + 1]);
+        src = reg_src(mem[reg[PC] + 1]);
+        switch (ri) {
+        case REG:
+            TRACE();
+            reg[dst] = sext8(mem[reg[src]]);
+            DISPATCH(+2);
+        case IMM:
+            iv = imm_val(mem[reg[PC] + 2]);
+            TRACE();
+            reg[dst] = sext8(mem[reg[src] + iv]);
+            DISPATCH(+6);
+        }
+    }
+
+    _loadh: {
+        ri = reg_imm(mem[reg[PC]]);
+        dst = reg_dst(mem[reg[PC] + 1]);
+        src = reg_src(mem[reg[PC] + 1]);
+        switch (ri) {
+        case REG:
+            TRACE();
+            reg[dst] = zext16(uint8_to_uint16(mem[reg[src]]));
+            DISPATCH(+2);
+        case IMM:
+            iv = imm_val(mem[reg[PC] + 2]);
+            TRACE();
+            reg[dst] = zext16(uint8_to_uint16(mem[reg[src] + iv]));
+            DISPATCH(+6);
+        }
+    }
+
+    _loadsh: {
+        ri = reg_imm(mem[reg[PC]]);
+        dst = reg_dst(mem[reg[PC] + 1]);
+        src = reg_src(mem[reg[PC] + 1]);
+        switch (ri) {
+        case REG:
+            TRACE();
+            reg[dst] = sext16(uint8_to_uint16(mem[reg[src]]));
+            DISPATCH(+2);
+        case IMM:
+            iv = imm_val(mem[reg[PC] + 2]);
+            TRACE();
+            reg[dst] = sext16(uint8_to_uint16(mem[reg[src] + iv]));
+            DISPATCH(+6);
+        }
+    }
+
+    _storeb: {
+        ri = reg_imm(mem[reg[PC]]);
+        dst = reg_dst(mem[reg[PC] + 1]);
+        src = reg_src(mem[reg[PC] + 1]);
+        switch (ri) {
+        case REG:
+            TRACE();
+            mem[reg[dst]] = static_cast<uint8_t>(reg[src]);
+            DISPATCH(+2);
+        case IMM:
+            iv = imm_val(mem[reg[PC] + 2]);
+            TRACE();
+            mem[reg[dst] + iv] = static_cast<uint8_t>(reg[src]);
+            DISPATCH(+6);
+        }
+    }
+
+    _storeh: {
+        ri = reg_imm(mem[reg[PC]]);
+        dst = reg_dst(mem[reg[PC] + 1]);
+        src = reg_src(mem[reg[PC] + 1]);
+        switch (ri) {
+        case REG:
+            TRACE();
+            uint8_to_uint16(mem[reg[dst]]) = static_cast<uint16_t>(reg[src]);
+            DISPATCH(+2);
+        case IMM:
+            iv = imm_val(mem[reg[PC] + 2]);
+            TRACE();
+            uint8_to_uint16(mem[reg[dst] + iv]) = static_cast<uint16_t>(reg[src]);
+            DISPATCH(+6);
+        }
+    }
+
+    _loadx: {
+        ri = REG;
         dst = reg_dst(mem[reg[PC] + 1]);
         src = reg_src(mem[reg[PC] + 1]);
         TRACE();
-        uint8_to_uint32(mem[reg[dst]]) = reg[src];
-        DISPATCH(+2);
+        uint8_t idx = mem[reg[PC] + 2];
+        reg[dst] = uint8_to_uint32(mem[reg[src] + (reg[reg_dst(idx)] << scale(idx))]);
+        DISPATCH(+3);
+    }
+
+    _storex: {
+        ri = REG;
+        dst = reg_dst(mem[reg[PC] + 1]);
+        src = reg_src(mem[reg[PC] + 1]);
+        TRACE();
+        uint8_t idx = mem[reg[PC] + 2];
+        uint8_to_uint32(mem[reg[dst] + (reg[reg_dst(idx)] << scale(idx))]) = reg[src];
+        DISPATCH(+3);
     }
 
     _mov: {
@@ -193,6 +382,174 @@ void Interpreter::exec_program()
         }
     }
 
+    _mul: {
+        ri = reg_imm(mem[reg[PC]]);
+        dst = reg_dst(mem[reg[PC] + 1]);
+        switch (ri) {
+        case REG:
+            src = reg_src(mem[reg[PC] + 1]);
+            TRACE();
+            reg[dst] *= reg[src];
+            DISPATCH(+2);
+        case IMM:
+            iv = imm_val(mem[reg[PC] + 2]);
+            TRACE();
+            reg[dst] *= iv;
+            DISPATCH(+6);
+        }
+    }
+
+    _div: {
+        ri = reg_imm(mem[reg[PC]]);
+        dst = reg_dst(mem[reg[PC] + 1]);
+        switch (ri) {
+        case REG:
+            src = reg_src(mem[reg[PC] + 1]);
+            TRACE();
+            if (reg[src] == 0) {
+                divide_by_zero();
+                return;
+            }
+            reg[dst] /= reg[src];
+            DISPATCH(+2);
+        case IMM:
+            iv = imm_val(mem[reg[PC] + 2]);
+            TRACE();
+            if (iv == 0) {
+                divide_by_zero();
+                return;
+            }
+            reg[dst] /= iv;
+            DISPATCH(+6);
+        }
+    }
+
+    _sdiv: {
+        ri = reg_imm(mem[reg[PC]]);
+        dst = reg_dst(mem[reg[PC] + 1]);
+        switch (ri) {
+        case REG:
+            src = reg_src(mem[reg[PC] + 1]);
+            TRACE();
+            if (reg[src] == 0) {
+                divide_by_zero();
+                return;
+            }
+            reg[dst] = sdiv(reg[dst], reg[src]);
+            DISPATCH(+2);
+        case IMM:
+            iv = imm_val(mem[reg[PC] + 2]);
+            TRACE();
+            if (iv == 0) {
+                divide_by_zero();
+                return;
+            }
+            reg[dst] = sdiv(reg[dst], iv);
+            DISPATCH(+6);
+        }
+    }
+
+    _mod: {
+        ri = reg_imm(mem[reg[PC]]);
+        dst = reg_dst(mem[reg[PC] + 1]);
+        switch (ri) {
+        case REG:
+            src = reg_src(mem[reg[PC] + 1]);
+            TRACE();
+            if (reg[src] == 0) {
+                divide_by_zero();
+                return;
+            }
+            reg[dst] %= reg[src];
+            DISPATCH(+2);
+        case IMM:
+            iv = imm_val(mem[reg[PC] + 2]);
+            TRACE();
+            if (iv == 0) {
+                divide_by_zero();
+                return;
+            }
+            reg[dst] %= iv;
+            DISPATCH(+6);
+        }
+    }
+
+    _smod: {
+        ri = reg_imm(mem[reg[PC]]);
+        dst = reg_dst(mem[reg[PC] + 1]);
+        switch (ri) {
+        case REG:
+            src = reg_src(mem[reg[PC] + 1]);
+            TRACE();
+            if (reg[src] == 0) {
+                divide_by_zero();
+                return;
+            }
+            reg[dst] = smod(reg[dst], reg[src]);
+            DISPATCH(+2);
+        case IMM:
+            iv = imm_val(mem[reg[PC] + 2]);
+            TRACE();
+            if (iv == 0) {
+                divide_by_zero();
+                return;
+            }
+            reg[dst] = smod(reg[dst], iv);
+            DISPATCH(+6);
+        }
+    }
+
+    _shl: {
+        ri = reg_imm(mem[reg[PC]]);
+        dst = reg_dst(mem[reg[PC] + 1]);
+        switch (ri) {
+        case REG:
+            src = reg_src(mem[reg[PC] + 1]);
+            TRACE();
+            reg[dst] <<= reg[src] & 31;
+            DISPATCH(+2);
+        case IMM:
+            iv = imm_val(mem[reg[PC] + 2]);
+            TRACE();
+            reg[dst] <<= iv & 31;
+            DISPATCH(+6);
+        }
+    }
+
+    _shr: {
+        ri = reg_imm(mem[reg[PC]]);
+        dst = reg_dst(mem[reg[PC] + 1]);
+        switch (ri) {
+        case REG:
+            src = reg_src(mem[reg[PC] + 1]);
+            TRACE();
+            reg[dst] >>= reg[src] & 31;
+            DISPATCH(+2);
+        case IMM:
+            iv = imm_val(mem[reg[PC] + 2]);
+            TRACE();
+            reg[dst] >>= iv & 31;
+            DISPATCH(+6);
+        }
+    }
+
+    _sar: {
+        ri = reg_imm(mem[reg[PC]]);
+        dst = reg_dst(mem[reg[PC] + 1]);
+        switch (ri) {
+        case REG:
+            src = reg_src(mem[reg[PC] + 1]);
+            TRACE();
+            reg[dst] = sar(reg[dst], reg[src]);
+            DISPATCH(+2);
+        case IMM:
+            iv = imm_val(mem[reg[PC] + 2]);
+            TRACE();
+            reg[dst] = sar(reg[dst], iv);
+            DISPATCH(+6);
+        }
+    }
+
     _not: {
         dst = reg_dst(mem[reg[PC] + 1]);
         TRACE();
@@ -255,33 +612,32 @@ void Interpreter::exec_program()
         reg[SP] -= 4;
         uint8_to_uint32(mem[reg[SP]]) = reg[PC] + 5;
         reg[PC] = iv;
-        DISPATCH(+0);
+        COVER();
+        if (PROFILE)
+            profile_call(iv);
+        DISPATCH_CHECKED();
     }
 
     _ret: {
         TRACE();
         reg[PC] = uint8_to_uint32(mem[reg[SP]]);
         reg[SP] += 4;
-        DISPATCH(+0);
+        COVER();
+        if (PROFILE)
+            profile_ret();
+        DISPATCH_CHECKED();
     }
 
     _jmp: {
         iv = imm_val(mem[reg[PC] + 1]);
         TRACE();
         switch (reg[PC]) {
-        case SYS_ENTER_ADDR: {
-            uint32_t syscall_id = imm_val(mem[reg[SP] + 4]);
-            switch (syscall_id) {
-            case SYSCALL_VM_EXIT:
+        case SYS_ENTER_ADDR:
+            if (!sys_enter())
                 return;
-            default:
-                sys_enter();
-                goto _ret;
-            }
-        }
+            goto _ret;
         default:
-            reg[PC] = iv;
-            DISPATCH(+0);
+            JUMP(iv);
         }
     }
 
@@ -289,8 +645,7 @@ void Interpreter::exec_program()
         iv = imm_val(mem[reg[PC] + 1]);
         TRACE();
         if (reg[FLAGS] & FLAG_Z) {
-            reg[PC] = iv;
-            DISPATCH(+0);
+            JUMP(iv);
         } else {
             DISPATCH(+5);
         }
@@ -302,8 +657,7 @@ void Interpreter::exec_program()
         if (reg[FLAGS] & FLAG_Z) {
             DISPATCH(+5);
         } else {
-            reg[PC] = iv;
-            DISPATCH(+0);
+            JUMP(iv);
         }
     }
 
@@ -311,8 +665,7 @@ void Interpreter::exec_program()
         iv = imm_val(mem[reg[PC] + 1]);
         TRACE();
         if (reg[FLAGS] & FLAG_EQ) {
-            reg[PC] = iv;
-            DISPATCH(+0);
+            JUMP(iv);
         } else {
             DISPATCH(+5);
         }
@@ -324,8 +677,7 @@ void Interpreter::exec_program()
         if (reg[FLAGS] & FLAG_EQ) {
             DISPATCH(+5);
         } else {
-            reg[PC] = iv;
-            DISPATCH(+0);
+            JUMP(iv);
         }
     }
 
@@ -333,8 +685,7 @@ void Interpreter::exec_program()
         iv = imm_val(mem[reg[PC] + 1]);
         TRACE();
         if (reg[FLAGS] & FLAG_GT) {
-            reg[PC] = iv;
-            DISPATCH(+0);
+            JUMP(iv);
         } else {
             DISPATCH(+5);
         }
@@ -344,8 +695,7 @@ void Interpreter::exec_program()
         iv = imm_val(mem[reg[PC] + 1]);
         TRACE();
         if (reg[FLAGS] & FLAG_LT) {
-            reg[PC] = iv;
-            DISPATCH(+0);
+            JUMP(iv);
         } else {
             DISPATCH(+5);
         }
@@ -355,8 +705,7 @@ void Interpreter::exec_program()
         iv = imm_val(mem[reg[PC] + 1]);
         TRACE();
         if (reg[FLAGS] & (FLAG_GT | FLAG_EQ)) {
-            reg[PC] = iv;
-            DISPATCH(+0);
+            JUMP(iv);
         } else {
             DISPATCH(+5);
         }
@@ -366,8 +715,7 @@ void Interpreter::exec_program()
         iv = imm_val(mem[reg[PC] + 1]);
         TRACE();
         if (reg[FLAGS] & (FLAG_LT | FLAG_EQ)) {
-            reg[PC] = iv;
-            DISPATCH(+0);
+            JUMP(iv);
         } else {
             DISPATCH(+5);
         }
@@ -376,97 +724,3 @@ void Interpreter::exec_program()
     std::abort();
 }
 
-
-void Interpreter::fini_execution()
-{
-    dump_registers();
-}
-
-
-void Interpreter::sys_enter()
-{
-    uint32_t syscall_id = imm_val(mem[reg[SP] + 4]);
-    switch (syscall_id) {
-    case SYSCALL_VM_EXIT:
-        std::abort();
-    case SYSCALL_DISPLAY_INT: {
-        int32_t val = imm_val(mem[reg[SP] + 8]);
-        cout << val << endl;
-        break;
-    }
-    default:
-        std::abort();
-    }
-}
-
-
-void Interpreter::trace(uint8_t ri, uint8_t dst, uint8_t src, uint32_t iv) const
-{
-    if (!debug)
-        return;
-
-    static const char* const R[] = {
-        "r0", "r1", "r2", "r3", "r4", "r5", "r6", "r7", "r8", "r9", "r10", "r11", "r12", "flags", "sp", "pc"
-    };
-    auto HEX_DUMP = [this](uint8_t num_bytes) {
-        uint8_t* addr = &mem[reg[PC]];
-        for (uint8_t i = 0; i < num_bytes; i++)
-            DBG_(HEX_(2, ((int) *(addr + i))) << " ");
-        for (uint8_t i = 0; i < 6 - num_bytes; i++)
-            DBG_("   ");
-        DBG_("   ");
-    };
-
-    DBG("\t" << HEX(8, reg[PC]) << "   ");
-    switch (instr(mem[reg[PC]])) {
-    case LOAD:
-        HEX_DUMP(2);      DBG_("load " << R[dst] << ", [" << R[src] << "]");                  break;
-    case STORE:
-        HEX_DUMP(2);      DBG_("store [" << R[dst] << "], " << R[src]);                       break;
-    case MOV:
-        HEX_DUMP(ri?6:2); DBG_("mov " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
-    case ADD:
-        HEX_DUMP(ri?6:2); DBG_("add " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
-    case SUB:
-        HEX_DUMP(ri?6:2); DBG_("sub " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
-    case AND:
-        HEX_DUMP(ri?6:2); DBG_("and " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
-    case OR:
-        HEX_DUMP(ri?6:2); DBG_("or " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]);  break;
-    case XOR:
-        HEX_DUMP(ri?6:2); DBG_("xor " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
-    case NOT:
-        HEX_DUMP(2);      DBG_("not " << R[dst]);                                             break;
-    case CMP:
-        HEX_DUMP(ri?6:2); DBG_("cmp " << R[dst] << ", "); if (ri) DBG_(iv) else DBG_(R[src]); break;
-    case PUSH:
-        HEX_DUMP(2);      DBG_("push " << R[dst]);                                            break;
-    case POP:
-        HEX_DUMP(2);      DBG_("pop " << R[dst]);                                             break;
-    case CALL:
-        HEX_DUMP(5);      DBG_("call " << HEX(8, iv));                                        break;
-    case RET:
-        HEX_DUMP(1);      DBG_("ret");                                                        break;
-    case JMP:
-        HEX_DUMP(5);      DBG_("jmp " << HEX(8, iv));                                         break;
-    case JMPZ:
-        HEX_DUMP(5);      DBG_("jmpz " << HEX(8, iv));                                        break;
-    case JMPNZ:
-        HEX_DUMP(5);      DBG_("jmpnz " << HEX(8, iv));                                       break;
-    case JMPEQ:
-        HEX_DUMP(5);      DBG_("jmpeq " << HEX(8, iv));                                       break;
-    case JMPNE:
-        HEX_DUMP(5);      DBG_("jmpne " << HEX(8, iv));                                       break;
-    case JMPGT:
-        HEX_DUMP(5);      DBG_("jmpgt " << HEX(8, iv));                                       break;
-    case JMPLT:
-        HEX_DUMP(5);      DBG_("jmplt " << HEX(8, iv));                                       break;
-    case JMPGE:
-        HEX_DUMP(5);      DBG_("jmpge " << HEX(8, iv));                                       break;
-    case JMPLE:
-        HEX_DUMP(5);      DBG_("jmple " << HEX(8, iv));                                       break;
-    default:
-        std::abort();
-    }
-    DBG_(endl);
-}
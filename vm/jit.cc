@@ -0,0 +1,611 @@
+#include <bitset>
+#include <cstdlib>
+#include <tuple>
+
+#include <sys/mman.h>
+
+#include "exe.h"
+#include "x64.h"
+
+
+typedef X64Emitter::reg_t host_reg_t;
+
+
+// Host registers holding guest registers inside a block; RAX, RCX and RDX are scratch,
+// RBX points to the guest registers and R15 to the guest memory.
+static const host_reg_t HOST_REGS[] = {
+    X64Emitter::RSI, X64Emitter::RDI, X64Emitter::R8,  X64Emitter::R9,  X64Emitter::R10,
+    X64Emitter::R11, X64Emitter::R12, X64Emitter::R13, X64Emitter::R14, X64Emitter::RBP,
+};
+static const size_t NUM_HOST_REGS = sizeof HOST_REGS / sizeof HOST_REGS[0];
+static const host_reg_t REG_BASE = X64Emitter::RBX;
+static const host_reg_t MEM_BASE = X64Emitter::R15;
+
+#define BIT(REG) (1u << (REG))
+#define GUEST_REG(REG) static_cast<int8_t>(4 * (REG))
+
+
+JITCompiler::JITCompiler(size_t ram_size_mb, bool sparse_mem, bool debug)
+: ExecutionEngine(ram_size_mb, sparse_mem, debug)
+, text_size(0), code_buf(nullptr), code_start(nullptr), code_top(nullptr)
+, epilogue(nullptr), enter(nullptr), generation(0)
+{
+    DBG("\ttype 'jit'" << endl);
+}
+
+
+JITCompiler::~JITCompiler()
+{
+    if (code_buf != nullptr)
+        munmap(code_buf, CODE_BUFFER_SIZE);
+}
+
+
+void JITCompiler::init_execution()
+{
+    DBG("Initializing code buffer ..." << endl);
+    void* buf = mmap(nullptr, CODE_BUFFER_SIZE, PROT_READ | PROT_WRITE | PROT_EXEC,
+                     MAP_PRIVATE | MAP_ANONYMOUS, -1, 0);
+    if (buf == MAP_FAILED)
+        std::abort();
+    code_buf = static_cast<uint8_t*>(buf);
+    DBG("\tCode buffer @" << (void*) code_buf << "[" << HEX(0, CODE_BUFFER_SIZE) << "]" << endl);
+
+    // enter(reg, mem, block): save the callee-saved registers and jump to the block
+    X64Emitter e(code_buf, code_buf + CODE_BUFFER_SIZE);
+    enter = reinterpret_cast<entry_t>(e.pos());
+    e.push(X64Emitter::RBX);
+    e.push(X64Emitter::RBP);
+    e.push(X64Emitter::R12);
+    e.push(X64Emitter::R13);
+    e.push(X64Emitter::R14);
+    e.push(X64Emitter::R15);
+    e.mov_rr64(REG_BASE, X64Emitter::RDI);
+    e.mov_rr64(MEM_BASE, X64Emitter::RSI);
+    e.jmp_r(X64Emitter::RDX);
+
+    // all blocks leave through here, with the exit code in RAX and its argument in RDX
+    epilogue = e.pos();
+    e.pop(X64Emitter::R15);
+    e.pop(X64Emitter::R14);
+    e.pop(X64Emitter::R13);
+    e.pop(X64Emitter::R12);
+    e.pop(X64Emitter::RBP);
+    e.pop(X64Emitter::RBX);
+    e.ret();
+
+    code_start = e.pos();
+}
+
+
+void JITCompiler::load_program()
+{
+    copy_program();
+    text_size = prog_size;
+    flush();
+}
+
+
+void JITCompiler::exec_program()
+{
+    DBG("Running program ..." << endl);
+
+    for (;;) {
+        const uint8_t* block = lookup(reg[PC]);
+        if (block == nullptr) {
+            if (!step() || out_of_fuel())
+                return;
+            continue;
+        }
+
+        exit_t exit = enter(reg, mem.get(), block);
+        switch (exit.code) {
+        case EXIT_DISPATCH:
+            break;
+        case EXIT_STORE_TEXT:
+            code_modified(exit.addr, 4);
+            break;
+        case EXIT_OUT_OF_FUEL:
+            if (!refuel())
+                return;
+            break;
+        case EXIT_DIVIDE_BY_ZERO:
+            divide_by_zero();
+            return;
+        default:
+            chain(reinterpret_cast<uint8_t*>(exit.code), reg[PC]);
+            break;
+        }
+    }
+}
+
+
+void JITCompiler::fini_execution()
+{
+    dump_registers();
+}
+
+
+void JITCompiler::code_modified(uint32_t addr, uint32_t size)
+{
+    for (uint32_t a = addr; a < addr + size && a < text_size; a++) {
+        if (compiled[a]) {
+            DBG("Text modified at " << HEX(8, addr) << "; flushing compiled code ..." << endl);
+            flush();
+            return;
+        }
+    }
+}
+
+
+void JITCompiler::flush()
+{
+    blocks.assign(text_size, nullptr);
+    compiled.assign(text_size, false);
+    code_top = code_start;
+    generation++;
+}
+
+
+const uint8_t* JITCompiler::lookup(uint32_t addr)
+{
+    if (addr >= text_size || addr == SYS_ENTER_ADDR)
+        return nullptr;
+    if (blocks[addr] == nullptr)
+        blocks[addr] = compile(addr);
+    return blocks[addr];
+}
+
+
+void JITCompiler::chain(uint8_t* site, uint32_t addr)
+{
+    uint64_t gen = generation;
+    const uint8_t* target = lookup(addr);
+    // compiling the target may have flushed the block owning the exit
+    if (target != nullptr && gen == generation)
+        X64Emitter::patch(site + 1, target);
+}
+
+
+bool JITCompiler::decode(uint32_t addr, guest_instr_t& i) const
+{
+    if (addr >= text_size || addr == SYS_ENTER_ADDR)
+        return false;
+
+    i.addr = addr;
+    i.op = instr(mem[addr]);
+    i.ri = reg_imm(mem[addr]);
+    i.dst = i.src = i.idx = i.scale = 0;
+    i.iv = 0;
+    i.used = i.written = 0;
+
+    switch (i.op) {
+    case LOAD:
+    case LOADB:
+    case LOADSB:
+    case LOADH:
+    case LOADSH:
+        i.len = i.ri == IMM ? 6 : 2;
+        i.dst = reg_dst(mem[addr + 1]);
+        i.src = reg_src(mem[addr + 1]);
+        if (i.ri == IMM)
+            i.iv = imm_val(mem[addr + 2]);
+        i.used = BIT(i.dst) | BIT(i.src);
+        i.written = BIT(i.dst);
+        break;
+    case STORE:
+    case STOREB:
+    case STOREH:
+        i.len = i.ri == IMM ? 6 : 2;
+        i.dst = reg_dst(mem[addr + 1]);
+        i.src = reg_src(mem[addr + 1]);
+        if (i.ri == IMM)
+            i.iv = imm_val(mem[addr + 2]);
+        i.used = BIT(i.dst) | BIT(i.src);
+        break;
+    case LOADX:
+    case STOREX:
+        i.len = 3;
+        i.dst = reg_dst(mem[addr + 1]);
+        i.src = reg_src(mem[addr + 1]);
+        i.idx = reg_dst(mem[addr + 2]);
+        i.scale = scale(mem[addr + 2]);
+        i.used = BIT(i.dst) | BIT(i.src) | BIT(i.idx);
+        if (i.op == LOADX)
+            i.written = BIT(i.dst);
+        break;
+    case MOV:
+    case ADD:
+    case SUB:
+    case AND:
+    case OR:
+    case XOR:
+    case CMP:
+    case MUL:
+    case DIV:
+    case SDIV:
+    case MOD:
+    case SMOD:
+    case SHL:
+    case SHR:
+    case SAR:
+        i.dst = reg_dst(mem[addr + 1]);
+        if (i.ri == IMM) {
+            i.len = 6;
+            i.iv = imm_val(mem[addr + 2]);
+            i.used = BIT(i.dst);
+        } else {
+            i.len = 2;
+            i.src = reg_src(mem[addr + 1]);
+            i.used = BIT(i.dst) | BIT(i.src);
+        }
+        if (i.op == CMP) {
+            i.used |= BIT(FLAGS);
+            i.written = BIT(FLAGS);
+        } else {
+            i.written = BIT(i.dst);
+        }
+        break;
+    case NOT:
+        i.len = 2;
+        i.dst = reg_dst(mem[addr + 1]);
+        i.used = i.written = BIT(i.dst);
+        break;
+    case PUSH:
+        i.len = 2;
+        i.dst = reg_dst(mem[addr + 1]);
+        i.used = BIT(i.dst) | BIT(SP);
+        i.written = BIT(SP);
+        break;
+    case POP:
+        i.len = 2;
+        i.dst = reg_dst(mem[addr + 1]);
+        i.used = i.written = BIT(i.dst) | BIT(SP);
+        break;
+    case CALL:
+        i.len = 5;
+        i.iv = imm_val(mem[addr + 1]);
+        i.used = i.written = BIT(SP);
+        break;
+    case RET:
+        i.len = 1;
+        i.used = i.written = BIT(SP);
+        break;
+    case JMP:
+        i.len = 5;
+        i.iv = imm_val(mem[addr + 1]);
+        break;
+    case JMPZ:
+    case JMPNZ:
+    case JMPEQ:
+    case JMPNE:
+    case JMPGT:
+    case JMPLT:
+    case JMPGE:
+    case JMPLE:
+        i.len = 5;
+        i.iv = imm_val(mem[addr + 1]);
+        i.used = BIT(FLAGS);
+        break;
+    default:
+        return false;
+    }
+
+    // instructions reading or writing PC are left to step()
+    return addr + i.len <= text_size && !(i.used & BIT(PC));
+}
+
+
+const uint8_t* JITCompiler::compile(uint32_t addr)
+{
+    std::vector<guest_instr_t> instrs;
+    uint16_t used = 0;
+    uint16_t written = 0;
+    uint32_t next = addr;
+
+    while (instrs.size() < MAX_BLOCK_INSTRS) {
+        guest_instr_t i;
+        if (!decode(next, i))
+            break;
+        if (std::bitset<16>(used | i.used).count() > NUM_HOST_REGS)
+            break;
+        instrs.push_back(i);
+        used |= i.used;
+        written |= i.written;
+        next += i.len;
+        if (i.op == CALL || i.op == RET || (i.op >= JMP && i.op <= JMPLE))
+            break;
+    }
+    if (instrs.empty())
+        return nullptr;
+
+    host_reg_t host[16] = {};
+    for (uint8_t g = 0, h = 0; g < 16; g++)
+        if (used & BIT(g))
+            host[g] = HOST_REGS[h++];
+
+    // a block overflowing the buffer is discarded; its dropped bytes and patches land in the slack
+    X64Emitter e(code_top, code_buf + CODE_BUFFER_SIZE - CODE_BUFFER_SLACK);
+
+    auto exit_to = [&](uint32_t target) {
+        for (uint8_t g = 0; g < 16; g++)
+            if (written & BIT(g))
+                e.store_disp(REG_BASE, GUEST_REG(g), host[g]);
+        e.store_disp_imm(REG_BASE, GUEST_REG(PC), target);
+        if (target < text_size && target != SYS_ENTER_ADDR)
+            e.lea_rip(X64Emitter::RAX);     // the jmp below, patched once the target is compiled
+        else
+            e.mov_ri(X64Emitter::RAX, EXIT_DISPATCH);
+        X64Emitter::patch(e.jmp(), epilogue);
+    };
+
+    std::vector<std::tuple<uint8_t*, const guest_instr_t*, host_reg_t>> store_exits;
+    std::vector<std::pair<uint8_t*, const guest_instr_t*>> div_exits;
+
+    const uint8_t* entry = e.pos();
+
+    // Fuel is taken a block at a time, on entry; chained blocks never go back to the dispatcher otherwise.
+    int32_t fuel_disp = static_cast<int32_t>(reinterpret_cast<uint8_t*>(&fuel) - reinterpret_cast<uint8_t*>(reg));
+    e.alu_mi64(X64Emitter::CMP, REG_BASE, fuel_disp, 0);
+    uint8_t* fuel_exit = e.jcc(X64Emitter::CC_LE);
+    e.alu_mi64(X64Emitter::SUB, REG_BASE, fuel_disp, instrs.size());
+
+    for (uint8_t g = 0; g < 16; g++)
+        if (used & BIT(g))
+            e.load_disp(host[g], REG_BASE, GUEST_REG(g));
+
+    for (const guest_instr_t& i : instrs) {
+        host_reg_t dst = host[i.dst];
+        host_reg_t src = host[i.src];
+        X64Emitter::alu_t alu = X64Emitter::ADD;
+
+        // [base+disp] and [base+index*scale] are computed in RAX, wrapping around as the guest does
+        auto address = [&](host_reg_t base) {
+            if (i.op == LOADX || i.op == STOREX) {
+                e.mov_rr(X64Emitter::RAX, host[i.idx]);
+                if (i.scale != 0)
+                    e.shift_ri(X64Emitter::SHL, X64Emitter::RAX, i.scale);
+                e.alu_rr(X64Emitter::ADD, X64Emitter::RAX, base);
+                return X64Emitter::RAX;
+            }
+            if (i.ri == IMM) {
+                e.mov_rr(X64Emitter::RAX, base);
+                e.alu_ri(X64Emitter::ADD, X64Emitter::RAX, i.iv);
+                return X64Emitter::RAX;
+            }
+            return base;
+        };
+
+        switch (i.op) {
+        case LOAD:
+        case LOADX:
+            e.load_idx(dst, MEM_BASE, address(src));
+            break;
+        case LOADB:
+            e.load8_idx(dst, MEM_BASE, address(src));
+            break;
+        case LOADSB:
+            e.load8s_idx(dst, MEM_BASE, address(src));
+            break;
+        case LOADH:
+            e.load16_idx(dst, MEM_BASE, address(src));
+            break;
+        case LOADSH:
+            e.load16s_idx(dst, MEM_BASE, address(src));
+            break;
+        case STORE:
+        case STOREX:
+        case STOREB:
+        case STOREH: {
+            host_reg_t addr = address(dst);
+            if (i.op == STOREB)
+                e.store8_idx(MEM_BASE, addr, src);
+            else if (i.op == STOREH)
+                e.store16_idx(MEM_BASE, addr, src);
+            else
+                e.store_idx(MEM_BASE, addr, src);
+            e.alu_ri(X64Emitter::CMP, addr, text_size);
+            store_exits.push_back({ e.jcc(X64Emitter::CC_B), &i, addr });
+            break;
+        }
+        case MOV:
+            if (i.ri == IMM)
+                e.mov_ri(dst, i.iv);
+            else
+                e.mov_rr(dst, src);
+            break;
+        case ADD:
+        case SUB:
+        case AND:
+        case OR:
+        case XOR:
+            switch (i.op) {
+            case ADD: alu = X64Emitter::ADD; break;
+            case SUB: alu = X64Emitter::SUB; break;
+            case AND: alu = X64Emitter::AND; break;
+            case OR:  alu = X64Emitter::OR;  break;
+            case XOR: alu = X64Emitter::XOR; break;
+            }
+            if (i.ri == IMM)
+                e.alu_ri(alu, dst, i.iv);
+            else
+                e.alu_rr(alu, dst, src);
+            break;
+        case NOT:
+            e.not_r(dst);
+            break;
+        case MUL:
+            if (i.ri == IMM)
+                e.imul_ri(dst, i.iv);
+            else
+                e.imul_rr(dst, src);
+            break;
+        case DIV:
+        case SDIV:
+        case MOD:
+        case SMOD: {
+            // EDX:EAX / divisor, with the quotient left in EAX and the remainder in EDX
+            bool is_signed = i.op == SDIV || i.op == SMOD;
+            bool is_mod = i.op == MOD || i.op == SMOD;
+            host_reg_t divisor = src;
+            if (i.ri == IMM) {
+                if (i.iv == 0) {
+                    div_exits.push_back({ e.jmp(), &i });
+                    break;
+                }
+                e.mov_ri(X64Emitter::RCX, i.iv);
+                divisor = X64Emitter::RCX;
+            } else {
+                e.test_rr(src, src);
+                div_exits.push_back({ e.jcc(X64Emitter::CC_Z), &i });
+            }
+            uint8_t* done = nullptr;
+            if (is_signed) {
+                // idiv faults on INT32_MIN / -1; dividing by -1 is a negation, with no remainder
+                e.alu_ri(X64Emitter::CMP, divisor, 0xffffffff);
+                uint8_t* not_minus_one = e.jcc(X64Emitter::CC_NZ);
+                if (is_mod)
+                    e.mov_ri(dst, 0);
+                else
+                    e.neg_r(dst);
+                done = e.jmp();
+                X64Emitter::patch(not_minus_one, e.pos());
+                e.mov_rr(X64Emitter::RAX, dst);
+                e.cdq();
+                e.idiv_r(divisor);
+            } else {
+                e.mov_rr(X64Emitter::RAX, dst);
+                e.alu_rr(X64Emitter::XOR, X64Emitter::RDX, X64Emitter::RDX);
+                e.div_r(divisor);
+            }
+            e.mov_rr(dst, is_mod ? X64Emitter::RDX : X64Emitter::RAX);
+            if (done != nullptr)
+                X64Emitter::patch(done, e.pos());
+            break;
+        }
+        case SHL:
+        case SHR:
+        case SAR: {
+            X64Emitter::shift_t shift = i.op == SHL ? X64Emitter::SHL
+                                      : i.op == SHR ? X64Emitter::SHR
+                                      : X64Emitter::SAR;
+            if (i.ri == IMM) {
+                e.shift_ri(shift, dst, i.iv & 31);
+            } else {
+                e.mov_rr(X64Emitter::RCX, src);
+                e.shift_cl(shift, dst);
+            }
+            break;
+        }
+        case CMP:
+            if (i.ri == IMM)
+                e.alu_ri(X64Emitter::CMP, dst, i.iv);
+            else
+                e.alu_rr(X64Emitter::CMP, dst, src);
+            e.mov_ri(X64Emitter::RAX, FLAG_EQ);
+            e.mov_ri(X64Emitter::RCX, FLAG_LT);
+            e.cmov(X64Emitter::CC_B, X64Emitter::RAX, X64Emitter::RCX);
+            e.mov_ri(X64Emitter::RCX, FLAG_GT);
+            e.cmov(X64Emitter::CC_A, X64Emitter::RAX, X64Emitter::RCX);
+            e.test_rr(dst, dst);
+            e.lea_disp(X64Emitter::RCX, X64Emitter::RAX, FLAG_Z);
+            e.cmov(X64Emitter::CC_Z, X64Emitter::RAX, X64Emitter::RCX);
+            e.mov_rr(host[FLAGS], X64Emitter::RAX);
+            break;
+        case PUSH:
+            e.alu_ri(X64Emitter::SUB, host[SP], 4);
+            e.store_idx(MEM_BASE, host[SP], dst);
+            break;
+        case POP:
+            e.load_idx(dst, MEM_BASE, host[SP]);
+            e.alu_ri(X64Emitter::ADD, host[SP], 4);
+            break;
+        case CALL:
+            e.alu_ri(X64Emitter::SUB, host[SP], 4);
+            e.store_idx_imm(MEM_BASE, host[SP], i.addr + i.len);
+            exit_to(i.iv);
+            break;
+        case RET:
+            e.load_idx(X64Emitter::RAX, MEM_BASE, host[SP]);
+            e.alu_ri(X64Emitter::ADD, host[SP], 4);
+            for (uint8_t g = 0; g < 16; g++)
+                if (written & BIT(g))
+                    e.store_disp(REG_BASE, GUEST_REG(g), host[g]);
+            e.store_disp(REG_BASE, GUEST_REG(PC), X64Emitter::RAX);
+            e.mov_ri(X64Emitter::RAX, EXIT_DISPATCH);
+            X64Emitter::patch(e.jmp(), epilogue);
+            break;
+        case JMP:
+            exit_to(i.iv);
+            break;
+        default: {
+            // conditional jumps: taken when the flags test is non-zero, or zero for the negated ones
+            uint32_t mask = 0;
+            bool negated = false;
+            switch (i.op) {
+            case JMPZ:  mask = FLAG_Z;                               break;
+            case JMPNZ: mask = FLAG_Z;              negated = true;  break;
+            case JMPEQ: mask = FLAG_EQ;                              break;
+            case JMPNE: mask = FLAG_EQ;             negated = true;  break;
+            case JMPGT: mask = FLAG_GT;                              break;
+            case JMPLT: mask = FLAG_LT;                              break;
+            case JMPGE: mask = FLAG_GT | FLAG_EQ;                    break;
+            case JMPLE: mask = FLAG_LT | FLAG_EQ;                    break;
+            }
+            e.test_ri(host[FLAGS], mask);
+            uint8_t* taken = e.jcc(negated ? X64Emitter::CC_Z : X64Emitter::CC_NZ);
+            exit_to(i.addr + i.len);
+            X64Emitter::patch(taken, e.pos());
+            exit_to(i.iv);
+            break;
+        }
+        }
+    }
+
+    const guest_instr_t& last = instrs.back();
+    if (!(last.op == CALL || last.op == RET || (last.op >= JMP && last.op <= JMPLE)))
+        exit_to(next);
+
+    // nothing has run yet, PC still holds the block address
+    X64Emitter::patch(fuel_exit, e.pos());
+    e.mov_ri(X64Emitter::RAX, EXIT_OUT_OF_FUEL);
+    X64Emitter::patch(e.jmp(), epilogue);
+
+    // stores into the text leave the block right after the store
+    for (auto& [site, i, addr] : store_exits) {
+        X64Emitter::patch(site, e.pos());
+        e.mov_rr(X64Emitter::RDX, addr);
+        for (uint8_t g = 0; g < 16; g++)
+            if (written & BIT(g))
+                e.store_disp(REG_BASE, GUEST_REG(g), host[g]);
+        e.store_disp_imm(REG_BASE, GUEST_REG(PC), i->addr + i->len);
+        e.mov_ri(X64Emitter::RAX, EXIT_STORE_TEXT);
+        X64Emitter::patch(e.jmp(), epilogue);
+    }
+
+    // divisions by zero leave the block with PC on the division
+    for (auto& [site, i] : div_exits) {
+        X64Emitter::patch(site, e.pos());
+        for (uint8_t g = 0; g < 16; g++)
+            if (written & BIT(g))
+                e.store_disp(REG_BASE, GUEST_REG(g), host[g]);
+        e.store_disp_imm(REG_BASE, GUEST_REG(PC), i->addr);
+        e.mov_ri(X64Emitter::RAX, EXIT_DIVIDE_BY_ZERO);
+        X64Emitter::patch(e.jmp(), epilogue);
+    }
+
+    if (e.full()) {
+        if (code_top == code_start)
+            std::abort();
+        DBG("Code buffer full; flushing compiled code ..." << endl);
+        flush();
+        return compile(addr);
+    }
+
+    DBG("Compiled " << HEX(8, addr) << " - " << HEX(8, next) << " (" << instrs.size() << " instructions) @"
+        << (void*) entry << "[" << e.pos() - entry << "]" << endl);
+    for (uint32_t a = addr; a < next; a++)
+        compiled[a] = true;
+    code_top = e.pos();
+    return entry;
+}
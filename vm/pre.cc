@@ -0,0 +1,902 @@
+#include <algorithm>
+#include <cstdlib>
+
+#include "exe.h"
+
+
+#define DISPATCH() { \
+    d = &code[reg[PC]]; \
+    goto *d->handler; \
+}
+#define DISPATCH_NEXT() { \
+    reg[PC] = d->next; \
+    fuel--; \
+    DISPATCH(); \
+}
+#define DISPATCH_TO(ADDR) { \
+    reg[PC] = ADDR; \
+    fuel--; \
+    if (reg[PC] >= text_size) \
+        goto _undecoded; \
+    DISPATCH(); \
+}
+
+// The fuel is only looked at on backward jumps, calls and returns; any loop goes through one of them.
+#define DISPATCH_CHECKED(ADDR) { \
+    reg[PC] = ADDR; \
+    fuel--; \
+    if (out_of_fuel()) \
+        return; \
+    if (reg[PC] >= text_size) \
+        goto _undecoded; \
+    DISPATCH(); \
+}
+#define JUMP_TO(ADDR) { \
+    if ((ADDR) <= reg[PC]) { \
+        DISPATCH_CHECKED(ADDR); \
+    } else { \
+        DISPATCH_TO(ADDR); \
+    } \
+}
+
+#define DISPATCH_IF(FLAGS) { \
+    if ((FLAGS) & d->mask) { \
+        JUMP_TO(d->target); \
+    } else { \
+        DISPATCH_NEXT(); \
+    } \
+}
+
+// As DISPATCH_IF, for fused branches leaving FLAGS out as dead; a stop on the backward jump hands out the
+// registers all the same, so FLAGS gets written then.
+#define DISPATCH_IF_NF(BRANCH_FLAGS) { \
+    if ((BRANCH_FLAGS) & d->mask) { \
+        if (d->target <= reg[PC]) { \
+            reg[PC] = d->target; \
+            fuel--; \
+            if (out_of_fuel()) { \
+                reg[FLAGS] = (BRANCH_FLAGS) & ~FLAG_NZ; \
+                return; \
+            } \
+            if (reg[PC] >= text_size) \
+                goto _undecoded; \
+            DISPATCH(); \
+        } \
+        DISPATCH_TO(d->target); \
+    } else { \
+        DISPATCH_NEXT(); \
+    } \
+}
+
+#define TRACE() if (debug) { trace(reg_imm(mem[reg[PC]]), d->dst, d->src, d->iv); }
+
+
+PreDecoder::PreDecoder(size_t ram_size_mb, bool sparse_mem, bool debug)
+: ExecutionEngine(ram_size_mb, sparse_mem, debug)
+, text_size(0), code(nullptr), decode_handler(nullptr)
+{
+    DBG("\ttype 'pre-decoder'" << endl);
+}
+
+
+void PreDecoder::init_execution()
+{
+}
+
+
+void PreDecoder::load_program()
+{
+    copy_program();
+
+    DBG("Initializing decoded text ..." << endl);
+    text_size = prog_size;
+    // One extra entry so that falling through the last instruction lands on an undecoded one.
+    code = std::unique_ptr<decoded_instr_t[]>(new decoded_instr_t[text_size + 1]);
+    DBG("\tDecoded text @" << (void*) code.get() << "[" << text_size + 1 << "]" << endl);
+    flags_deps.assign(text_size, false);
+}
+
+
+void PreDecoder::exec_program()
+{
+    static const void* const instr_exec_handle[][2] = {
+        { nullptr,     nullptr     },
+        { &&_load,     &&_load_i   },
+        { &&_store,    &&_store_i  },
+        { &&_mov_r,    &&_mov_i    },
+        { &&_add_r,    &&_add_i    },
+        { &&_sub_r,    &&_sub_i    },
+        { &&_and_r,    &&_and_i    },
+        { &&_or_r,     &&_or_i     },
+        { &&_xor_r,    &&_xor_i    },
+        { &&_not,      nullptr     },
+        { &&_cmp_r,    &&_cmp_i    },
+        { &&_push,     nullptr     },
+        { &&_pop,      nullptr     },
+        { nullptr,     &&_call     },
+        { &&_ret,      nullptr     },
+        { nullptr,     &&_jmp      },
+        { nullptr,     &&_jmpz     },
+        { nullptr,     &&_jmpnz    },
+        { nullptr,     &&_jmpeq    },
+        { nullptr,     &&_jmpne    },
+        { nullptr,     &&_jmpgt    },
+        { nullptr,     &&_jmplt    },
+        { nullptr,     &&_jmpge    },
+        { nullptr,     &&_jmple    },
+        { &&_mul_r,    &&_mul_i    },
+        { &&_div_r,    &&_div_i    },
+        { &&_sdiv_r,   &&_sdiv_i   },
+        { &&_mod_r,    &&_mod_i    },
+        { &&_smod_r,   &&_smod_i   },
+        { &&_shl_r,    &&_shl_i    },
+        { &&_shr_r,    &&_shr_i    },
+        { &&_sar_r,    &&_sar_i    },
+        { &&_loadx,    nullptr     },
+        { &&_storex,   nullptr     },
+        { &&_loadb_r,  &&_loadb_i  },
+        { &&_loadsb_r, &&_loadsb_i },
+        { &&_loadh_r,  &&_loadh_i  },
+        { &&_loadsh_r, &&_loadsh_i },
+        { &&_storeb_r, &&_storeb_i },
+        { &&_storeh_r, &&_storeh_i },
+    };
+
+    static const handlers_t handlers = {
+        instr_exec_handle,
+        &&_sys_enter,
+        &&_undecoded,
+        { { &&_cmp_r_jcc_nf, &&_cmp_r_jcc }, { &&_cmp_i_jcc_nf, &&_cmp_i_jcc } },
+        &&_load_sp,
+        &&_push_call,
+        &&_push_push,
+        &&_pop_pop,
+        &&_step,
+    };
+
+    DBG("Decoding program ..." << endl);
+    decode_handler = &&_decode;
+    for (uint32_t addr = 0; addr <= text_size; addr++)
+        code[addr] = { &&_decode, 0, 0, 0, 0, 0, 0 };
+    for (uint32_t addr = 0; addr < text_size; addr = code[addr].next)
+        decode(addr, handlers);
+
+    DBG("Running program ..." << endl);
+
+    const decoded_instr_t* d;
+
+    // The first instruction is charged here, as any other is when dispatched to.
+    fuel--;
+    if (reg[PC] >= text_size)
+        goto _undecoded;
+    DISPATCH();
+
+    _decode: {
+        decode(reg[PC], handlers);
+        DISPATCH();
+    }
+
+    // Past the text, or on what does not decode whole within it: stepped as the interpreter does it, back to
+    // pre-decoded dispatch once PC is on text that decodes.
+    _undecoded: {
+        do {
+            if (!step() || out_of_fuel())
+                return;
+        } while (reg[PC] >= text_size);
+        DISPATCH();
+    }
+
+    _load: {
+        TRACE();
+        reg[d->dst] = uint8_to_uint32(mem[reg[d->src]]);
+        DISPATCH_NEXT();
+    }
+
+    _store: {
+        TRACE();
+        uint32_t addr = reg[d->dst];
+        uint8_to_uint32(mem[addr]) = reg[d->src];
+        if (addr < text_size)
+            invalidate(addr, 4, &&_decode);
+        DISPATCH_NEXT();
+    }
+
+    _load_i: {
+        TRACE();
+        reg[d->dst] = uint8_to_uint32(mem[reg[d->src] + d->iv]);
+        DISPATCH_NEXT();
+    }
+
+    _store_i: {
+        TRACE();
+        uint32_t addr = reg[d->dst] + d->iv;
+        uint8_to_uint32(mem[addr]) = reg[d->src];
+        if (addr < text_size)
+            invalidate(addr, 4, &&_decode);
+        DISPATCH_NEXT();
+    }
+
+    _loadb_r: {
+        TRACE();
+        reg[d->dst] = zext8(mem[reg[d->src]]);
+        DISPATCH_NEXT();
+    }
+
+    _loadb_i: {
+        TRACE();
+        reg[d->dst] = zext8(mem[reg[d->src] + d->iv]);
+        DISPATCH_NEXT();
+    }
+
+    _loadsb_r: {
+        TRACE();
+        reg[d->dst] = sext8(mem[reg[d->src]]);
+        DISPATCH_NEXT();
+    }
+
+    _loadsb_i: {
+        TRACE();
+        reg[d->dst] = sext8(mem[reg[d->src] + d->iv]);
+        DISPATCH_NEXT();
+    }
+
+    _loadh_r: {
+        TRACE();
+        reg[d->dst] = zext16(uint8_to_uint16(mem[reg[d->src]]));
+        DISPATCH_NEXT();
+    }
+
+    _loadh_i: {
+        TRACE();
+        reg[d->dst] = zext16(uint8_to_uint16(mem[reg[d->src] + d->iv]));
+        DISPATCH_NEXT();
+    }
+
+    _loadsh_r: {
+        TRACE();
+        reg[d->dst] = sext16(uint8_to_uint16(mem[reg[d->src]]));
+        DISPATCH_NEXT();
+    }
+
+    _loadsh_i: {
+        TRACE();
+        reg[d->dst] = sext16(uint8_to_uint16(mem[reg[d->src] + d->iv]));
+        DISPATCH_NEXT();
+    }
+
+    _storeb_r: {
+        TRACE();
+        uint32_t addr = reg[d->dst];
+        mem[addr] = static_cast<uint8_t>(reg[d->src]);
+        if (addr < text_size)
+            invalidate(addr, 1, &&_decode);
+        DISPATCH_NEXT();
+    }
+
+    _storeb_i: {
+        TRACE();
+        uint32_t addr = reg[d->dst] + d->iv;
+        mem[addr] = static_cast<uint8_t>(reg[d->src]);
+        if (addr < text_size)
+            invalidate(addr, 1, &&_decode);
+        DISPATCH_NEXT();
+    }
+
+    _storeh_r: {
+        TRACE();
+        uint32_t addr = reg[d->dst];
+        uint8_to_uint16(mem[addr]) = static_cast<uint16_t>(reg[d->src]);
+        if (addr < text_size)
+            invalidate(addr, 2, &&_decode);
+        DISPATCH_NEXT();
+    }
+
+    _storeh_i: {
+        TRACE();
+        uint32_t addr = reg[d->dst] + d->iv;
+        uint8_to_uint16(mem[addr]) = static_cast<uint16_t>(reg[d->src]);
+        if (addr < text_size)
+            invalidate(addr, 2, &&_decode);
+        DISPATCH_NEXT();
+    }
+
+    _loadx: {
+        TRACE();
+        reg[d->dst] = uint8_to_uint32(mem[reg[d->src] + (reg[d->target] << d->mask)]);
+        DISPATCH_NEXT();
+    }
+
+    _storex: {
+        TRACE();
+        uint32_t addr = reg[d->dst] + (reg[d->target] << d->mask);
+        uint8_to_uint32(mem[addr]) = reg[d->src];
+        if (addr < text_size)
+            invalidate(addr, 4, &&_decode);
+        DISPATCH_NEXT();
+    }
+
+    _mov_r: {
+        TRACE();
+        reg[d->dst] = reg[d->src];
+        DISPATCH_NEXT();
+    }
+
+    _mov_i: {
+        TRACE();
+        reg[d->dst] = d->iv;
+        DISPATCH_NEXT();
+    }
+
+    _add_r: {
+        TRACE();
+        uint32_to_int32(reg[d->dst]) += uint32_to_int32(reg[d->src]);
+        DISPATCH_NEXT();
+    }
+
+    _add_i: {
+        TRACE();
+        reg[d->dst] += d->iv;
+        DISPATCH_NEXT();
+    }
+
+    _sub_r: {
+        TRACE();
+        uint32_to_int32(reg[d->dst]) -= uint32_to_int32(reg[d->src]);
+        DISPATCH_NEXT();
+    }
+
+    _sub_i: {
+        TRACE();
+        reg[d->dst] -= d->iv;
+        DISPATCH_NEXT();
+    }
+
+    _and_r: {
+        TRACE();
+        reg[d->dst] &= reg[d->src];
+        DISPATCH_NEXT();
+    }
+
+    _and_i: {
+        TRACE();
+        reg[d->dst] &= d->iv;
+        DISPATCH_NEXT();
+    }
+
+    _or_r: {
+        TRACE();
+        reg[d->dst] |= reg[d->src];
+        DISPATCH_NEXT();
+    }
+
+    _or_i: {
+        TRACE();
+        reg[d->dst] |= d->iv;
+        DISPATCH_NEXT();
+    }
+
+    _xor_r: {
+        TRACE();
+        reg[d->dst] ^= reg[d->src];
+        DISPATCH_NEXT();
+    }
+
+    _xor_i: {
+        TRACE();
+        reg[d->dst] ^= d->iv;
+        DISPATCH_NEXT();
+    }
+
+    _mul_r: {
+        TRACE();
+        reg[d->dst] *= reg[d->src];
+        DISPATCH_NEXT();
+    }
+
+    _mul_i: {
+        TRACE();
+        reg[d->dst] *= d->iv;
+        DISPATCH_NEXT();
+    }
+
+    _div_r: {
+        TRACE();
+        if (reg[d->src] == 0) {
+            divide_by_zero();
+            return;
+        }
+        reg[d->dst] /= reg[d->src];
+        DISPATCH_NEXT();
+    }
+
+    _div_i: {
+        TRACE();
+        if (d->iv == 0) {
+            divide_by_zero();
+            return;
+        }
+        reg[d->dst] /= d->iv;
+        DISPATCH_NEXT();
+    }
+
+    _sdiv_r: {
+        TRACE();
+        if (reg[d->src] == 0) {
+            divide_by_zero();
+            return;
+        }
+        reg[d->dst] = sdiv(reg[d->dst], reg[d->src]);
+        DISPATCH_NEXT();
+    }
+
+    _sdiv_i: {
+        TRACE();
+        if (d->iv == 0) {
+            divide_by_zero();
+            return;
+        }
+        reg[d->dst] = sdiv(reg[d->dst], d->iv);
+        DISPATCH_NEXT();
+    }
+
+    _mod_r: {
+        TRACE();
+        if (reg[d->src] == 0) {
+            divide_by_zero();
+            return;
+        }
+        reg[d->dst] %= reg[d->src];
+        DISPATCH_NEXT();
+    }
+
+    _mod_i: {
+        TRACE();
+        if (d->iv == 0) {
+            divide_by_zero();
+            return;
+        }
+        reg[d->dst] %= d->iv;
+        DISPATCH_NEXT();
+    }
+
+    _smod_r: {
+        TRACE();
+        if (reg[d->src] == 0) {
+            divide_by_zero();
+            return;
+        }
+        reg[d->dst] = smod(reg[d->dst], reg[d->src]);
+        DISPATCH_NEXT();
+    }
+
+    _smod_i: {
+        TRACE();
+        if (d->iv == 0) {
+            divide_by_zero();
+            return;
+        }
+        reg[d->dst] = smod(reg[d->dst], d->iv);
+        DISPATCH_NEXT();
+    }
+
+    _shl_r: {
+        TRACE();
+        reg[d->dst] <<= reg[d->src] & 31;
+        DISPATCH_NEXT();
+    }
+
+    _shl_i: {
+        TRACE();
+        reg[d->dst] <<= d->iv & 31;
+        DISPATCH_NEXT();
+    }
+
+    _shr_r: {
+        TRACE();
+        reg[d->dst] >>= reg[d->src] & 31;
+        DISPATCH_NEXT();
+    }
+
+    _shr_i: {
+        TRACE();
+        reg[d->dst] >>= d->iv & 31;
+        DISPATCH_NEXT();
+    }
+
+    _sar_r: {
+        TRACE();
+        reg[d->dst] = sar(reg[d->dst], reg[d->src]);
+        DISPATCH_NEXT();
+    }
+
+    _sar_i: {
+        TRACE();
+        reg[d->dst] = sar(reg[d->dst], d->iv);
+        DISPATCH_NEXT();
+    }
+
+    _not: {
+        TRACE();
+        reg[d->dst] = ~reg[d->dst];
+        DISPATCH_NEXT();
+    }
+
+    _cmp_r: {
+        TRACE();
+        reg[FLAGS] = 0;
+        if (reg[d->dst] == 0)
+            reg[FLAGS] |= FLAG_Z;
+        if (reg[d->dst] < reg[d->src])
+            reg[FLAGS] |= FLAG_LT;
+        else if (reg[d->dst] > reg[d->src])
+            reg[FLAGS] |= FLAG_GT;
+        else
+            reg[FLAGS] |= FLAG_EQ;
+        DISPATCH_NEXT();
+    }
+
+    _cmp_i: {
+        TRACE();
+        reg[FLAGS] = 0;
+        if (reg[d->dst] == 0)
+            reg[FLAGS] |= FLAG_Z;
+        if (reg[d->dst] < d->iv)
+            reg[FLAGS] |= FLAG_LT;
+        else if (reg[d->dst] > d->iv)
+            reg[FLAGS] |= FLAG_GT;
+        else
+            reg[FLAGS] |= FLAG_EQ;
+        DISPATCH_NEXT();
+    }
+
+    _push: {
+        TRACE();
+        reg[SP] -= 4;
+        uint8_to_uint32(mem[reg[SP]]) = reg[d->dst];
+        DISPATCH_NEXT();
+    }
+
+    _pop: {
+        TRACE();
+        reg[d->dst] = uint8_to_uint32(mem[reg[SP]]);
+        reg[SP] += 4;
+        DISPATCH_NEXT();
+    }
+
+    _call: {
+        TRACE();
+        reg[SP] -= 4;
+        uint8_to_uint32(mem[reg[SP]]) = d->next;
+        DISPATCH_CHECKED(d->iv);
+    }
+
+    _ret: {
+        TRACE();
+        reg[SP] += 4;
+        DISPATCH_CHECKED(uint8_to_uint32(mem[reg[SP] - 4]));
+    }
+
+    _sys_enter: {
+        TRACE();
+        if (!sys_enter())
+            return;
+        goto _ret;
+    }
+
+    _jmp: {
+        TRACE();
+        JUMP_TO(d->iv);
+    }
+
+    // Writing PC goes anywhere rather than to d->next; done as the interpreter does it, and checked like any
+    // backward jump.
+    _step: {
+        TRACE();
+        if (!step() || out_of_fuel())
+            return;
+        if (reg[PC] >= text_size)
+            goto _undecoded;
+        DISPATCH();
+    }
+
+    _jmpz: {
+        TRACE();
+        if (reg[FLAGS] & FLAG_Z) {
+            JUMP_TO(d->iv);
+        } else {
+            DISPATCH_NEXT();
+        }
+    }
+
+    _jmpnz: {
+        TRACE();
+        if (reg[FLAGS] & FLAG_Z) {
+            DISPATCH_NEXT();
+        } else {
+            JUMP_TO(d->iv);
+        }
+    }
+
+    _jmpeq: {
+        TRACE();
+        if (reg[FLAGS] & FLAG_EQ) {
+            JUMP_TO(d->iv);
+        } else {
+            DISPATCH_NEXT();
+        }
+    }
+
+    _jmpne: {
+        TRACE();
+        if (reg[FLAGS] & FLAG_EQ) {
+            DISPATCH_NEXT();
+        } else {
+            JUMP_TO(d->iv);
+        }
+    }
+
+    _jmpgt: {
+        TRACE();
+        if (reg[FLAGS] & FLAG_GT) {
+            JUMP_TO(d->iv);
+        } else {
+            DISPATCH_NEXT();
+        }
+    }
+
+    _jmplt: {
+        TRACE();
+        if (reg[FLAGS] & FLAG_LT) {
+            JUMP_TO(d->iv);
+        } else {
+            DISPATCH_NEXT();
+        }
+    }
+
+    _jmpge: {
+        TRACE();
+        if (reg[FLAGS] & (FLAG_GT | FLAG_EQ)) {
+            JUMP_TO(d->iv);
+        } else {
+            DISPATCH_NEXT();
+        }
+    }
+
+    _jmple: {
+        TRACE();
+        if (reg[FLAGS] & (FLAG_LT | FLAG_EQ)) {
+            JUMP_TO(d->iv);
+        } else {
+            DISPATCH_NEXT();
+        }
+    }
+
+    // Superinstructions; selected by decode() from the hottest sequences in profiled runs
+    // (see tools/hotseq.py). Never used when tracing, so the trace still shows every instruction.
+
+    _cmp_r_jcc: {
+        fuel--;
+        uint32_t flags = compare(reg[d->dst], reg[d->src]);
+        reg[FLAGS] = flags & ~FLAG_NZ;
+        DISPATCH_IF(flags);
+    }
+
+    _cmp_r_jcc_nf: {
+        fuel--;
+        uint32_t flags = compare(reg[d->dst], reg[d->src]);
+        DISPATCH_IF_NF(flags);
+    }
+
+    _cmp_i_jcc: {
+        fuel--;
+        uint32_t flags = compare(reg[d->dst], d->iv);
+        reg[FLAGS] = flags & ~FLAG_NZ;
+        DISPATCH_IF(flags);
+    }
+
+    _cmp_i_jcc_nf: {
+        fuel--;
+        uint32_t flags = compare(reg[d->dst], d->iv);
+        DISPATCH_IF_NF(flags);
+    }
+
+    _load_sp: {
+        fuel -= 2;
+        uint32_t addr = reg[SP] + d->iv;
+        reg[d->dst] = addr;
+        reg[d->src] = uint8_to_uint32(mem[addr]);
+        DISPATCH_NEXT();
+    }
+
+    _push_call: {
+        fuel--;
+        reg[SP] -= 4;
+        uint8_to_uint32(mem[reg[SP]]) = reg[d->dst];
+        reg[SP] -= 4;
+        uint8_to_uint32(mem[reg[SP]]) = d->next;
+        DISPATCH_CHECKED(d->iv);
+    }
+
+    _push_push: {
+        fuel--;
+        reg[SP] -= 4;
+        uint8_to_uint32(mem[reg[SP]]) = reg[d->dst];
+        reg[SP] -= 4;
+        uint8_to_uint32(mem[reg[SP]]) = reg[d->src];
+        DISPATCH_NEXT();
+    }
+
+    _pop_pop: {
+        fuel--;
+        reg[d->dst] = uint8_to_uint32(mem[reg[SP]]);
+        reg[SP] += 4;
+        reg[d->src] = uint8_to_uint32(mem[reg[SP]]);
+        reg[SP] += 4;
+        DISPATCH_NEXT();
+    }
+
+    std::abort();
+}
+
+
+void PreDecoder::fini_execution()
+{
+    dump_registers();
+}
+
+
+void PreDecoder::decode(uint32_t addr, const handlers_t& handlers)
+{
+    static const uint8_t instr_size[][2] = {
+        { 0, 0 },
+        { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 },
+        { 2, 0 }, { 2, 6 }, { 2, 0 }, { 2, 0 }, { 0, 5 }, { 1, 0 },
+        { 0, 5 }, { 0, 5 }, { 0, 5 }, { 0, 5 }, { 0, 5 }, { 0, 5 }, { 0, 5 }, { 0, 5 }, { 0, 5 },
+        { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 },
+        { 3, 0 }, { 3, 0 },
+        { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 },
+    };
+
+    decoded_instr_t& d = code[addr];
+    // The text may be followed by a guard page; never look past it.
+    uint8_t op = addr < text_size ? instr(mem[addr]) : 0;
+    uint8_t ri = addr < text_size ? reg_imm(mem[addr]) : 0;
+
+    if (op >= sizeof instr_size / sizeof instr_size[0] || instr_size[op][ri] == 0
+            || addr + instr_size[op][ri] > text_size) {
+        d = { handlers.undecoded, 0, addr + 1, 0, 0, 0, 0 };
+        return;
+    }
+
+    d.handler = handlers.instr[op][ri];
+    d.next = addr + instr_size[op][ri];
+    d.target = d.mask = 0;
+    d.dst = d.src = 0;
+    d.iv = 0;
+    switch (instr_size[op][ri]) {
+    case 2:
+        d.dst = reg_dst(mem[addr + 1]);
+        d.src = reg_src(mem[addr + 1]);
+        break;
+    case 3:
+        d.dst = reg_dst(mem[addr + 1]);
+        d.src = reg_src(mem[addr + 1]);
+        d.target = reg_dst(mem[addr + 2]);
+        d.mask = scale(mem[addr + 2]);
+        break;
+    case 5:
+        d.iv = imm_val(mem[addr + 1]);
+        break;
+    case 6:
+        d.dst = reg_dst(mem[addr + 1]);
+        d.src = reg_src(mem[addr + 1]);             // [reg+imm]: the base register
+        d.iv = imm_val(mem[addr + 2]);
+        break;
+    }
+
+    if (addr == SYS_ENTER_ADDR && op == JMP)
+        d.handler = handlers.sys_enter;
+    else if (d.dst == PC)
+        d.handler = handlers.step;
+    else if (!debug)
+        fuse(addr, handlers);
+}
+
+
+void PreDecoder::fuse(uint32_t addr, const handlers_t& handlers)
+{
+    static const uint16_t jcc_mask[] = {
+        FLAG_Z, FLAG_NZ, FLAG_EQ, FLAG_LT | FLAG_GT, FLAG_GT, FLAG_LT, FLAG_GT | FLAG_EQ, FLAG_LT | FLAG_EQ,
+    };
+
+    decoded_instr_t& d = code[addr];
+    uint8_t op = instr(mem[addr]);
+    uint8_t ri = reg_imm(mem[addr]);
+    auto at = [&](uint32_t a, uint8_t a_op, uint8_t a_ri, uint32_t a_size) {
+        return a + a_size <= text_size && instr(mem[a]) == a_op && reg_imm(mem[a]) == a_ri;
+    };
+
+    // Instructions referencing PC depend on where they are; leave them alone.
+    if (d.dst == PC || (ri == REG && d.src == PC))
+        return;
+
+    switch (op) {
+    case CMP: {
+        if (d.next + 5 > text_size)
+            break;
+        uint8_t jop = instr(mem[d.next]);
+        if (jop < JMPZ || jop > JMPLE || reg_imm(mem[d.next]) != IMM)
+            break;
+        d.target = imm_val(mem[d.next + 1]);
+        d.mask = jcc_mask[jop - JMPZ];
+        d.next += 5;
+        // FLAGS is dead if whichever way the branch goes the next instruction compares again.
+        bool observable = !(is_cmp(d.target) && is_cmp(d.next));
+        if (!observable)
+            flags_deps[d.target] = flags_deps[d.next] = true;
+        d.handler = handlers.cmp_jcc[ri][observable];
+        break;
+    }
+    case MOV: {
+        uint8_t a = d.dst;
+        if (ri != REG || d.src != SP || !at(addr + 2, ADD, IMM, 6) || !at(addr + 8, LOAD, REG, 2))
+            break;
+        if (reg_dst(mem[addr + 3]) != a || reg_src(mem[addr + 9]) != a || reg_dst(mem[addr + 9]) == PC)
+            break;
+        d.iv = imm_val(mem[addr + 4]);
+        d.src = reg_dst(mem[addr + 9]);
+        d.next = addr + 10;
+        d.handler = handlers.load_sp;
+        break;
+    }
+    case PUSH:
+        if (at(d.next, CALL, IMM, 5)) {
+            d.iv = imm_val(mem[d.next + 1]);
+            d.next += 5;
+            d.handler = handlers.push_call;
+        } else if (at(d.next, PUSH, REG, 2) && reg_dst(mem[d.next + 1]) != PC) {
+            d.src = reg_dst(mem[d.next + 1]);
+            d.next += 2;
+            d.handler = handlers.push_push;
+        }
+        break;
+    case POP:
+        if (at(d.next, POP, REG, 2) && reg_dst(mem[d.next + 1]) != PC) {
+            d.src = reg_dst(mem[d.next + 1]);
+            d.next += 2;
+            d.handler = handlers.pop_pop;
+        }
+        break;
+    }
+}
+
+
+void PreDecoder::code_modified(uint32_t addr, uint32_t size)
+{
+    // Before the first run everything gets decoded anyway.
+    if (addr < text_size && decode_handler != nullptr)
+        invalidate(addr, std::min(size, text_size - addr), decode_handler);
+}
+
+
+bool PreDecoder::is_cmp(uint32_t addr) const
+{
+    return addr < text_size && instr(mem[addr]) == CMP;
+}
+
+
+void PreDecoder::invalidate(uint32_t addr, uint32_t size, const void* handler)
+{
+    // Any instruction, fused or not, starting up to MAX_FUSED_SIZE - 1 bytes before the write may overlap it.
+    uint32_t first = addr < MAX_FUSED_SIZE - 1 ? 0 : addr - (MAX_FUSED_SIZE - 1);
+    uint32_t last = std::min<uint32_t>(addr + size, text_size);
+    // Overwriting an instruction some fused branch relied on to discard FLAGS invalidates everything.
+    if (std::find(flags_deps.begin() + std::min(addr, last), flags_deps.begin() + last, true)
+            != flags_deps.begin() + last) {
+        flags_deps.assign(text_size, false);
+        first = 0;
+        last = text_size;
+    }
+    for (uint32_t a = first; a < last; a++)
+        code[a].handler = handler;
+}
@@ -0,0 +1,57 @@
+#include <algorithm>
+
+#include "exe.h"
+
+
+// The call stacks are kept as a tree, one node per distinct stack, with the current stack as a node
+// index; calls and returns move it along the edges, so the guest stack itself is never walked.
+
+
+void ExecutionEngine::set_profiling(bool profiling)
+{
+    this->profiling = profiling;
+    reset_profile();
+}
+
+
+std::vector<std::pair<uint32_t, uint64_t>> ExecutionEngine::get_profile_pcs() const
+{
+    std::vector<std::pair<uint32_t, uint64_t>> pcs;
+    for (uint32_t pc = 0; pc < profile_pcs.size(); pc++)
+        if (profile_pcs[pc] != 0)
+            pcs.emplace_back(pc, profile_pcs[pc]);
+    pcs.insert(pcs.end(), profile_far_pcs.begin(), profile_far_pcs.end());
+    std::sort(pcs.begin(), pcs.end());
+    return pcs;
+}
+
+
+void ExecutionEngine::reset_profile()
+{
+    profile_pcs.assign(profiling ? prog_size : 0, 0);
+    profile_far_pcs.clear();
+    call_edges.clear();
+    call_nodes.clear();
+    call_nodes.push_back({reg[PC], 0, 1, 0});
+    call_node = 0;
+}
+
+
+void ExecutionEngine::profile_call(uint32_t func)
+{
+    uint64_t edge = uint64_t(call_node) << 32 | func;
+    auto it = call_edges.find(edge);
+    if (it == call_edges.end()) {
+        it = call_edges.emplace(edge, static_cast<uint32_t>(call_nodes.size())).first;
+        call_nodes.push_back({func, call_node, 0, 0});
+    }
+    call_node = it->second;
+    call_nodes[call_node].calls++;
+}
+
+
+void ExecutionEngine::profile_ret()
+{
+    // More returns than calls, when restored from a snapshot taken in a callee say, stop at the entry point.
+    call_node = call_nodes[call_node].caller;
+}
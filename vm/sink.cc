@@ -0,0 +1,54 @@
+#include <cerrno>
+
+#include <unistd.h>
+
+#include "sink.h"
+
+
+FdSink::FdSink(int fd)
+: fd(fd), buffer(new char[BUFFER_SIZE])
+{
+    setp(buffer.get(), buffer.get() + BUFFER_SIZE);
+}
+
+
+FdSink::~FdSink()
+{
+    drain();
+}
+
+
+FdSink::int_type FdSink::overflow(int_type c)
+{
+    if (!drain())
+        return traits_type::eof();
+    if (!traits_type::eq_int_type(c, traits_type::eof())) {
+        *pptr() = traits_type::to_char_type(c);
+        pbump(1);
+    }
+    return traits_type::not_eof(c);
+}
+
+
+int FdSink::sync()
+{
+    return drain() ? 0 : -1;
+}
+
+
+bool FdSink::drain()
+{
+    const char* data = pbase();
+    size_t size = pptr() - pbase();
+    while (size > 0) {
+        ssize_t n = write(fd, data, size);
+        if (n < 0 && errno == EINTR)
+            continue;
+        if (n <= 0)
+            return false;
+        data += n;
+        size -= n;
+    }
+    setp(buffer.get(), buffer.get() + BUFFER_SIZE);
+    return true;
+}
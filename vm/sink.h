@@ -0,0 +1,26 @@
+#pragma once
+
+
+#include <cstddef>
+#include <memory>
+#include <streambuf>
+
+
+// Writes to a file descriptor in large batches; flushed when full, on sync and when destroyed.
+class FdSink final : public std::streambuf {
+public:
+    static const size_t BUFFER_SIZE = 64 << 10;
+
+    explicit FdSink(int fd);
+    ~FdSink();
+
+protected:
+    int_type overflow(int_type c) override;
+    int sync() override;
+
+private:
+    int fd;
+    std::unique_ptr<char[]> buffer;
+
+    bool drain();
+};
@@ -0,0 +1,188 @@
+#include <algorithm>
+#include <cstdlib>
+#include <cstring>
+#include <vector>
+
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <unistd.h>
+
+#include "exe.h"
+
+
+// Snapshot file layout:
+//     header
+//     extents[header.extent_count]
+//     padding up to a page boundary
+//     page data, one page aligned run per extent
+// Only pages holding something other than zeros are saved; everything else restores as zero.
+
+static const char SNAPSHOT_MAGIC[8]         = { 'U', 'C', 'O', 'M', 'P', 'S', 'N', 'P' };
+static const uint32_t SNAPSHOT_VERSION      = 1;
+
+typedef struct {
+    char magic[8];
+    uint32_t version;
+    uint32_t page_size;
+    uint64_t ram_size;
+    uint64_t prog_size;
+    uint64_t prog_hash;
+    uint32_t reg[16];
+    uint32_t sparse_mem;
+    uint32_t extent_count;
+} snapshot_header_t;
+
+typedef struct {
+    uint32_t first_page;
+    uint32_t page_count;
+    uint64_t offset;
+} snapshot_extent_t;
+
+
+static uint64_t hash(const void* data, size_t size)
+{
+    // FNV-1a
+    uint64_t h = 0xcbf29ce484222325;
+    for (size_t i = 0; i < size; i++)
+        h = (h ^ static_cast<const uint8_t*>(data)[i]) * 0x100000001b3;
+    return h;
+}
+
+
+static bool is_zero(const uint8_t* page, size_t page_size)
+{
+    return std::all_of(page, page + page_size, [](uint8_t b) { return b == 0; });
+}
+
+
+static void write_all(int fd, const void* data, size_t size, off_t offset, const char* path)
+{
+    while (size > 0) {
+        ssize_t n = pwrite(fd, data, size, offset);
+        if (n <= 0) {
+            cout << "Cannot write snapshot '" << path << "'." << endl;
+            std::abort();
+        }
+        data = static_cast<const uint8_t*>(data) + n;
+        size -= n;
+        offset += n;
+    }
+}
+
+
+void ExecutionEngine::save_snapshot(const char* path)
+{
+    DBG("Saving snapshot to '" << path << "' ..." << endl);
+
+    size_t page_size = sysconf(_SC_PAGESIZE);
+    size_t page_count = ram_size / page_size;
+
+    // Pages never touched are not resident; no need to look at them. Files are mapped again on restore.
+    std::vector<unsigned char> resident(page_count);
+    if (mincore(mem.get(), ram_size, resident.data()) != 0) {
+        cout << "Cannot query resident memory." << endl;
+        std::abort();
+    }
+    std::vector<snapshot_extent_t> extents;
+    for (size_t page = 0; page < page_count; page++) {
+        if (!(resident[page] & 1) || is_file_mapped(page * page_size) || is_zero(&mem[page * page_size], page_size))
+            continue;
+        if (!extents.empty() && extents.back().first_page + extents.back().page_count == page)
+            extents.back().page_count++;
+        else
+            extents.push_back({ static_cast<uint32_t>(page), 1, 0 });
+    }
+
+    snapshot_header_t header;
+    std::memset(&header, 0, sizeof header);
+    std::memcpy(header.magic, SNAPSHOT_MAGIC, sizeof header.magic);
+    header.version = SNAPSHOT_VERSION;
+    header.page_size = page_size;
+    header.ram_size = ram_size;
+    header.prog_size = prog_size;
+    header.prog_hash = hash(prog.data(), prog_size);
+    header.sparse_mem = sparse_mem;
+    header.extent_count = extents.size();
+    // The state right after the system call returns.
+    std::memcpy(header.reg, reg, sizeof header.reg);
+    header.reg[PC] = uint8_to_uint32(mem[reg[SP]]);
+    header.reg[SP] += 4;
+
+    size_t table_size = sizeof header + extents.size() * sizeof(snapshot_extent_t);
+    uint64_t offset = (table_size + page_size - 1) & ~(page_size - 1);
+    for (auto& extent : extents) {
+        extent.offset = offset;
+        offset += extent.page_count * page_size;
+    }
+
+    int fd = open(path, O_WRONLY | O_CREAT | O_TRUNC, 0644);
+    if (fd < 0) {
+        cout << "Cannot create snapshot '" << path << "'." << endl;
+        std::abort();
+    }
+    write_all(fd, &header, sizeof header, 0, path);
+    write_all(fd, extents.data(), extents.size() * sizeof(snapshot_extent_t), sizeof header, path);
+    for (const auto& extent : extents)
+        write_all(fd, &mem[extent.first_page * page_size], extent.page_count * page_size, extent.offset, path);
+    close(fd);
+
+    DBG("\t" << extents.size() << " extent(s), " << (offset >> 10) << " KiB" << endl);
+    snapshot_saved = true;
+}
+
+
+void ExecutionEngine::restore_snapshot(const char* path)
+{
+    DBG("Restoring snapshot from '" << path << "' ..." << endl);
+
+    int fd = open(path, O_RDONLY);
+    if (fd < 0) {
+        cout << "Cannot open snapshot '" << path << "'." << endl;
+        std::abort();
+    }
+    snapshot_header_t header;
+    if (pread(fd, &header, sizeof header, 0) != sizeof header
+            || std::memcmp(header.magic, SNAPSHOT_MAGIC, sizeof header.magic) != 0
+            || header.version != SNAPSHOT_VERSION) {
+        cout << "'" << path << "' is not a snapshot." << endl;
+        std::abort();
+    }
+    size_t page_size = sysconf(_SC_PAGESIZE);
+    if (header.page_size != page_size) {
+        cout << "Snapshot '" << path << "' was taken with " << header.page_size << " byte pages." << endl;
+        std::abort();
+    }
+    if (header.prog_size != prog_size || header.prog_hash != hash(prog.data(), prog_size)) {
+        cout << "Snapshot '" << path << "' was not taken from this program." << endl;
+        std::abort();
+    }
+    std::vector<snapshot_extent_t> extents(header.extent_count);
+    size_t extents_size = extents.size() * sizeof(snapshot_extent_t);
+    if (pread(fd, extents.data(), extents_size, sizeof header) != static_cast<ssize_t>(extents_size)) {
+        cout << "Snapshot '" << path << "' is truncated." << endl;
+        std::abort();
+    }
+
+    ram_size = header.ram_size;
+    sparse_mem = header.sparse_mem;
+    DBG("\tmemory " << (ram_size >> 20) << " MiB" << (sparse_mem ? ", sparse" : "") << endl);
+    map_memory();
+
+    // Copy-on-write; the snapshot itself is never modified and pages are only read in when touched.
+    for (const auto& extent : extents) {
+        if ((uint64_t(extent.first_page) + extent.page_count) * page_size > ram_size) {
+            cout << "Snapshot '" << path << "' is corrupt." << endl;
+            std::abort();
+        }
+        void* addr = mmap(&mem[extent.first_page * page_size], extent.page_count * page_size,
+                          PROT_READ | PROT_WRITE, MAP_PRIVATE | MAP_FIXED, fd, extent.offset);
+        if (addr == MAP_FAILED) {
+            cout << "Cannot map snapshot '" << path << "'." << endl;
+            std::abort();
+        }
+    }
+    close(fd);
+
+    std::memcpy(reg, header.reg, sizeof reg);
+    DBG("\t" << extents.size() << " extent(s)" << endl);
+}
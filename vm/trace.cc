@@ -0,0 +1,123 @@
+#include <cstdlib>
+#include <cstring>
+
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <unistd.h>
+
+#include "exe.h"
+
+
+// Trace file layout:
+//     header
+//     records[header.capacity]
+// Record i, counting from 0 since tracing started, is at i % capacity; the last ones are those from
+// count - capacity, if positive, to count. tools/trace.py turns them into the text -d emits.
+
+static const char TRACE_MAGIC[8]            = { 'U', 'C', 'O', 'M', 'P', 'T', 'R', 'C' };
+static const uint32_t TRACE_VERSION         = 1;
+
+struct ExecutionEngine::trace_header_t {
+    char magic[8];
+    uint32_t version;
+    uint32_t record_size;
+    uint64_t capacity;
+    uint64_t count;
+};
+
+
+void ExecutionEngine::set_trace(const char* path, uint64_t size)
+{
+    close_trace();
+    if (path == nullptr)
+        return;
+
+    uint64_t capacity = 1;
+    while (capacity < size)
+        capacity <<= 1;
+    size_t map_size = sizeof(trace_header_t) + capacity * sizeof(trace_record_t);
+
+    DBG("Tracing the last " << capacity << " instructions to '" << path << "' ..." << endl);
+    int fd = open(path, O_RDWR | O_CREAT | O_TRUNC, 0644);
+    if (fd < 0 || ftruncate(fd, map_size) != 0) {
+        cout << "Cannot create trace '" << path << "'." << endl;
+        std::abort();
+    }
+    void* map = mmap(nullptr, map_size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    close(fd);
+    if (map == MAP_FAILED) {
+        cout << "Cannot map trace '" << path << "'." << endl;
+        std::abort();
+    }
+
+    trace_header = static_cast<trace_header_t*>(map);
+    std::memcpy(trace_header->magic, TRACE_MAGIC, sizeof TRACE_MAGIC);
+    trace_header->version = TRACE_VERSION;
+    trace_header->record_size = sizeof(trace_record_t);
+    trace_header->capacity = capacity;
+    trace_header->count = 0;
+    trace_ring = reinterpret_cast<trace_record_t*>(trace_header + 1);
+    trace_mask = capacity - 1;
+    trace_pending = nullptr;
+}
+
+
+void ExecutionEngine::reset_trace()
+{
+    if (trace_header != nullptr)
+        trace_header->count = 0;
+    trace_pending = nullptr;
+}
+
+
+void ExecutionEngine::close_trace()
+{
+    if (trace_header == nullptr)
+        return;
+    trace_done();
+    munmap(trace_header, sizeof(trace_header_t) + (trace_mask + 1) * sizeof(trace_record_t));
+    trace_header = nullptr;
+    trace_ring = nullptr;
+}
+
+
+void ExecutionEngine::trace_instr(uint32_t pc)
+{
+    // [instruction_t][reg_imm_t]
+    static const uint8_t instr_size[][2] = {
+        { 0, 0 },
+        { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 },
+        { 2, 2 }, { 2, 6 }, { 2, 2 }, { 2, 2 }, { 5, 5 }, { 1, 1 },
+        { 5, 5 }, { 5, 5 }, { 5, 5 }, { 5, 5 }, { 5, 5 }, { 5, 5 }, { 5, 5 }, { 5, 5 }, { 5, 5 },
+        { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 },
+        { 3, 3 }, { 3, 3 },
+        { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 }, { 2, 6 },
+    };
+
+    trace_done();
+    trace_record_t* r = &trace_ring[trace_header->count++ & trace_mask];
+    uint8_t op = instr(mem[pc]);
+    uint8_t size = op < sizeof instr_size / sizeof instr_size[0] ? instr_size[op][reg_imm(mem[pc])] : 1;
+    r->pc = pc;
+    std::memcpy(r->code, &mem[pc], size);
+    std::memset(r->code + size, 0, sizeof r->code - size);
+    switch (op) {
+    case LOAD: case MOV: case ADD: case SUB: case AND: case OR: case XOR: case NOT: case POP:
+    case MUL: case DIV: case SDIV: case MOD: case SMOD: case SHL: case SHR: case SAR: case LOADX:
+    case LOADB: case LOADSB: case LOADH: case LOADSH:
+        r->reg = reg_dst(mem[pc + 1]);
+        break;
+    case CMP:
+        r->reg = FLAGS;
+        break;
+    case PUSH: case CALL: case RET:
+        r->reg = SP;
+        break;
+    default:
+        r->reg = NO_REG;
+        break;
+    }
+    r->unused = 0;
+    r->val = 0;
+    trace_pending = r;
+}
@@ -1,33 +1,344 @@
+#include <algorithm>
 #include <cstddef>
 #include <cstdlib>
 #include <memory>
+#include <string>
+#include <vector>
 
 #include "vm.h"
 #include "exe.h"
 
 
+struct vm_s {
+    std::unique_ptr<ExecutionEngine> engine;
+    bool loaded;
+};
+
+
 static size_t adjust_ram_size_mb(size_t ram_size_mb);
 static ExecutionEngine* create_execution_engine(
-    const void* prog, size_t prog_size, size_t ram_size_mb, exec_type_t exec_type, bool debug);
+    size_t ram_size_mb, bool sparse_mem, exec_type_t exec_type, bool debug, const char* native_lib);
+static ExecutionEngine* loaded_engine(const vm_t* vm);
 
 
 extern "C"
-void vm_run(
+vm_status_t vm_run(
     const void* prog,
     size_t prog_size,
     size_t ram_size_mb,
+    bool sparse_mem,
     exec_type_t exec_type,
-    bool debug
+    bool debug,
+    const char* native_lib,
+    uint64_t max_instrs,
+    uint64_t timeout_ms,
+    uint32_t* regs
 )
 {
-    std::unique_ptr<ExecutionEngine>(
+    std::unique_ptr<ExecutionEngine> engine(
         create_execution_engine(
-            prog,
-            prog_size,
             adjust_ram_size_mb(ram_size_mb),
+            sparse_mem,
             exec_type,
-            debug
-    ))->execute();
+            debug,
+            native_lib
+    ));
+    engine->set_limits(max_instrs, timeout_ms);
+    vm_status_t status = static_cast<vm_status_t>(engine->execute(prog, prog_size));
+    if (regs != nullptr)
+        for (uint32_t r = 0; r < ExecutionEngine::NUM_REGS; r++)
+            regs[r] = engine->get_reg(r);
+    return status;
+}
+
+
+extern "C"
+bool vm_snapshot(
+    const void* prog,
+    size_t prog_size,
+    size_t ram_size_mb,
+    bool sparse_mem,
+    exec_type_t exec_type,
+    bool debug,
+    const char* native_lib,
+    const char* snapshot
+)
+{
+    std::unique_ptr<ExecutionEngine> engine(
+        create_execution_engine(
+            adjust_ram_size_mb(ram_size_mb),
+            sparse_mem,
+            exec_type,
+            debug,
+            native_lib
+    ));
+    engine->set_snapshot_out(snapshot);
+    engine->execute(prog, prog_size);
+    return engine->is_snapshot_saved();
+}
+
+
+extern "C"
+void vm_restore(
+    const void* prog,
+    size_t prog_size,
+    exec_type_t exec_type,
+    bool debug,
+    const char* native_lib,
+    const char* snapshot
+)
+{
+    // The memory configuration is taken from the snapshot.
+    std::unique_ptr<ExecutionEngine> engine(
+        create_execution_engine(
+            adjust_ram_size_mb(0),
+            false,
+            exec_type,
+            debug,
+            native_lib
+    ));
+    engine->set_restore_from(snapshot);
+    engine->execute(prog, prog_size);
+}
+
+
+extern "C"
+vm_t* vm_create(
+    size_t ram_size_mb,
+    bool sparse_mem,
+    exec_type_t exec_type,
+    bool debug,
+    const char* native_lib
+)
+{
+    return new vm_t {
+        std::unique_ptr<ExecutionEngine>(
+            create_execution_engine(
+                adjust_ram_size_mb(ram_size_mb),
+                sparse_mem,
+                exec_type,
+                debug,
+                native_lib
+        )),
+        false
+    };
+}
+
+
+extern "C"
+void vm_load(vm_t* vm, const void* prog, size_t prog_size)
+{
+    vm->engine->load(prog, prog_size);
+    vm->loaded = true;
+}
+
+
+extern "C"
+void vm_load_file(vm_t* vm, const char* path)
+{
+    vm->engine->load_image(path);
+    vm->loaded = true;
+}
+
+
+extern "C"
+vm_status_t vm_exec(vm_t* vm)
+{
+    return static_cast<vm_status_t>(loaded_engine(vm)->run());
+}
+
+
+extern "C"
+uint64_t vm_step(vm_t* vm, uint64_t count)
+{
+    return loaded_engine(vm)->run_for(count);
+}
+
+
+extern "C"
+void vm_set_limits(vm_t* vm, uint64_t max_instrs, uint64_t timeout_ms)
+{
+    vm->engine->set_limits(max_instrs, timeout_ms);
+}
+
+
+extern "C"
+vm_status_t vm_status(const vm_t* vm)
+{
+    return static_cast<vm_status_t>(loaded_engine(vm)->get_status());
+}
+
+
+extern "C"
+uint64_t vm_retired(const vm_t* vm)
+{
+    return loaded_engine(vm)->get_retired();
+}
+
+
+extern "C"
+uint32_t vm_get_reg(const vm_t* vm, uint32_t reg)
+{
+    if (reg >= ExecutionEngine::NUM_REGS)
+        std::abort();
+    return loaded_engine(vm)->get_reg(reg);
+}
+
+
+extern "C"
+void vm_set_reg(vm_t* vm, uint32_t reg, uint32_t val)
+{
+    if (reg >= ExecutionEngine::NUM_REGS)
+        std::abort();
+    loaded_engine(vm)->set_reg(reg, val);
+}
+
+
+extern "C"
+uint8_t* vm_memory(vm_t* vm, size_t* size)
+{
+    ExecutionEngine* engine = loaded_engine(vm);
+    *size = engine->get_mem_size();
+    return engine->get_mem();
+}
+
+
+extern "C"
+uint32_t* vm_registers(vm_t* vm)
+{
+    return loaded_engine(vm)->get_regs();
+}
+
+
+extern "C"
+void vm_set_output(vm_t* vm, output_type_t output_type, int fd)
+{
+    switch (output_type) {
+    case OUTPUT_STDOUT:
+        vm->engine->set_output_stdout();
+        break;
+    case OUTPUT_BUFFER:
+        vm->engine->set_output_buffer();
+        break;
+    case OUTPUT_FD:
+        vm->engine->set_output_fd(fd);
+        break;
+    default:
+        std::abort();
+    }
+}
+
+
+extern "C"
+size_t vm_output(const vm_t* vm, char* buf, size_t size)
+{
+    std::string output = vm->engine->output();
+    output.copy(buf, std::min(size, output.size()));
+    return output.size();
+}
+
+
+extern "C"
+void vm_set_input_fd(vm_t* vm, int fd)
+{
+    vm->engine->set_input_fd(fd);
+}
+
+
+extern "C"
+void vm_set_input(vm_t* vm, const void* data, size_t size)
+{
+    vm->engine->set_input(data, size);
+}
+
+
+extern "C"
+void vm_set_profiling(vm_t* vm, bool profiling)
+{
+    vm->engine->set_profiling(profiling);
+}
+
+
+extern "C"
+size_t vm_profile_pcs(const vm_t* vm, vm_pc_profile_t* buf, size_t size)
+{
+    std::vector<std::pair<uint32_t, uint64_t>> pcs = vm->engine->get_profile_pcs();
+    for (size_t i = 0; i < std::min(size, pcs.size()); i++)
+        buf[i] = {pcs[i].first, pcs[i].second};
+    return pcs.size();
+}
+
+
+extern "C"
+size_t vm_profile_calls(const vm_t* vm, vm_call_profile_t* buf, size_t size)
+{
+    const std::vector<ExecutionEngine::call_node_t>& calls = vm->engine->get_profile_calls();
+    for (size_t i = 0; i < std::min(size, calls.size()); i++)
+        buf[i] = {calls[i].func, calls[i].caller, calls[i].calls, calls[i].instrs};
+    return calls.size();
+}
+
+
+extern "C"
+void vm_set_trace(vm_t* vm, const char* path, uint64_t size)
+{
+    vm->engine->set_trace(path, size);
+}
+
+
+extern "C"
+void vm_set_coverage(vm_t* vm, uint8_t* bitmap, size_t size)
+{
+    vm->engine->set_coverage(bitmap, size);
+}
+
+
+extern "C"
+bool vm_fork_server(vm_t* vm, const char* input)
+{
+    return loaded_engine(vm)->serve_forks(input);
+}
+
+
+extern "C"
+void vm_set_snapshot_out(vm_t* vm, const char* snapshot)
+{
+    vm->engine->set_snapshot_out(snapshot);
+}
+
+
+extern "C"
+bool vm_snapshot_saved(const vm_t* vm)
+{
+    return vm->engine->is_snapshot_saved();
+}
+
+
+extern "C"
+void vm_set_restore_from(vm_t* vm, const char* snapshot)
+{
+    vm->engine->set_restore_from(snapshot);
+}
+
+
+extern "C"
+void vm_map_file(vm_t* vm, const char* path, uint32_t addr, bool writable)
+{
+    vm->engine->map_file(path, addr, writable);
+}
+
+
+extern "C"
+void vm_reset(vm_t* vm)
+{
+    loaded_engine(vm)->reset();
+}
+
+
+extern "C"
+void vm_destroy(vm_t* vm)
+{
+    delete vm;
 }
 
 
@@ -41,12 +352,27 @@ static size_t adjust_ram_size_mb(size_t ram_size_mb)
 
 
 static ExecutionEngine* create_execution_engine(
-    const void* prog, size_t prog_size, size_t ram_size_mb, exec_type_t exec_type, bool debug)
+    size_t ram_size_mb, bool sparse_mem, exec_type_t exec_type, bool debug, const char* native_lib)
 {
     switch (exec_type) {
     case INTERPRETER:
-        return new Interpreter(prog, prog_size, ram_size_mb, debug);
+        return new Interpreter(ram_size_mb, sparse_mem, debug);
+    case PREDECODER:
+        return new PreDecoder(ram_size_mb, sparse_mem, debug);
+    case JIT:
+        return new JITCompiler(ram_size_mb, sparse_mem, debug);
+    case AOT:
+        return new AOTExecutor(ram_size_mb, sparse_mem, debug, native_lib);
     default:
         std::abort();
     }
 }
+
+
+static ExecutionEngine* loaded_engine(const vm_t* vm)
+{
+    // Nothing to run, or look at, before a program is loaded.
+    if (!vm->loaded)
+        std::abort();
+    return vm->engine.get();
+}
@@ -2,18 +2,208 @@
 
 
 #include <cstddef>
+#include <cstdint>
 
 
 typedef enum {
-    INTERPRETER = 1
+    INTERPRETER = 1,
+    PREDECODER  = 2,
+    JIT         = 3,
+    AOT         = 4
 } exec_type_t;
 
+typedef enum {
+    OUTPUT_STDOUT   = 1,
+    OUTPUT_BUFFER   = 2,
+    OUTPUT_FD       = 3
+} output_type_t;
+
+typedef enum {
+    VM_RUNNING          = 0,
+    VM_EXITED           = 1,
+    VM_CHECKPOINT       = 2,
+    VM_OUT_OF_FUEL      = 3,
+    VM_TIMED_OUT        = 4,
+    VM_DIVIDE_BY_ZERO   = 5
+} vm_status_t;
+
+typedef struct {
+    uint32_t addr;
+    uint64_t instrs;
+} vm_pc_profile_t;
+
+// One per distinct call stack; the first one stands for the entry point and is its own caller.
+typedef struct {
+    uint32_t func;
+    uint32_t caller;
+    uint64_t calls;
+    uint64_t instrs;
+} vm_call_profile_t;
+
+typedef struct vm_s vm_t;
+
+
+// Stops after about max_instrs instructions or timeout_ms milliseconds, 0 for no limit; the registers
+// are copied to regs, if given, on the way out.
+extern "C"
+vm_status_t vm_run(
+    const void* prog,
+    size_t prog_size,
+    size_t ram_size_mb,
+    bool sparse_mem,
+    exec_type_t exec_type,
+    bool debug,
+    const char* native_lib,
+    uint64_t max_instrs,
+    uint64_t timeout_ms,
+    uint32_t* regs
+);
+
+extern "C"
+bool vm_snapshot(
+    const void* prog,
+    size_t prog_size,
+    size_t ram_size_mb,
+    bool sparse_mem,
+    exec_type_t exec_type,
+    bool debug,
+    const char* native_lib,
+    const char* snapshot
+);
 
 extern "C"
-void vm_run(
+void vm_restore(
     const void* prog,
     size_t prog_size,
+    exec_type_t exec_type,
+    bool debug,
+    const char* native_lib,
+    const char* snapshot
+);
+
+
+// A VM to run programs on, one after another; memory and the engine are set up once.
+extern "C"
+vm_t* vm_create(
     size_t ram_size_mb,
+    bool sparse_mem,
     exec_type_t exec_type,
-    bool debug
+    bool debug,
+    const char* native_lib
 );
+
+// (Re)starts the VM with a copy of the given program.
+extern "C"
+void vm_load(vm_t* vm, const void* prog, size_t prog_size);
+
+// (Re)starts the VM with the program in the given image file, as written by asm.py; the file is mapped,
+// not read, and left alone once loaded.
+extern "C"
+void vm_load_file(vm_t* vm, const char* path);
+
+// Runs the program until it exits, stops at a checkpoint or hits a limit.
+extern "C"
+vm_status_t vm_exec(vm_t* vm);
+
+// Runs at most count instructions; returns how many ran, fewer than count once the program exits.
+extern "C"
+uint64_t vm_step(vm_t* vm, uint64_t count);
+
+// Limits each run to about max_instrs instructions and timeout_ms milliseconds; 0 for no limit.
+// Both are checked on backward jumps, calls and returns only.
+extern "C"
+void vm_set_limits(vm_t* vm, uint64_t max_instrs, uint64_t timeout_ms);
+
+// Why the last run stopped; VM_RUNNING if it can go on.
+extern "C"
+vm_status_t vm_status(const vm_t* vm);
+
+// Instructions retired since the last load or reset.
+extern "C"
+uint64_t vm_retired(const vm_t* vm);
+
+extern "C"
+uint32_t vm_get_reg(const vm_t* vm, uint32_t reg);
+
+extern "C"
+void vm_set_reg(vm_t* vm, uint32_t reg, uint32_t val);
+
+// Guest memory, in place, its size stored to size; valid until the VM is destroyed or, when restoring
+// from a snapshot, reset. Writes to the text are not seen by code already decoded or compiled.
+extern "C"
+uint8_t* vm_memory(vm_t* vm, size_t* size);
+
+// The registers, in place, NUM_REGS of them in register order; valid until the VM is destroyed.
+extern "C"
+uint32_t* vm_registers(vm_t* vm);
+
+// Where the output goes: stdout (the default), a buffer kept per run, from the last load or reset on,
+// or the given file descriptor, written to in large batches; fd is only used by OUTPUT_FD.
+extern "C"
+void vm_set_output(vm_t* vm, output_type_t output_type, int fd);
+
+// Copies at most size bytes of the buffered output to buf; returns the size of the whole output.
+extern "C"
+size_t vm_output(const vm_t* vm, char* buf, size_t size);
+
+// Reads the input from the given file descriptor; stdin by default.
+extern "C"
+void vm_set_input_fd(vm_t* vm, int fd);
+
+// Reads the input from a copy of the given data, from the start again on every load or reset.
+extern "C"
+void vm_set_input(vm_t* vm, const void* data, size_t size);
+
+// Counts the instructions retired per address and per call stack, from the last load or reset on,
+// starting over now; the interpreter has a loop of its own for it, other engines single-step.
+extern "C"
+void vm_set_profiling(vm_t* vm, bool profiling);
+
+// Copies at most size per address counts, nonzero ones only, to buf; returns how many there are.
+extern "C"
+size_t vm_profile_pcs(const vm_t* vm, vm_pc_profile_t* buf, size_t size);
+
+// Copies at most size per call stack counts to buf; returns how many there are.
+extern "C"
+size_t vm_profile_calls(const vm_t* vm, vm_call_profile_t* buf, size_t size);
+
+// Keeps a record of the last size instructions run, at least, in a ring in the given file, from the
+// last load or reset on; the file holds them even if the VM aborts. NULL to stop tracing.
+extern "C"
+void vm_set_trace(vm_t* vm, const char* path, uint64_t size);
+
+// Counts the edges taken, AFL style, in the given bitmap of size bytes, a power of 2, from the next run
+// on; NULL to stop. Engines other than the interpreter single-step while at it.
+extern "C"
+void vm_set_coverage(vm_t* vm, uint8_t* bitmap, size_t size);
+
+// Serves AFL's fork server with the program loaded, forking a run of it per input, read from the file
+// at input or, if NULL, from the input set up; coverage goes to AFL's bitmap. Returns once the fuzzer
+// is done, or right away, with false, when not run by one.
+extern "C"
+bool vm_fork_server(vm_t* vm, const char* input);
+
+// Stops at the first checkpoint and saves the VM state to the given file; NULL to run on.
+extern "C"
+void vm_set_snapshot_out(vm_t* vm, const char* snapshot);
+
+// Whether the last run stopped at a checkpoint and saved the VM state.
+extern "C"
+bool vm_snapshot_saved(const vm_t* vm);
+
+// Starts from the VM state saved in the given file on every load or reset; NULL to start from scratch.
+// Takes effect on the next load; the memory configuration is taken from the snapshot.
+extern "C"
+void vm_set_restore_from(vm_t* vm, const char* snapshot);
+
+// Maps the given file at addr, page aligned and in the heap, read-only or, if writable, copy-on-write,
+// on every load or reset from the next one on; the file itself is never written. NULL to map none.
+extern "C"
+void vm_map_file(vm_t* vm, const char* path, uint32_t addr, bool writable);
+
+// Starts over with the program loaded last.
+extern "C"
+void vm_reset(vm_t* vm);
+
+extern "C"
+void vm_destroy(vm_t* vm);
@@ -0,0 +1,205 @@
+#pragma once
+
+
+#include <cstddef>
+#include <cstdint>
+#include <cstring>
+
+
+class X64Emitter {
+public:
+    typedef enum : uint8_t {
+        RAX     =  0,
+        RCX     =  1,
+        RDX     =  2,
+        RBX     =  3,
+        RSP     =  4,
+        RBP     =  5,
+        RSI     =  6,
+        RDI     =  7,
+        R8      =  8,
+        R9      =  9,
+        R10     = 10,
+        R11     = 11,
+        R12     = 12,
+        R13     = 13,
+        R14     = 14,
+        R15     = 15
+    } reg_t;
+
+    typedef enum : uint8_t {
+        CC_B    = 0x2,
+        CC_AE   = 0x3,
+        CC_Z    = 0x4,
+        CC_NZ   = 0x5,
+        CC_BE   = 0x6,
+        CC_A    = 0x7,
+        CC_LE   = 0xe
+    } cond_t;
+
+    typedef enum : uint8_t {
+        ADD     = 0,
+        OR      = 1,
+        AND     = 4,
+        SUB     = 5,
+        XOR     = 6,
+        CMP     = 7
+    } alu_t;
+
+    typedef enum : uint8_t {
+        SHL     = 4,
+        SHR     = 5,
+        SAR     = 7
+    } shift_t;
+
+    X64Emitter(uint8_t* start, uint8_t* end) : cur(start), end(end) {}
+
+    uint8_t* pos() const { return cur; }
+    bool full() const { return cur > end; }
+
+    // mov dst32, src32
+    void mov_rr(reg_t dst, reg_t src)                   { op_rr(0x89, src, dst); }
+    // mov dst, src
+    void mov_rr64(reg_t dst, reg_t src)                 { rex(true, src, 0, dst); byte(0x89); modrm(3, src, dst); }
+    // mov dst32, imm32
+    void mov_ri(reg_t dst, uint32_t imm)                { rex(false, 0, 0, dst); byte(0xb8 + (dst & 7)); imm32(imm); }
+    // mov dst32, [base + disp8]
+    void load_disp(reg_t dst, reg_t base, int8_t disp)  { op_disp(0x8b, dst, base, disp); }
+    // mov [base + disp8], src32
+    void store_disp(reg_t base, int8_t disp, reg_t src) { op_disp(0x89, src, base, disp); }
+    // mov dword [base + disp8], imm32
+    void store_disp_imm(reg_t base, int8_t disp, uint32_t imm) { op_disp(0xc7, 0, base, disp); imm32(imm); }
+    // mov dst32, [base + index]
+    void load_idx(reg_t dst, reg_t base, reg_t index)   { op_idx(0x8b, dst, base, index); }
+    // mov [base + index], src32
+    void store_idx(reg_t base, reg_t index, reg_t src)  { op_idx(0x89, src, base, index); }
+    // mov dword [base + index], imm32
+    void store_idx_imm(reg_t base, reg_t index, uint32_t imm) { op_idx(0xc7, 0, base, index); imm32(imm); }
+    // movzx dst32, byte [base + index]
+    void load8_idx(reg_t dst, reg_t base, reg_t index)  { op_idx(0xb6, dst, base, index, ESCAPE); }
+    // movsx dst32, byte [base + index]
+    void load8s_idx(reg_t dst, reg_t base, reg_t index) { op_idx(0xbe, dst, base, index, ESCAPE); }
+    // movzx dst32, word [base + index]
+    void load16_idx(reg_t dst, reg_t base, reg_t index) { op_idx(0xb7, dst, base, index, ESCAPE); }
+    // movsx dst32, word [base + index]
+    void load16s_idx(reg_t dst, reg_t base, reg_t index) { op_idx(0xbf, dst, base, index, ESCAPE); }
+    // mov [base + index], src8
+    void store8_idx(reg_t base, reg_t index, reg_t src) { op_idx(0x88, src, base, index, BYTE_REG); }
+    // mov [base + index], src16
+    void store16_idx(reg_t base, reg_t index, reg_t src) { byte(0x66); op_idx(0x89, src, base, index); }
+    // <op> dst32, src32
+    void alu_rr(alu_t op, reg_t dst, reg_t src)         { op_rr((op << 3) | 0x01, src, dst); }
+    // <op> dst32, imm32
+    void alu_ri(alu_t op, reg_t dst, uint32_t imm)      { op_rr(0x81, op, dst); imm32(imm); }
+    // <op> qword [base + disp32], imm32
+    void alu_mi64(alu_t op, reg_t base, int32_t disp, uint32_t imm) {
+        rex(true, 0, 0, base);
+        byte(0x81);
+        modrm(2, op, base);
+        if ((base & 7) == RSP)
+            byte(0x24);
+        imm32(disp);
+        imm32(imm);
+    }
+    // not dst32
+    void not_r(reg_t dst)                               { op_rr(0xf7, 2, dst); }
+    // neg dst32
+    void neg_r(reg_t dst)                               { op_rr(0xf7, 3, dst); }
+    // imul dst32, src32
+    void imul_rr(reg_t dst, reg_t src)                  { rex(false, dst, 0, src); byte(0x0f); byte(0xaf); modrm(3, dst, src); }
+    // imul dst32, dst32, imm32
+    void imul_ri(reg_t dst, uint32_t imm)               { op_rr(0x69, dst, dst); imm32(imm); }
+    // div src32; unsigned EDX:EAX / src32, quotient in EAX, remainder in EDX
+    void div_r(reg_t src)                               { op_rr(0xf7, 6, src); }
+    // idiv src32; signed EDX:EAX / src32, quotient in EAX, remainder in EDX
+    void idiv_r(reg_t src)                              { op_rr(0xf7, 7, src); }
+    // cdq; sign extends EAX into EDX
+    void cdq()                                          { byte(0x99); }
+    // <op> dst32, imm8
+    void shift_ri(shift_t op, reg_t dst, uint8_t imm)   { op_rr(0xc1, op, dst); byte(imm); }
+    // <op> dst32, cl
+    void shift_cl(shift_t op, reg_t dst)                { op_rr(0xd3, op, dst); }
+    // test dst32, src32
+    void test_rr(reg_t dst, reg_t src)                  { op_rr(0x85, src, dst); }
+    // test dst32, imm32
+    void test_ri(reg_t dst, uint32_t imm)               { op_rr(0xf7, 0, dst); imm32(imm); }
+    // cmov<cc> dst32, src32
+    void cmov(cond_t cc, reg_t dst, reg_t src)          { rex(false, dst, 0, src); byte(0x0f); byte(0x40 | cc); modrm(3, dst, src); }
+    // lea dst32, [base + disp8]
+    void lea_disp(reg_t dst, reg_t base, int8_t disp)   { op_disp(0x8d, dst, base, disp); }
+    // lea dst, [rip]; i.e. the address of the next instruction
+    void lea_rip(reg_t dst)                             { rex(true, dst, 0, 0); byte(0x8d); modrm(0, dst, 5); imm32(0); }
+    // j<cc> rel32; returns the location of rel32
+    uint8_t* jcc(cond_t cc)                             { byte(0x0f); byte(0x80 | cc); return rel32(); }
+    // jmp rel32; returns the location of rel32
+    uint8_t* jmp()                                      { byte(0xe9); return rel32(); }
+    // jmp dst
+    void jmp_r(reg_t dst)                               { rex(false, 0, 0, dst); byte(0xff); modrm(3, 4, dst); }
+    void push(reg_t src)                                { rex(false, 0, 0, src); byte(0x50 + (src & 7)); }
+    void pop(reg_t dst)                                 { rex(false, 0, 0, dst); byte(0x58 + (dst & 7)); }
+    void ret()                                          { byte(0xc3); }
+
+    static void patch(uint8_t* rel32, const uint8_t* target) {
+        int32_t disp = static_cast<int32_t>(target - (rel32 + 4));
+        std::memcpy(rel32, &disp, sizeof disp);
+    }
+
+private:
+    // op_idx() flags
+    static const uint8_t ESCAPE     = 0x01;     // two byte opcode, 0x0f <op>
+    static const uint8_t BYTE_REG   = 0x02;     // reg is a byte register
+
+    uint8_t* cur;
+    uint8_t* const end;
+
+    void byte(uint8_t b) {
+        if (cur < end)
+            *cur = b;
+        cur++;
+    }
+    void imm32(uint32_t imm) {
+        for (int i = 0; i < 4; i++)
+            byte(imm >> (8 * i));
+    }
+    uint8_t* rel32() {
+        uint8_t* at = cur;
+        imm32(0);
+        return at;
+    }
+    // force: a bare REX prefix, which makes the byte registers 4 to 7 SPL, BPL, SIL and DIL instead of AH to BH
+    void rex(bool w, uint8_t r, uint8_t x, uint8_t b, bool force = false) {
+        uint8_t prefix = 0x40 | (w << 3) | ((r >> 3) << 2) | ((x >> 3) << 1) | (b >> 3);
+        if (prefix != 0x40 || force)
+            byte(prefix);
+    }
+    void modrm(uint8_t mod, uint8_t reg, uint8_t rm) {
+        byte((mod << 6) | ((reg & 7) << 3) | (rm & 7));
+    }
+    void op_rr(uint8_t op, uint8_t reg, uint8_t rm) {
+        rex(false, reg, 0, rm);
+        byte(op);
+        modrm(3, reg, rm);
+    }
+    void op_disp(uint8_t op, uint8_t reg, reg_t base, int8_t disp) {
+        rex(false, reg, 0, base);
+        byte(op);
+        modrm(1, reg, base);
+        if ((base & 7) == RSP)
+            byte(0x24);
+        byte(disp);
+    }
+    void op_idx(uint8_t op, uint8_t reg, reg_t base, reg_t index, uint8_t flags = 0) {
+        rex(false, reg, index, base, (flags & BYTE_REG) && reg >= RSP);
+        if (flags & ESCAPE)
+            byte(0x0f);
+        byte(op);
+        if ((base & 7) == RBP) {
+            modrm(1, reg, RSP);
+            byte(((index & 7) << 3) | (base & 7));
+            byte(0);
+        } else {
+            modrm(0, reg, RSP);
+            byte(((index & 7) << 3) | (base & 7));
+        }
+    }
+};